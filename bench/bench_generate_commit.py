@@ -0,0 +1,474 @@
+'''
+Benchmark of submarine commit generation.
+
+Measures, for every dappData size and worker count, the commits per second of
+generateCommitAddressBytes() on a pool of worker processes and the latency
+percentiles of single commits, and breaks the cost of a commit down by stage:
+
+    witnessRng      32 byte witness from the entropy pool
+    keccakCommit    Keccak256(A | C | value | dappData | w | gasPrice | gasLimit)
+    rsDerivation    R = Keccak256(commit | 1), S = Keccak256(commit | 0)
+    recovery        hash of the unsigned unlock tx and recovery of address B
+    rlpEncoding     RLP encoding of the signed unlock tx
+
+A commit costs attemptsPerCommit times the first three stages, plus the last
+two roughly once (candidates rejected for an out of range R/S never get to
+recovery).
+
+The results are written as JSON. With --baseline they are compared against a
+stored run, and regressions beyond --tolerance are reported. No baseline is
+checked in: record one on the reference machine, a multi-core machine running
+the CI interpreter, and keep it there. A --baseline file that does not exist
+skips the comparison.
+
+    $ python3 bench/bench_generate_commit.py --output results.json
+    $ python3 bench/bench_generate_commit.py --baseline bench/baseline.json --fail-on-regression
+    $ python3 bench/bench_generate_commit.py --save-baseline bench/baseline.json
+
+Numbers only compare meaningfully on the same machine and interpreter, see
+"meta" in the results. Differences in meta and runs missing from either side
+are reported next to the comparison.
+'''
+
+import argparse
+import datetime
+import gc
+import json
+import math
+import os
+import platform
+import sys
+import time
+
+sys.path.append(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "..",
+                 "generate_commitment"))
+
+from commit_hasher import CommitHasher, deriveRS
+from entropy_pool import randomWitness
+from unlock_recovery import recoverAddress
+from unlock_template import cachedTemplate
+import generate_submarine_commit
+import keccak
+import unlock_recovery
+
+FROM_ADDRESS = bytes.fromhex("4a6ab22a54bbf4e0aab4d9b4a1e0cae2ae5a2bf4")
+TO_ADDRESS = bytes.fromhex("7aeb1fd3a42731c4ae80870044c992eb689fb2fe")
+SEND_AMOUNT = 1000000000000000000
+GAS_PRICE = 50000000000
+GAS_LIMIT = 3712394
+
+DEFAULT_DAPP_DATA_SIZES = [0, 32, 256, 1024]
+DEFAULT_COMMITS = 2000
+DEFAULT_STAGE_ROUNDS = 2000
+DEFAULT_REPEAT = 5
+DEFAULT_TOLERANCE = 0.2
+STAGES = [
+    "witnessRng", "keccakCommit", "rsDerivation", "recovery", "rlpEncoding"
+]
+PERCENTILES = [50, 90, 99, 100]
+# Meta keys that make two runs incomparable when they differ
+COMPARED_META = [
+    "python", "machine", "cpus", "keccakBackend", "keccakMode",
+    "secp256k1Backend"
+]
+
+
+def _percentile(sortedValues, percent):
+    '''
+    Nearest rank percentile of an already sorted list, see commit_server.py
+    '''
+    if not sortedValues:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sortedValues)))
+    return sortedValues[max(rank, 1) - 1]
+
+
+def _perCall(function, inputs, repeat):
+    '''
+    Like timeit, the garbage collector is off and the fastest of repeat passes
+    is kept, the slower ones only measure interference.
+
+    :return: seconds per call of function over inputs
+    '''
+    best = None
+    gcEnabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            for item in inputs:
+                function(item)
+            seconds = time.perf_counter() - started
+            best = seconds if best is None else min(best, seconds)
+    finally:
+        if gcEnabled:
+            gc.enable()
+    return best / len(inputs)
+
+
+def benchmarkStages(dappDataSize,
+                    rounds=DEFAULT_STAGE_ROUNDS,
+                    repeat=DEFAULT_REPEAT):
+    '''
+    Times every stage of a commit separately, on the same inputs as a real
+    generation run.
+
+    :param dappDataSize: dappData length in bytes
+    :param rounds: calls per stage and pass
+    :param repeat: number of passes, the fastest is kept
+    :return: dict stage -> microseconds per call
+    '''
+    dappData = b'\x42' * dappDataSize
+    hasher = CommitHasher(FROM_ADDRESS, TO_ADDRESS, SEND_AMOUNT, dappData,
+                          GAS_PRICE, GAS_LIMIT)
+    template = cachedTemplate(GAS_PRICE, GAS_LIMIT, TO_ADDRESS, SEND_AMOUNT)
+
+    witnesses = [randomWitness() for _ in range(rounds)]
+    commits = [hasher.commit(w) for w in witnesses]
+    signatures = [(commit, ) + deriveRS(commit) for commit in commits]
+    # Recovery and encoding only ever see candidates with R & S in range
+    signatures = [(commit, R, S) for commit, R, S in signatures
+                  if (0 < R < generate_submarine_commit.secp256k1n) and
+                  (0 < S < generate_submarine_commit.secp256k1n / 2)]
+
+    seconds = {
+        "witnessRng":
+        _perCall(lambda _: randomWitness(), range(rounds), repeat),
+        "keccakCommit":
+        _perCall(hasher.commit, witnesses, repeat),
+        "rsDerivation":
+        _perCall(deriveRS, commits, repeat),
+        "recovery":
+        _perCall(
+            lambda s: recoverAddress(template.unsignedHash(s[0]), 27, s[1], s[2]),
+            signatures, repeat),
+        "rlpEncoding":
+        _perCall(lambda s: template.signed(*s), signatures, repeat),
+    }
+    return {stage: seconds[stage] * 1e6 for stage in STAGES}
+
+
+def _timedCommit(request):
+    '''
+    Internal function. Runs in the worker processes, returns the seconds a
+    single generateCommitAddressBytes call took.
+    '''
+    started = time.perf_counter()
+    generate_submarine_commit.generateCommitAddressBytes(*request)
+    return time.perf_counter() - started
+
+
+def benchmarkGeneration(dappDataSize,
+                        workers,
+                        commits=DEFAULT_COMMITS,
+                        repeat=DEFAULT_REPEAT):
+    '''
+    :param dappDataSize: dappData length in bytes
+    :param workers: number of worker processes
+    :param commits: number of commits to generate per pass
+    :param repeat: number of passes, the fastest is kept
+    :return: dict with commits, seconds, commitsPerSecond and latencyMs
+             percentiles over the commits of all passes
+    '''
+    request = (FROM_ADDRESS, TO_ADDRESS, SEND_AMOUNT, b'\x42' * dappDataSize,
+               GAS_PRICE, GAS_LIMIT)
+    seconds = None
+    latencies = []
+    for _ in range(repeat):
+        # Wall time includes starting the worker processes, like a real batch
+        started = time.perf_counter()
+        latencies += generate_submarine_commit.mapRequests(
+            _timedCommit, [request] * commits, workers)
+        elapsed = time.perf_counter() - started
+        seconds = elapsed if seconds is None else min(seconds, elapsed)
+    latencies.sort()
+    return {
+        "dappDataSize": dappDataSize,
+        "workers": workers,
+        "commits": commits,
+        "seconds": seconds,
+        "commitsPerSecond": commits / seconds,
+        "latencyMs": {
+            "p{}".format(percent): _percentile(latencies, percent) * 1e3
+            for percent in PERCENTILES
+        },
+    }
+
+
+def runBenchmarks(dappDataSizes=DEFAULT_DAPP_DATA_SIZES,
+                  workerCounts=None,
+                  commits=DEFAULT_COMMITS,
+                  stageRounds=DEFAULT_STAGE_ROUNDS,
+                  repeat=DEFAULT_REPEAT):
+    '''
+    :param dappDataSizes: dappData lengths in bytes
+    :param workerCounts: worker process counts, defaults to 1 and the number of CPUs
+    :param commits: commits per generation run
+    :param stageRounds: calls per stage in the stage breakdown
+    :param repeat: passes per measurement, the fastest is kept
+    :return: results dict, see main()
+    '''
+    if workerCounts is None:
+        workerCounts = sorted({1, os.cpu_count() or 1})
+    generate_submarine_commit.quietLogging()
+
+    stages = {}
+    runs = []
+    for size in dappDataSizes:
+        stages[str(size)] = benchmarkStages(size, stageRounds, repeat)
+        for workers in workerCounts:
+            generate_submarine_commit.samplerStats.reset()
+            run = benchmarkGeneration(size, workers, commits, repeat)
+            if workers == 1:
+                # Workers keep their own counters
+                sampler = generate_submarine_commit.getSamplerStats()
+                run["attemptsPerCommit"] = (
+                    sampler["attempts"] / max(sampler["commits"], 1))
+            runs.append(run)
+            print(
+                "dappData {:5d} B, {:2d} workers: {:8.1f} commits/s, p50 {:.3f} ms, p99 {:.3f} ms"
+                .format(size, workers, run["commitsPerSecond"],
+                        run["latencyMs"]["p50"], run["latencyMs"]["p99"]),
+                file=sys.stderr)
+
+    return {
+        "meta": {
+            "date": datetime.datetime.utcnow().isoformat() + "Z",
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "machine": platform.machine(),
+            "cpus": os.cpu_count(),
+            "keccakBackend": keccak.getBackend().name,
+            "keccakMode": keccak.activeMode(),
+            "secp256k1Backend": unlock_recovery.activeBackend(),
+            "commits": commits,
+            "stageRounds": stageRounds,
+            "repeat": repeat,
+        },
+        "stagesUs": stages,
+        "runs": runs,
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    '''
+    Compares results against a baseline run. Throughput that dropped or stage
+    times that grew by more than tolerance are regressions. Entries missing
+    from either run are skipped, see notCompared().
+
+    :param tolerance: allowed relative change, 0.2 is 20%
+    :return: list of dicts with metric, baseline, current, change and regression
+    '''
+    comparison = []
+
+    def add(metric, old, new, higherIsBetter):
+        change = (new - old) / old if old else 0.0
+        regression = (-change if higherIsBetter else change) > tolerance
+        comparison.append({
+            "metric": metric,
+            "baseline": old,
+            "current": new,
+            "change": change,
+            "regression": regression,
+        })
+
+    for size, stages in sorted(results["stagesUs"].items(),
+                               key=lambda item: int(item[0])):
+        baseStages = baseline.get("stagesUs", {}).get(size, {})
+        for stage in STAGES:
+            if stage in stages and stage in baseStages:
+                add("stagesUs.{}.{}".format(size, stage), baseStages[stage],
+                    stages[stage], False)
+
+    baseRuns = {(run["dappDataSize"], run["workers"]): run
+                for run in baseline.get("runs", [])}
+    for run in results["runs"]:
+        baseRun = baseRuns.get((run["dappDataSize"], run["workers"]))
+        if baseRun is None:
+            continue
+        prefix = "runs.{}B.{}w.".format(run["dappDataSize"], run["workers"])
+        add(prefix + "commitsPerSecond", baseRun["commitsPerSecond"],
+            run["commitsPerSecond"], True)
+        add(prefix + "latencyMs.p99", baseRun["latencyMs"]["p99"],
+            run["latencyMs"]["p99"], False)
+    return comparison
+
+
+def notCompared(results, baseline):
+    '''
+    :return: list of the stage and run entries compare() skips, as
+             "<entry> missing from the baseline" or "<entry> missing from the results"
+    '''
+
+    def entries(run):
+        stages = [
+            "stagesUs.{}".format(size) for size in run.get("stagesUs", {})
+        ]
+        runs = [
+            "runs.{}B.{}w".format(entry["dappDataSize"], entry["workers"])
+            for entry in run.get("runs", [])
+        ]
+        return stages + runs
+
+    current, base = entries(results), entries(baseline)
+    return (["{} missing from the baseline".format(entry)
+             for entry in current if entry not in base] +
+            ["{} missing from the results".format(entry)
+             for entry in base if entry not in current])
+
+
+def metaDifferences(results, baseline):
+    '''
+    :return: dict meta key -> (baseline, current) for the COMPARED_META keys
+             that differ
+    '''
+    differences = {}
+    meta, baseMeta = results.get("meta", {}), baseline.get("meta", {})
+    for key in COMPARED_META:
+        current, base = meta.get(key), baseMeta.get(key)
+        if key == "python":
+            # Patch releases don't change the numbers
+            current = current and ".".join(current.split(".")[:2])
+            base = base and ".".join(base.split(".")[:2])
+        if current != base:
+            differences[key] = (base, current)
+    return differences
+
+
+def _get_args():
+    '''
+    Internal function. Creates an argparser for the main method to use.
+
+    :return: parser: argparse object for parsing program arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description="Benchmark of submarine commit generation",
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '-s',
+        '--dapp-data-sizes',
+        type=str,
+        default=",".join(str(size) for size in DEFAULT_DAPP_DATA_SIZES),
+        help="Optional comma separated dappData sizes in bytes. Default is {}".
+        format(",".join(str(size) for size in DEFAULT_DAPP_DATA_SIZES)))
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=str,
+        default=None,
+        help="Optional comma separated worker counts. Default is 1 and the number of CPUs")
+    parser.add_argument(
+        '-n',
+        '--commits',
+        type=int,
+        default=DEFAULT_COMMITS,
+        help="Optional number of commits per run. Default is {}".format(
+            DEFAULT_COMMITS))
+    parser.add_argument(
+        '-r',
+        '--stage-rounds',
+        type=int,
+        default=DEFAULT_STAGE_ROUNDS,
+        help="Optional calls per stage in the stage breakdown. Default is {}".
+        format(DEFAULT_STAGE_ROUNDS))
+    parser.add_argument(
+        '--repeat',
+        type=int,
+        default=DEFAULT_REPEAT,
+        help="Optional passes per measurement, the fastest is kept. Default is {}".
+        format(DEFAULT_REPEAT))
+    parser.add_argument(
+        '-o',
+        '--output',
+        type=str,
+        default=None,
+        help="Optional JSON file to write the results to. Default is stdout")
+    parser.add_argument(
+        '-b',
+        '--baseline',
+        type=str,
+        default=None,
+        help="Optional JSON results of an earlier run to compare against,\n"
+        "the comparison is skipped if the file does not exist")
+    parser.add_argument(
+        '--save-baseline',
+        type=str,
+        default=None,
+        help="Optional JSON file to store the results as the new baseline")
+    parser.add_argument(
+        '--tolerance',
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Optional relative change that counts as a regression. Default is {}".
+        format(DEFAULT_TOLERANCE))
+    parser.add_argument(
+        '--fail-on-regression',
+        action='store_true',
+        help="Exit with status 1 if any metric regressed against the baseline")
+    return parser.parse_args()
+
+
+def _parseList(value):
+    return [int(item) for item in value.split(",") if item.strip()]
+
+
+def main():
+    '''
+    Main method. Runs the benchmarks and writes the results as JSON:
+
+    meta: machine, python version and backends the numbers were taken with
+    stagesUs: {dappDataSize: {stage: microseconds per call}}
+    runs: list of {dappDataSize, workers, commits, seconds, commitsPerSecond, latencyMs}
+    comparison: see compare(), only with --baseline
+    notCompared: see notCompared(), only with --baseline
+    '''
+    args = _get_args()
+    workerCounts = _parseList(args.workers) if args.workers else None
+    results = runBenchmarks(
+        _parseList(args.dapp_data_sizes), workerCounts, args.commits,
+        args.stage_rounds, args.repeat)
+
+    regressions = []
+    if args.baseline and not os.path.exists(args.baseline):
+        print("WARNING: no baseline at {}, not compared".format(args.baseline),
+              file=sys.stderr)
+    elif args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        results["comparison"] = compare(results, baseline, args.tolerance)
+        results["notCompared"] = notCompared(results, baseline)
+        for key, (old, new) in sorted(
+                metaDifferences(results, baseline).items()):
+            print("WARNING: baseline {} is {}, this run {}".format(
+                key, old, new), file=sys.stderr)
+        for entry in results["notCompared"]:
+            print("WARNING: not compared, {}".format(entry), file=sys.stderr)
+        for entry in results["comparison"]:
+            print(
+                "{:45s} {:12.3f} -> {:12.3f} {:+7.1%}{}".format(
+                    entry["metric"], entry["baseline"], entry["current"],
+                    entry["change"], "  REGRESSION"
+                    if entry["regression"] else ""),
+                file=sys.stderr)
+        regressions = [e for e in results["comparison"] if e["regression"]]
+
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.save_baseline:
+        baseline = dict(results)
+        baseline.pop("comparison", None)
+        baseline.pop("notCompared", None)
+        with open(args.save_baseline, "w") as f:
+            f.write(json.dumps(baseline, indent=2, sort_keys=True) + "\n")
+
+    if regressions and args.fail_on_regression:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+'''
+Asyncio friendly commit generation.
+
+Generating a commit is CPU bound: the rejection sampler hashes and recovers
+until it finds a valid address B. Calling generateCommitAddress from a
+coroutine blocks the event loop for all of that time. AsyncCommitGenerator runs
+the generation on a managed thread or process pool instead, with a limit on the
+number of concurrent generations so a burst of requests cannot flood the pool.
+
+    generator = AsyncCommitGenerator(executor="process", maxWorkers=4,
+                                     maxConcurrency=16)
+    addressB, commit, witness, tx_hex = await generator.generateCommitAddress(
+        fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit)
+
+Cancelling a coroutine that is still waiting for a slot, or whose work has not
+been picked up by a worker yet, drops the work. Work that is already running
+cannot be interrupted, it finishes in the background and its result is
+discarded. It keeps its slot until then, so cancellations cannot push more than
+maxConcurrency generations onto the pool.
+'''
+
+import asyncio
+import functools
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+import generate_submarine_commit
+
+
+class AsyncCommitGenerator(object):
+    '''
+    Runs commit generation on an executor and awaits the result.
+    '''
+
+    def __init__(self, executor="process", maxWorkers=None,
+                 maxConcurrency=None):
+        '''
+        :param executor: "process", "thread" or a concurrent.futures.Executor.
+                         A process pool sidesteps the GIL, so it keeps the event
+                         loop responsive under load and scales with cores.
+                         Executors passed in are not shut down by close().
+        :param maxWorkers: size of the pool, defaults to the number of CPUs
+        :param maxConcurrency: maximum number of generations submitted to the
+                               pool at the same time, defaults to 2 * maxWorkers
+        '''
+        if maxWorkers is None:
+            maxWorkers = os.cpu_count() or 1
+
+        self._ownsExecutor = not isinstance(executor, Executor)
+        if executor == "process":
+            self._executor = ProcessPoolExecutor(max_workers=maxWorkers)
+        elif executor == "thread":
+            self._executor = ThreadPoolExecutor(max_workers=maxWorkers)
+        elif isinstance(executor, Executor):
+            self._executor = executor
+        else:
+            raise ValueError(
+                "executor must be \"process\", \"thread\" or an Executor, not {!r}".
+                format(executor))
+
+        self.maxConcurrency = maxConcurrency or 2 * maxWorkers
+        # Created on first use, so it belongs to the loop we are running in
+        self._semaphore = None
+
+    async def _run(self, function, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.maxConcurrency)
+        await self._semaphore.acquire()
+        loop = asyncio.get_event_loop()
+        try:
+            future = self._executor.submit(function, *args, **kwargs)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        # The slot is held until the pool is done with the work, not until the
+        # caller stops waiting: cancelling a running job doesn't free a worker.
+        future.add_done_callback(
+            functools.partial(self._release, loop, self._semaphore))
+        return await asyncio.wrap_future(future, loop=loop)
+
+    @staticmethod
+    def _release(loop, semaphore, future):
+        # Called from a pool thread, or right away if the work was cancelled
+        try:
+            loop.call_soon_threadsafe(semaphore.release)
+        except RuntimeError:
+            # The loop is closed, nobody is waiting for the slot anymore
+            pass
+
+    async def generateCommitAddress(self, *args, **kwargs):
+        '''
+        Async version of generate_submarine_commit.generateCommitAddress, same arguments.
+        '''
+        return await self._run(generate_submarine_commit.generateCommitAddress,
+                               *args, **kwargs)
+
+    async def generateCommitAddressBytes(self, *args, **kwargs):
+        '''
+        Async version of generate_submarine_commit.generateCommitAddressBytes, same arguments.
+        '''
+        return await self._run(
+            generate_submarine_commit.generateCommitAddressBytes, *args,
+            **kwargs)
+
+    async def generateCommitment(self, *args, **kwargs):
+        '''
+        Async version of generate_submarine_commit.generateCommitment, same arguments.
+        '''
+        return await self._run(generate_submarine_commit.generateCommitment,
+                               *args, **kwargs)
+
+    async def generateCommitAddresses(self, requests):
+        '''
+        Async version of generate_submarine_commit.generateCommitAddresses
+
+        :param requests: iterable of (fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit) tuples
+        :return: list of (addressB, commit, w (witness), tx_hex) tuples, in the same order as the requests
+        '''
+        return list(await asyncio.gather(
+            *[self.generateCommitAddress(*request) for request in requests]))
+
+    def close(self, wait=True):
+        '''
+        Shuts down the pool, unless it was passed in by the caller.
+        '''
+        if self._ownsExecutor:
+            self._executor.shutdown(wait=wait)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        # Waiting for the pool to shut down blocks, keep it off the event loop
+        await asyncio.get_event_loop().run_in_executor(None, self.close)
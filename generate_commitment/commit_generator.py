@@ -0,0 +1,276 @@
+'''
+Reusable commit generation engine.
+
+The functions of generate_submarine_commit take every parameter on every call
+and look the unlock tx template and the commit hasher up again each time. A
+service that generates commitments for one LibSubmarine contract at fixed gas
+parameters configures a SubmarineCommitGenerator once instead:
+
+    generator = SubmarineCommitGenerator(addressC, gasPrice, gasLimit)
+    commitment = generator.generate(fromAddress, sendAmount, dappData)
+    commitments = generator.generateMany(requests)
+    for commitment in generator.generateIter(requests):  # lazily, in order
+        ...
+    generator.close()
+
+The Keccak256 and secp256k1 backends are process wide. A generator resolves
+them when it is created and refuses a backend that differs from the one the
+process already uses, so it never switches them under other code. It keeps the unlock tx templates (per sendAmount) and commit hashers (per
+fromAddress, sendAmount and dappData) it builds. The batch methods run on a pool
+of worker processes that is started on first use and kept until close(). Every
+worker builds its own generator from the configuration once and reuses it for
+all chunks.
+
+A generator can be shared between threads. In a forked child it drops the
+lock and the worker pool of the parent and starts its own pool when needed.
+'''
+
+import os
+import threading
+import weakref
+from collections import OrderedDict, deque
+from itertools import islice
+
+from commit_hasher import CommitHasher
+from submarine_commitment import SubmarineCommitment
+from unlock_template import UnlockTxTemplate
+import generate_submarine_commit
+import keccak
+import unlock_recovery
+
+# Templates and hashers kept per generator
+DEFAULT_CACHE_SIZE = 128
+# Requests handed to a worker at a time by generateIter()
+DEFAULT_CHUNK_SIZE = 64
+
+_generators = weakref.WeakSet()
+
+
+def _resetAfterFork():
+    for generator in list(_generators):
+        generator._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_resetAfterFork)
+
+# Generators of this worker process by configuration, see _generateChunk()
+_workerGenerators = {}
+
+
+class SubmarineCommitGenerator(object):
+    '''
+    Generates SubmarineCommitments for one addressC, gasPrice and gasLimit.
+    Thread safe.
+    '''
+
+    def __init__(self,
+                 toAddress,
+                 gasPrice,
+                 gasLimit,
+                 maxAttempts=generate_submarine_commit.DEFAULT_MAX_ATTEMPTS,
+                 keccakBackend=None,
+                 secp256k1Backend=None,
+                 workers=None,
+                 cacheSize=DEFAULT_CACHE_SIZE):
+        '''
+        :param toAddress: 20 bytes address of the LibSubmarine contract (addressC)
+        :param gasPrice: Gas Price of the unlock txs
+        :param gasLimit: Gas Limit of the unlock txs
+        :param maxAttempts: Raise CommitGenerationError after this many candidates
+        :param keccakBackend: Keccak256 backend, see keccak.BACKEND_NAMES. The backend
+                              is process wide, None uses the one in use.
+        :param secp256k1Backend: "coincurve" or "py_ecc", see unlock_recovery.py. The
+                                 backend is process wide, None uses the one in use.
+        :raises ValueError: if a backend is not installed, or differs from the one
+                            the process already uses
+        :param workers: number of worker processes of the batch methods, defaults to
+                        the number of CPUs. 1 generates everything in the calling process.
+        :param cacheSize: number of unlock tx templates and of commit hashers kept
+        '''
+        if len(toAddress) != 20:
+            raise ValueError("toAddress must be 20 bytes")
+        self.toAddress = bytes(toAddress)
+        self.gasPrice = gasPrice
+        self.gasLimit = gasLimit
+        self.maxAttempts = maxAttempts
+        if keccakBackend is not None:
+            keccak.requireBackend(keccakBackend)
+        if secp256k1Backend is not None:
+            unlock_recovery.requireBackend(secp256k1Backend)
+        # Resolved now rather than on the first commit
+        self.keccakBackend = keccak.activeBackend()
+        self.secp256k1Backend = unlock_recovery.activeBackend()
+        self.workers = workers or os.cpu_count() or 1
+        self.cacheSize = cacheSize
+
+        self._templates = OrderedDict()
+        self._hashers = OrderedDict()
+        self._closed = False
+        self._reset()
+        _generators.add(self)
+
+    def _reset(self):
+        '''
+        Internal function. Also runs in the child after a fork: the lock may
+        have been held by another thread of the parent, and the worker pool
+        belongs to the parent.
+        '''
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = os.getpid()
+
+    def _config(self):
+        return (self.toAddress, self.gasPrice, self.gasLimit, self.maxAttempts,
+                self.keccakBackend, self.secp256k1Backend)
+
+    def _cached(self, cache, key, factory):
+        '''
+        Internal function. LRU lookup in cache, the value is built outside of
+        the lock.
+        '''
+        with self._lock:
+            value = cache.get(key)
+            if value is not None:
+                cache.move_to_end(key)
+                return value
+        value = factory()
+        with self._lock:
+            cache[key] = value
+            if len(cache) > self.cacheSize:
+                cache.popitem(last=False)
+        return value
+
+    def generate(self, fromAddress, sendAmount, dappData=b'',
+                 witnessSource=None):
+        '''
+        :param fromAddress: 20 bytes address of the sender (addressA)
+        :param sendAmount: Send Amount (in Wei)
+        :param dappData: Data for smart contract C
+        :param witnessSource: callable(attempt) -> witness, random witnesses if None
+        :return: SubmarineCommitment
+        '''
+        self._checkOpen()
+        # Hashable cache keys, the caller may pass bytearrays
+        fromAddress = bytes(fromAddress)
+        dappData = bytes(dappData)
+        template = self._cached(
+            self._templates, sendAmount, lambda: UnlockTxTemplate(
+                self.gasPrice, self.gasLimit, self.toAddress, sendAmount))
+        hasher = self._cached(
+            self._hashers, (fromAddress, sendAmount, dappData),
+            lambda: CommitHasher(fromAddress, self.toAddress, sendAmount,
+                                 dappData, self.gasPrice, self.gasLimit))
+        _, rawAddressB, commit, randw, R, S = (
+            generate_submarine_commit._generateUnlockInternal(
+                fromAddress,
+                self.toAddress,
+                sendAmount,
+                dappData,
+                self.gasPrice,
+                self.gasLimit,
+                maxAttempts=self.maxAttempts,
+                witnessSource=witnessSource,
+                template=template,
+                hasher=hasher))
+        return SubmarineCommitment(fromAddress, self.toAddress, sendAmount,
+                                   self.gasPrice, self.gasLimit, dappData,
+                                   randw, commit, rawAddressB, R, S)
+
+    def _checkOpen(self):
+        if self._closed:
+            raise ValueError("Generator is closed")
+
+    def _getExecutor(self):
+        with self._lock:
+            self._checkOpen()
+            if self._pid != os.getpid():
+                # Forked without os.register_at_fork (Python < 3.7)
+                self._executor = None
+                self._pid = os.getpid()
+            if self._executor is None:
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def generateIter(self, requests, chunksize=DEFAULT_CHUNK_SIZE):
+        '''
+        Generates lazily, at most two chunks per worker are in flight, so
+        requests can be an endless iterator.
+
+        :param requests: iterable of (fromAddress, sendAmount) or (fromAddress, sendAmount, dappData) tuples
+        :param chunksize: number of requests handed to a worker at a time
+        :return: iterator of SubmarineCommitment, in the same order as the requests.
+                 Closing it early waits for the chunks in flight.
+        '''
+        self._checkOpen()
+        if self.workers <= 1:
+            for request in requests:
+                yield self.generate(*request)
+            return
+
+        executor = self._getExecutor()
+        config = self._config()
+        requests = iter(requests)
+        pending = deque()
+        try:
+            while True:
+                chunk = [tuple(request) for request in islice(requests, chunksize)]
+                if not chunk:
+                    break
+                pending.append(executor.submit(_generateChunk, config, chunk))
+                if len(pending) >= 2 * self.workers:
+                    for commitment in pending.popleft().result():
+                        yield commitment
+            while pending:
+                for commitment in pending.popleft().result():
+                    yield commitment
+        finally:
+            # Cancelled chunks can hang the shutdown of the pool in close() on
+            # Python 3.8, let them finish instead
+            for future in pending:
+                future.exception()
+
+    def generateMany(self, requests, chunksize=None):
+        '''
+        Batch version of generate
+
+        :param requests: iterable of (fromAddress, sendAmount) or (fromAddress, sendAmount, dappData) tuples
+        :param chunksize: number of requests handed to a worker at a time
+        :return: list of SubmarineCommitment, in the same order as the requests
+        '''
+        self._checkOpen()
+        requests = list(requests)
+        if chunksize is None:
+            # a few chunks per worker keeps them all busy until the end
+            chunksize = max(1, len(requests) // (self.workers * 4))
+        return list(self.generateIter(requests, chunksize))
+
+    def close(self):
+        '''
+        Shuts the worker pool down
+        '''
+        with self._lock:
+            self._closed = True
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+def _generateChunk(config, requests):
+    '''
+    Internal function. Runs in the worker processes of
+    SubmarineCommitGenerator.generateIter().
+    '''
+    generator = _workerGenerators.get(config)
+    if generator is None:
+        generate_submarine_commit.quietLogging()
+        generator = SubmarineCommitGenerator(*config, workers=1)
+        _workerGenerators[config] = generator
+    return [generator.generate(*request) for request in requests]
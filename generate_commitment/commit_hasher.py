@@ -0,0 +1,77 @@
+'''
+Incremental Keccak256 hashing of commits.
+
+commit = Keccak256(addressA | addressC | sendAmount | dappData | w | gasPrice | gasLimit)
+
+Everything in front of the witness w is the same for every retry of the
+rejection sampler and for every commit of the same template. CommitHasher
+absorbs that prefix once and clones the Keccak state for each witness, so large
+dappData is not rehashed for every candidate. The same trick is used for
+R = Keccak256(commit | 1) and S = Keccak256(commit | 0).
+
+Hashing goes through the Keccak256 backend selected in keccak.py. Cloning the
+state needs a backend that supports it (pysha3), with the others we hash the
+full preimage. keccak.activeMode() tells you which of the two is used.
+'''
+
+from keccak import getBackend
+
+
+def aux(x):
+    return x.to_bytes(32, byteorder='big')
+
+
+class CommitHasher(object):
+    '''
+    Computes commits for a fixed (addressA, addressC, sendAmount, dappData,
+    gasPrice, gasLimit) template. Instances are never mutated after creation,
+    so they can be shared between threads.
+    '''
+
+    def __init__(self, addressA, addressC, sendAmount, dappData, gasPrice,
+                 gasLimit):
+        '''
+        :param addressA: Sender's Address
+        :param addressC: Smart Contracts Address
+        :param sendAmount: Send Amount (in Wei)
+        :param dappData: Data for smart contract
+        :param gasPrice: Gas Price
+        :param gasLimit: Gas Limit
+        '''
+        self._prefix = addressA + addressC + aux(sendAmount) + dappData
+        self._suffix = aux(gasPrice) + aux(gasLimit)
+        backend = getBackend()
+        self._hash = backend.hash
+        self._prefixState = None
+        if backend.new is not None:
+            self._prefixState = backend.new(self._prefix)
+
+    def commit(self, w):
+        '''
+        :param w: 32 bytes witness
+        :return: Keccak256 (sha3_256) hash of the full commit
+        '''
+        if self._prefixState is None:
+            return self._hash(self._prefix + w + self._suffix)
+        state = self._prefixState.copy()
+        state.update(w + self._suffix)
+        return state.digest()
+
+
+def deriveRS(commit):
+    '''
+    :param commit: 32 bytes commit
+    :return: R, S = Keccak256(commit | 1), Keccak256(commit | 0) as ints
+    '''
+    backend = getBackend()
+    if backend.new is None:
+        R = backend.hash(commit + b'\x01')
+        S = backend.hash(commit + b'\x00')
+    else:
+        stateR = backend.new(commit)
+        stateS = stateR.copy()
+        stateR.update(b'\x01')
+        stateS.update(b'\x00')
+        R = stateR.digest()
+        S = stateS.digest()
+    return int.from_bytes(R, byteorder='big'), int.from_bytes(S, byteorder='big')
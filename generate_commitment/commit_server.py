@@ -0,0 +1,330 @@
+'''
+Long running commit generation server.
+
+Every run of generate_submarine_commit.py pays for the interpreter start up and
+for importing ethereum, py_ecc and rlp before any work is done. This server
+keeps a pool of warm worker processes around and serves commit generation over
+HTTP/1.1 (with keep-alive) on a TCP port or a Unix socket.
+
+    POST /commit    Body: one JSON request per line, see --stream of
+                    generate_submarine_commit.py. The lines are spread over the
+                    workers in chunks of --batch-size. Response: one JSON
+                    result per line, in the same order. A single request that
+                    fails is answered with status 400.
+    GET  /stats     Request counters and p50/p99 latency in milliseconds.
+    GET  /health    "ok"
+
+There is no default port, 8545 and its neighbours belong to Ethereum nodes.
+Pass --port or --unix-socket:
+
+    $ python3 commit_server.py --port 8600 --workers 8 -t 0x7AEB1Fd3A42731c4Ae80870044C992eb689fb2Fe
+    $ curl -d '{"from": "0x...", "amount": 1000}' http://localhost:8600/commit
+'''
+
+import argparse
+import json
+import logging
+import math
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import generate_submarine_commit
+
+log = logging.getLogger('SubmarineCommitServer')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+
+# Latencies of the most recent requests used for the percentiles
+LATENCY_WINDOW = 10000
+# Refuse request bodies larger than this
+MAX_BODY_SIZE = 16 * 1024 * 1024
+# Request lines of a body handed to a worker at a time
+DEFAULT_BATCH_SIZE = 64
+
+
+def _percentile(sortedValues, percent):
+    '''
+    Nearest rank percentile of an already sorted list
+    '''
+    if not sortedValues:
+        return None
+    rank = int(math.ceil(percent / 100.0 * len(sortedValues)))
+    return sortedValues[max(rank, 1) - 1]
+
+
+class LatencyStats(object):
+    '''
+    Thread safe request counters and latencies of the last LATENCY_WINDOW requests.
+    '''
+
+    def __init__(self, window=LATENCY_WINDOW):
+        self._lock = threading.Lock()
+        self._latencies = deque(maxlen=window)
+        self._requests = 0
+        self._commits = 0
+        self._errors = 0
+
+    def record(self, seconds, commits, errors):
+        with self._lock:
+            self._latencies.append(seconds)
+            self._requests += 1
+            self._commits += commits
+            self._errors += errors
+
+    def snapshot(self):
+        '''
+        :return: dict with requests, commits, errors and p50Ms/p99Ms/maxMs over the latency window
+        '''
+        with self._lock:
+            latencies = sorted(self._latencies)
+            stats = {
+                "requests": self._requests,
+                "commits": self._commits,
+                "errors": self._errors,
+            }
+        for name, percent in [("p50Ms", 50), ("p99Ms", 99), ("maxMs", 100)]:
+            value = _percentile(latencies, percent)
+            stats[name] = None if value is None else value * 1000.0
+        return stats
+
+
+def _warmUp(_):
+    '''
+    Runs in every worker once at start up, so the imports and the first
+    generation are paid for before the first request comes in.
+    '''
+    generate_submarine_commit.quietLogging()
+    generate_submarine_commit.generateCommitAddress(
+        b"\x00" * 20, b"\x00" * 20, 0, b"", 0, 0)
+    return os.getpid()
+
+
+class CommitRequestHandler(BaseHTTPRequestHandler):
+    '''
+    HTTP/1.1 handler, connections are kept alive between requests.
+    '''
+    protocol_version = "HTTP/1.1"
+
+    def _respond(self, status, body, contentType="application/json"):
+        body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self._respond(200, json.dumps(self.server.stats.snapshot()))
+        elif self.path == "/health":
+            self._respond(200, "ok", "text/plain")
+        else:
+            self._respond(404, json.dumps({"error": "Not found"}))
+
+    def do_POST(self):
+        started = time.perf_counter()
+        if self.path != "/commit":
+            self._respond(404, json.dumps({"error": "Not found"}))
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+        except ValueError:
+            length = -1
+        if not 0 < length <= MAX_BODY_SIZE:
+            self.close_connection = True
+            self._respond(400, json.dumps({"error": "Bad Content-Length"}))
+            return
+
+        lines = [
+            line for line in self.rfile.read(length).decode(
+                "utf-8", "replace").splitlines() if line.strip()
+        ]
+        batchSize = self.server.batchSize
+        try:
+            futures = [
+                self.server.executor.submit(
+                    generate_submarine_commit.processStreamChunk,
+                    lines[start:start + batchSize], self.server.defaults)
+                for start in range(0, len(lines), batchSize)
+            ]
+            results = [
+                result for future in futures for result in future.result()
+            ]
+        except Exception as e:
+            # Bad requests are answered per line by processStreamChunk, this
+            # is a bug or a broken worker pool. Still answer the client.
+            log.exception("Generation failed")
+            self._respond(500, json.dumps({"error": str(e)}))
+            self.server.stats.record(time.perf_counter() - started, 0,
+                                     max(len(lines), 1))
+            return
+
+        errors = sum(1 for result in results if "error" in json.loads(result))
+        status = 400 if len(results) == 1 and errors else 200
+        self._respond(status, "".join(result + "\n" for result in results),
+                      "application/x-ndjson")
+        self.server.stats.record(time.perf_counter() - started,
+                                 len(results) - errors, errors)
+
+    def log_message(self, format, *args):
+        # client_address is empty for Unix sockets, so don't use address_string()
+        log.debug(format, *args)
+
+
+class _CommitServerMixIn(socketserver.ThreadingMixIn):
+    daemon_threads = True
+
+    def setUp(self, executor, defaults, batchSize):
+        self.executor = executor
+        self.defaults = defaults
+        self.batchSize = max(1, batchSize)
+        self.stats = LatencyStats()
+
+
+class CommitHTTPServer(_CommitServerMixIn, HTTPServer):
+    pass
+
+
+if hasattr(socket, "AF_UNIX"):
+
+    class CommitUnixServer(_CommitServerMixIn, socketserver.UnixStreamServer):
+        pass
+
+
+def createServer(executor,
+                 defaults,
+                 host="127.0.0.1",
+                 port=0,
+                 unixSocket=None,
+                 batchSize=DEFAULT_BATCH_SIZE):
+    '''
+    :param executor: pool of warm worker processes, see startWorkers()
+    :param defaults: dict of request values used when a request leaves them out
+    :param host: interface to listen on
+    :param port: TCP port, 0 picks a free one (see server.server_address)
+    :param unixSocket: listen on this Unix socket path instead of host/port
+    :param batchSize: request lines of a body handed to a worker at a time
+    :return: server, call serve_forever() on it
+    '''
+    if unixSocket is not None:
+        if os.path.exists(unixSocket):
+            os.unlink(unixSocket)
+        server = CommitUnixServer(unixSocket, CommitRequestHandler)
+    else:
+        server = CommitHTTPServer((host, port), CommitRequestHandler)
+    server.setUp(executor, defaults, batchSize)
+    return server
+
+
+def startWorkers(workers=None):
+    '''
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :return: ProcessPoolExecutor whose workers have all been warmed up
+    '''
+    workers = workers or os.cpu_count() or 1
+    executor = ProcessPoolExecutor(max_workers=workers)
+    # Enough warm up jobs that every worker gets to run at least one
+    pids = set(executor.map(_warmUp, range(4 * workers)))
+    log.info("{} worker processes warmed up".format(len(pids)))
+    return executor
+
+
+def _get_args():
+    '''
+    Internal function. Creates an argparser for the main method to use.
+
+    :return: parser: argparse object for parsing program arguments.
+    '''
+    parser = argparse.ArgumentParser(
+        description="Server that generates submarine commitments on warm workers",
+        formatter_class=argparse.RawTextHelpFormatter)
+    parser.add_argument(
+        '--host',
+        type=str,
+        default="127.0.0.1",
+        help="Optional interface to listen on. Default is 127.0.0.1")
+    listen = parser.add_mutually_exclusive_group(required=True)
+    listen.add_argument(
+        '--port',
+        type=int,
+        default=None,
+        help="TCP port to listen on. Avoid 8545-8551, used by Ethereum nodes")
+    listen.add_argument(
+        '--unix-socket',
+        type=str,
+        default=None,
+        help="Unix socket path to listen on instead of --host/--port")
+    parser.add_argument(
+        '-w',
+        '--workers',
+        type=int,
+        default=None,
+        help="Optional number of worker processes. Default is the number of CPUs.")
+    parser.add_argument(
+        '--batch-size',
+        type=int,
+        default=DEFAULT_BATCH_SIZE,
+        help="Optional number of request lines of a body handed to a worker "
+        "at a time. Default is {}.".format(DEFAULT_BATCH_SIZE))
+    parser.add_argument(
+        '-t',
+        '--target-address',
+        type=str,
+        default="",
+        help="Optional default target address of requests.")
+    parser.add_argument(
+        '-p',
+        '--gas-price',
+        type=int,
+        default=50000000000,
+        help="Optional default gas price of requests. Default is 50 GWei")
+    parser.add_argument(
+        '-l',
+        '--gas-limit',
+        type=int,
+        default=3712394,
+        help="Optional default gas limit of requests. Default is 3.7 million gas.")
+    return parser.parse_args()
+
+
+def main():
+    '''
+    Main method. Serves until interrupted.
+    '''
+    args = _get_args()
+
+    logHandler = logging.StreamHandler(stream=sys.stderr)
+    logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+    log.addHandler(logHandler)
+    log.setLevel(logging.INFO)
+
+    defaults = {
+        "from": "",
+        "target": args.target_address,
+        "amount": None,
+        "dappData": "",
+        "gasPrice": args.gas_price,
+        "gasLimit": args.gas_limit,
+    }
+    executor = startWorkers(args.workers)
+    server = createServer(executor, defaults, args.host, args.port,
+                          args.unix_socket, args.batch_size)
+    log.info("Listening on {}".format(args.unix_socket or server.server_address))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        executor.shutdown()
+        log.info("Final stats: {}".format(server.stats.snapshot()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+'''
+Shared memory output path for multi-process commit generation.
+
+generateCommitments() pickles every SubmarineCommitment in the worker and
+unpickles it in the parent. generateCommitmentArena() instead lays the binary
+records (see submarine_commitment.py) of all requests out in one
+multiprocessing.shared_memory block. The record sizes are known up front
+(HEADER_SIZE + len(dappData)), so every request has a fixed slot. The workers
+write their records straight into their slots with packInto(), only the slot
+offsets travel through the process pool and nothing travels back.
+
+The parent reads the records in place: arena.record(i) is a memoryview of the
+binary record, arena[i] unpacks it into a SubmarineCommitment.
+
+    with generateCommitmentArena(requests, workers=8) as arena:
+        for commitment in arena:
+            ...
+
+multiprocessing.shared_memory needs Python 3.8. On older versions the workers
+return their packed records and the parent copies them into a local buffer,
+the arena works the same way.
+'''
+
+
+import generate_submarine_commit
+from submarine_commitment import HEADER_SIZE, SubmarineCommitment
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:  # Python < 3.8
+    shared_memory = None
+
+
+class CommitmentArena(object):
+    '''
+    Binary SubmarineCommitment records in one buffer, record i at offsets[i].
+    '''
+
+    def __init__(self, offsets, size, sharedMemory=None):
+        '''
+        :param offsets: offset of every record
+        :param size: size of the buffer in bytes
+        :param sharedMemory: SharedMemory holding the records, a local buffer is used if None
+        '''
+        self.offsets = offsets
+        self.size = size
+        self._sharedMemory = sharedMemory
+        if sharedMemory is not None:
+            self.buf = sharedMemory.buf[:size]
+        else:
+            self.buf = memoryview(bytearray(size))
+
+    @property
+    def name(self):
+        '''
+        :return: name of the shared memory block, None if the arena is local
+        '''
+        return self._sharedMemory.name if self._sharedMemory else None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def record(self, index):
+        '''
+        :return: memoryview of the binary record of commitment index, no copy
+        '''
+        start = self.offsets[index]
+        end = (self.offsets[index + 1]
+               if index + 1 < len(self.offsets) else self.size)
+        return self.buf[start:end]
+
+    def __getitem__(self, index):
+        '''
+        :return: SubmarineCommitment index
+        '''
+        return SubmarineCommitment.unpackFrom(self.buf,
+                                              self.offsets[index])[0]
+
+    def __iter__(self):
+        for offset in self.offsets:
+            yield SubmarineCommitment.unpackFrom(self.buf, offset)[0]
+
+    def close(self):
+        '''
+        Releases the buffer and frees the shared memory block. Records and
+        memoryviews taken from the arena must not be used afterwards.
+        '''
+        self.buf.release()
+        if self._sharedMemory is not None:
+            self._sharedMemory.close()
+            self._sharedMemory.unlink()
+            self._sharedMemory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+
+def _generateInto(buf, jobs):
+    for offset, request in jobs:
+        generate_submarine_commit.generateCommitment(*request).packInto(
+            buf, offset)
+
+
+def _generateIntoSharedMemory(name, jobs):
+    '''
+    Internal function. Runs in the worker processes, writes the records of
+    jobs ((offset, request) tuples) into the shared memory block name.
+    '''
+    generate_submarine_commit.quietLogging()
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        _generateInto(block.buf, jobs)
+    finally:
+        block.close()
+
+
+def _generatePacked(job):
+    '''
+    Internal function. Fallback of _generateIntoSharedMemory without shared memory.
+    '''
+    generate_submarine_commit.quietLogging()
+    _, request = job
+    return generate_submarine_commit.generateCommitment(*request).pack()
+
+
+def generateCommitmentArena(requests, workers=None, chunksize=None):
+    '''
+    Batch version of generateCommitment that returns the records in a CommitmentArena
+
+    :param requests: iterable of (fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit) tuples
+    :param workers: number of worker processes, defaults to the number of CPUs.
+                    1 generates everything in the calling process.
+    :param chunksize: number of requests handed to a worker at a time
+    :return: CommitmentArena, in the same order as the requests. Close it when done.
+    '''
+    requests = [tuple(request) for request in requests]
+    offsets = []
+    size = 0
+    for request in requests:
+        offsets.append(size)
+        size += HEADER_SIZE + len(request[3])
+
+    jobs = list(zip(offsets, requests))
+    workers, chunks = generate_submarine_commit.chunkRequests(
+        jobs, workers, chunksize)
+
+    if workers <= 1:
+        arena = CommitmentArena(offsets, size)
+        _generateInto(arena.buf, jobs)
+        return arena
+
+    if shared_memory is None:
+        arena = CommitmentArena(offsets, size)
+        records = generate_submarine_commit.mapRequests(
+            _generatePacked, jobs, workers, chunksize)
+        for offset, record in zip(offsets, records):
+            arena.buf[offset:offset + len(record)] = record
+        return arena
+
+    # SharedMemory refuses size 0
+    arena = CommitmentArena(offsets, size,
+                            shared_memory.SharedMemory(create=True,
+                                                       size=max(size, 1)))
+    from concurrent.futures import ProcessPoolExecutor
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            list(
+                executor.map(_generateIntoSharedMemory,
+                             [arena.name] * len(chunks), chunks))
+    except BaseException:
+        arena.close()
+        raise
+    return arena
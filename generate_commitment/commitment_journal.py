@@ -0,0 +1,374 @@
+'''
+Append-only, memory mapped journal of generated commitments.
+
+If the witness or the unlock transaction of a commitment is lost, the funds
+sent to its address B cannot be recovered. Persist every commitment in the
+journal before handing it out:
+
+    journal = CommitmentJournal("commitments.journal")
+    commitment = generateCommitment(fromAddress, toAddress, sendAmount,
+                                    dappData, gasPrice, gasLimit)
+    journal.append(commitment)  # returns once the record is on disk
+    journal.getBySubmarineId(commitment.submarineId)
+
+File format: an 8 byte magic, the 8 byte checkpoint (big endian offset behind
+the last acknowledged record) and the frames
+
+    length   4 bytes, big endian, 0 marks the end of the journal
+    crc32    4 bytes, big endian, of the record
+    record   length bytes, SubmarineCommitment.pack() (see submarine_commitment.py)
+
+The file is grown in large zero filled steps and written through a memory map.
+Concurrent appends are made durable together (group commit): the first
+appender that has to wait flushes everything written so far with a single
+msync, then writes and flushes the checkpoint. The others wait for it. An
+append returns only once a checkpoint covering its record is on disk.
+
+The kernel writes the pages of the map back in any order, so after a crash a
+record that was never acknowledged may be missing while a later one is on
+disk. When the journal is opened, the frames are read and their checksums
+verified up to the first empty or damaged frame:
+
+    in front of the checkpoint  an acknowledged record is damaged. JournalError
+                                is raised and the file is left untouched, the
+                                records behind it may hold the only copy of a
+                                witness. See repair().
+    behind the checkpoint       appends that were never acknowledged. The frame
+                                is the end of the journal, it and everything
+                                behind it are cleared.
+
+Lookups by submarine ID (commit) and by address B use in-memory indexes that
+are rebuilt when the journal is opened.
+'''
+
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+from submarine_commitment import SubmarineCommitment
+
+MAGIC = b"SUBJRNL\x02"
+_CHECKPOINT = struct.Struct(">Q")
+CHECKPOINT_OFFSET = len(MAGIC)
+# Offset of the first frame
+HEADER_SIZE = CHECKPOINT_OFFSET + _CHECKPOINT.size
+_FRAME = struct.Struct(">II")
+FRAME_HEADER_SIZE = _FRAME.size
+# Initial file size and minimum growth step
+DEFAULT_GROWTH = 4 * 1024 * 1024
+_ZERO_BLOCK = bytes(1024 * 1024)
+
+
+class JournalError(Exception):
+    pass
+
+
+def _scanFrames(buffer, size):
+    '''
+    Internal function. Reads the frames of a journal map in order, up to the
+    first empty or damaged one.
+
+    :return: list of (offset, SubmarineCommitment), offset behind the last intact frame
+    '''
+    records = []
+    offset = HEADER_SIZE
+    while offset + FRAME_HEADER_SIZE <= size:
+        length, crc = _FRAME.unpack_from(buffer, offset)
+        start = offset + FRAME_HEADER_SIZE
+        end = start + length
+        if length == 0 or end > size or zlib.crc32(buffer[start:end]) != crc:
+            break
+        try:
+            commitment = SubmarineCommitment.unpack(buffer[start:end])
+        except (ValueError, struct.error):
+            break
+        records.append((offset, commitment))
+        offset = end
+    return records, offset
+
+
+def _dataEnd(buffer, size):
+    '''
+    Internal function. Offset behind the last non zero byte of a journal map.
+    '''
+    end = size
+    while end > 0:
+        start = max(end - len(_ZERO_BLOCK), 0)
+        block = buffer[start:end]
+        if block != _ZERO_BLOCK[:end - start]:
+            return start + len(block.rstrip(b"\x00"))
+        end = start
+    return 0
+
+
+def _clear(buffer, start, end):
+    '''
+    Internal function. Zeroes buffer[start:end] a block at a time.
+    '''
+    for blockStart in range(start, end, len(_ZERO_BLOCK)):
+        blockEnd = min(blockStart + len(_ZERO_BLOCK), end)
+        buffer[blockStart:blockEnd] = _ZERO_BLOCK[:blockEnd - blockStart]
+
+
+def repair(path):
+    '''
+    Truncates a journal that refuses to open behind its last intact record
+    and moves the checkpoint there. Every record behind the first damaged
+    one is dropped, together with the witnesses only it holds: copy the file
+    first and try to recover them from the copy.
+
+    :param path: journal file
+    :return: number of records kept
+    '''
+    fd = os.open(path, os.O_RDWR)
+    try:
+        size = os.fstat(fd).st_size
+        if size < HEADER_SIZE:
+            raise JournalError("{} is not a commitment journal".format(path))
+        journalMap = mmap.mmap(fd, size)
+        try:
+            if journalMap[:len(MAGIC)] != MAGIC:
+                raise JournalError(
+                    "{} is not a commitment journal".format(path))
+            records, tail = _scanFrames(journalMap, size)
+            _clear(journalMap, tail, max(tail, _dataEnd(journalMap, size)))
+            _CHECKPOINT.pack_into(journalMap, CHECKPOINT_OFFSET, tail)
+            journalMap.flush()
+        finally:
+            journalMap.close()
+    finally:
+        os.close(fd)
+    return len(records)
+
+
+class CommitmentJournal(object):
+    '''
+    Append-only journal of SubmarineCommitment records. Thread safe.
+    '''
+
+    def __init__(self, path, growth=DEFAULT_GROWTH):
+        '''
+        :param path: journal file, created if it does not exist
+        :param growth: bytes the file is grown by when it is full
+        '''
+        self.path = path
+        self.growth = max(growth, mmap.PAGESIZE)
+        self._cond = threading.Condition(threading.Lock())
+        self._bySubmarineId = {}
+        self._byAddressB = {}
+        self._offsets = []
+        self._written = 0  # records written to the map
+        self._durable = 0  # records covered by a completed flush
+        self._flushing = False
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            size = os.fstat(self._fd).st_size
+            if size == 0:
+                os.ftruncate(self._fd, self.growth)
+                os.write(self._fd, MAGIC + _CHECKPOINT.pack(HEADER_SIZE))
+                os.fsync(self._fd)
+                size = self.growth
+            self._size = size
+            self._map = mmap.mmap(self._fd, size)
+            if size < HEADER_SIZE or self._map[:len(MAGIC)] != MAGIC:
+                raise JournalError("{} is not a commitment journal".format(path))
+            self._recover()
+        except BaseException:
+            self._closeFiles()
+            raise
+
+    def _recover(self):
+        '''
+        Internal function. Rebuilds the indexes and finds the end of the journal.
+        '''
+        checkpoint, = _CHECKPOINT.unpack_from(self._map, CHECKPOINT_OFFSET)
+        records, offset = _scanFrames(self._map, self._size)
+        if offset < checkpoint:
+            raise JournalError(
+                "{} is damaged at offset {}, in front of the records acknowledged "
+                "up to offset {}. {} records before it are intact, see repair()".
+                format(self.path, offset, checkpoint, len(records)))
+        for recordOffset, commitment in records:
+            self._index(commitment, recordOffset)
+
+        self._tail = self._durableTail = offset
+        self._written = self._durable = len(self._offsets)
+        dataEnd = _dataEnd(self._map, self._size)
+        if dataEnd > offset:
+            # Appends that were never acknowledged, torn or written back out
+            # of order. Clear them so they can't be mistaken for records later.
+            _clear(self._map, offset, dataEnd)
+            self._map.flush()
+
+    def _index(self, commitment, offset):
+        self._offsets.append(offset)
+        self._bySubmarineId[commitment.commit] = offset
+        self._byAddressB[commitment.addressB] = offset
+
+    def _grow(self, needed):
+        '''
+        Internal function. Called with the lock held and no flush running.
+        '''
+        size = max(self._size + self.growth, needed)
+        self._map.flush()
+        self._map.close()
+        os.ftruncate(self._fd, size)
+        self._map = mmap.mmap(self._fd, size)
+        self._size = size
+
+    def _write(self, commitment):
+        '''
+        Internal function. Called with the lock held.
+        '''
+        record = commitment.pack()
+        while True:
+            end = self._tail + FRAME_HEADER_SIZE + len(record)
+            # Keep room for the empty frame that marks the end
+            if end + FRAME_HEADER_SIZE <= self._size:
+                break
+            if self._flushing:
+                # Other appends may move the tail while we wait
+                self._cond.wait()
+                continue
+            self._grow(end + FRAME_HEADER_SIZE)
+        offset = self._tail
+        start = offset + FRAME_HEADER_SIZE
+        self._map[start:end] = record
+        _FRAME.pack_into(self._map, offset, len(record), zlib.crc32(record))
+        self._tail = end
+        self._index(commitment, offset)
+        self._written += 1
+        return offset
+
+    def _waitDurable(self, count):
+        '''
+        Internal function. Returns once the first count records are flushed,
+        flushing them if no other thread is doing so already.
+        '''
+        with self._cond:
+            while self._durable < count:
+                if self._flushing:
+                    self._cond.wait()
+                    continue
+                self._flushing = True
+                target, targetTail = self._written, self._tail
+                # Only the pages written since the last flush
+                start = self._durableTail - self._durableTail % mmap.PAGESIZE
+                self._cond.release()
+                try:
+                    self._map.flush(start, targetTail - start)
+                    # Only once the records are on disk, a checkpoint written
+                    # back early must not cover records that are not
+                    _CHECKPOINT.pack_into(self._map, CHECKPOINT_OFFSET,
+                                          targetTail)
+                    self._map.flush(0, mmap.PAGESIZE)
+                finally:
+                    self._cond.acquire()
+                    self._flushing = False
+                    self._cond.notify_all()
+                self._durable = max(self._durable, target)
+                self._durableTail = max(self._durableTail, targetTail)
+
+    def append(self, commitment, wait=True):
+        '''
+        :param commitment: SubmarineCommitment
+        :param wait: return only once the record is on disk. If False, call sync() later.
+        :return: offset of the record in the journal
+        '''
+        with self._cond:
+            if self._map is None:
+                raise JournalError("Journal is closed")
+            offset = self._write(commitment)
+            count = self._written
+        if wait:
+            self._waitDurable(count)
+        return offset
+
+    def appendMany(self, commitments, wait=True):
+        '''
+        Appends all commitments and makes them durable with a single flush
+
+        :param commitments: iterable of SubmarineCommitment
+        :param wait: return only once the records are on disk
+        :return: list of record offsets
+        '''
+        with self._cond:
+            if self._map is None:
+                raise JournalError("Journal is closed")
+            offsets = [self._write(commitment) for commitment in commitments]
+            count = self._written
+        if wait:
+            self._waitDurable(count)
+        return offsets
+
+    def sync(self):
+        '''
+        Flushes all appended records to disk
+        '''
+        with self._cond:
+            count = self._written
+        self._waitDurable(count)
+
+    def _read(self, offset):
+        with self._cond:
+            length, _ = _FRAME.unpack_from(self._map, offset)
+            start = offset + FRAME_HEADER_SIZE
+            return SubmarineCommitment.unpack(self._map[start:start + length])
+
+    def getBySubmarineId(self, submarineId):
+        '''
+        :param submarineId: 32 bytes commit
+        :return: SubmarineCommitment, None if it is not in the journal
+        '''
+        offset = self._bySubmarineId.get(submarineId)
+        return None if offset is None else self._read(offset)
+
+    def getByAddressB(self, addressB):
+        '''
+        :param addressB: 20 bytes address B
+        :return: SubmarineCommitment, None if it is not in the journal
+        '''
+        offset = self._byAddressB.get(addressB)
+        return None if offset is None else self._read(offset)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        '''
+        Yields the commitments in the order they were appended
+        '''
+        for offset in list(self._offsets):
+            yield self._read(offset)
+
+    def _closeFiles(self):
+        if getattr(self, "_map", None) is not None:
+            self._map.close()
+        self._map = None
+        if self._fd is not None:
+            os.close(self._fd)
+        self._fd = None
+
+    def close(self):
+        '''
+        Flushes and closes the journal
+        '''
+        with self._cond:
+            if self._map is None:
+                return
+        self.sync()
+        with self._cond:
+            while self._flushing:
+                self._cond.wait()
+            if self._map is not None:
+                self._map.flush()
+                self._closeFiles()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
@@ -0,0 +1,169 @@
+'''
+Pool of pre-generated commitments with background refill.
+
+A burst of commit requests (e.g. when an auction opens) would otherwise pay the
+full rejection sampling and recovery cost per request. CommitmentPool keeps a
+number of fresh commitments ready for every registered template and refills it
+on a pool of worker processes as commitments are taken.
+
+    pool = CommitmentPool(size=16, workers=4)
+    key = pool.register(fromAddress, toAddress, sendAmount, dappData,
+                        gasPrice, gasLimit)
+    commitment = pool.take(key)  # SubmarineCommitment
+
+The commit covers addressA, addressC, the exact sendAmount, dappData, gasPrice
+and gasLimit, so a template is the full tuple of generateCommitment arguments.
+A commitment can only be used for exactly these values.
+
+Every commitment is handed out at most once: take() removes it from the pool
+under a lock, and nothing is ever put back. The pool holds witnesses, treat it
+like you would treat the witnesses themselves.
+'''
+
+import logging
+import os
+import threading
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+
+import generate_submarine_commit
+
+log = logging.getLogger('SubmarineCommitmentPool')
+
+
+class _Template(object):
+    '''
+    Ready commitments and in flight refills of one template
+    '''
+
+    __slots__ = ('request', 'ready', 'pending')
+
+    def __init__(self, request):
+        self.request = request
+        self.ready = deque()
+        self.pending = 0
+
+
+class CommitmentPool(object):
+    '''
+    Keeps size unused commitments ready per registered template.
+    '''
+
+    def __init__(self, size=8, workers=None, executor=None):
+        '''
+        :param size: number of ready commitments to keep per template
+        :param workers: number of worker processes, defaults to the number of CPUs
+        :param executor: concurrent.futures.Executor to refill on instead of a
+                         new process pool. It is not shut down by close().
+        '''
+        if size < 1:
+            raise ValueError("size must be at least 1, not {}".format(size))
+        self.size = size
+        self._ownsExecutor = executor is None
+        if executor is None:
+            executor = ProcessPoolExecutor(
+                max_workers=workers or os.cpu_count() or 1)
+        elif not isinstance(executor, Executor):
+            raise ValueError(
+                "executor must be an Executor, not {!r}".format(executor))
+        self._executor = executor
+        # Reentrant: a refill that completes right away runs its done
+        # callback from within _refill()
+        self._lock = threading.RLock()
+        self._templates = {}
+        self._closed = False
+        self.hits = 0
+        self.misses = 0
+
+    def register(self, fromAddress, toAddress, sendAmount, dappData, gasPrice,
+                 gasLimit):
+        '''
+        Starts filling the pool for a template, see generateCommitment for the parameters.
+        Registering a template again is a no-op.
+
+        :return: key of the template for take()
+        '''
+        key = (bytes(fromAddress), bytes(toAddress), sendAmount,
+               bytes(dappData), gasPrice, gasLimit)
+        with self._lock:
+            if key not in self._templates:
+                self._templates[key] = _Template(key)
+            self._refill(self._templates[key])
+        return key
+
+    def unregister(self, key):
+        '''
+        Stops refilling a template and drops its ready commitments.
+        '''
+        with self._lock:
+            self._templates.pop(key, None)
+
+    def _refill(self, template):
+        # Called with the lock held
+        if self._closed:
+            return
+        missing = self.size - len(template.ready) - template.pending
+        for _ in range(missing):
+            template.pending += 1
+            future = self._executor.submit(
+                generate_submarine_commit.generateCommitment,
+                *template.request)
+            future.add_done_callback(
+                lambda future, template=template: self._done(template, future))
+
+    def _done(self, template, future):
+        with self._lock:
+            template.pending -= 1
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                log.error("Refill failed: {!r}".format(error))
+                return
+            if self._templates.get(template.request) is template:
+                template.ready.append(future.result())
+
+    def take(self, key):
+        '''
+        Hands out a ready commitment of the template and schedules a refill.
+        If none is ready, one is generated in the calling thread.
+
+        :param key: key returned by register()
+        :return: SubmarineCommitment, never returned by this pool before
+        :raises KeyError: if the template is not registered
+        '''
+        with self._lock:
+            template = self._templates[key]
+            commitment = template.ready.popleft() if template.ready else None
+            if commitment is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            self._refill(template)
+
+        if commitment is None:
+            commitment = generate_submarine_commit.generateCommitment(*key)
+        return commitment
+
+    def available(self, key):
+        '''
+        :return: number of ready commitments of the template
+        '''
+        with self._lock:
+            return len(self._templates[key].ready)
+
+    def close(self, wait=True):
+        '''
+        Stops refilling. Shuts down the pool of worker processes unless it was
+        passed in by the caller.
+        '''
+        with self._lock:
+            self._closed = True
+        if self._ownsExecutor:
+            self._executor.shutdown(wait=wait)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
@@ -0,0 +1,235 @@
+'''
+SQLite store of submarine sessions through their lifecycle.
+
+    GENERATED -> COMMITTED -> REVEALED -> UNLOCKED
+
+The unlock tx can also be mined before the reveal (see LibSubmarineSimple).
+Such a session stays COMMITTED, with its unlocked flag set, until it is
+revealed, then goes straight to UNLOCKED.
+Every row holds the binary SubmarineCommitment record (see
+submarine_commitment.py) and the fields reconciliation jobs join on: address
+B, the submarine ID and the commit tx position, the same fields
+LibSubmarineSimple.SubmarineSession stores on chain.
+
+    store = CommitmentStore("sessions.sqlite")
+    store.putCommitments(generateCommitments(requests))
+    store.markCommitted([(submarineId, commitTxBlockNumber, commitTxIndex)])
+    for session in store.awaitingReveal(beforeBlock=blockNumber - 240):
+        ...
+
+The database runs in WAL mode, so readers are not blocked by the writer.
+Bulk writes go through executemany() in a single transaction.
+'''
+
+import sqlite3
+import threading
+from collections import namedtuple
+
+from submarine_commitment import SubmarineCommitment
+
+GENERATED = 0
+COMMITTED = 1
+REVEALED = 2
+UNLOCKED = 3
+STATE_NAMES = {
+    GENERATED: "generated",
+    COMMITTED: "committed",
+    REVEALED: "revealed",
+    UNLOCKED: "unlocked",
+}
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS sessions (
+        submarineId BLOB PRIMARY KEY,
+        addressA BLOB NOT NULL,
+        addressB BLOB NOT NULL,
+        addressC BLOB NOT NULL,
+        state INTEGER NOT NULL DEFAULT 0,
+        unlocked INTEGER NOT NULL DEFAULT 0,
+        commitTxBlockNumber INTEGER,
+        commitTxIndex INTEGER,
+        record BLOB NOT NULL
+    ) WITHOUT ROWID''',
+    'CREATE UNIQUE INDEX IF NOT EXISTS sessionsByAddressB ON sessions (addressB)',
+    '''CREATE INDEX IF NOT EXISTS sessionsByStateAndBlock
+        ON sessions (state, commitTxBlockNumber)''',
+    '''CREATE INDEX IF NOT EXISTS sessionsByBlock
+        ON sessions (commitTxBlockNumber, commitTxIndex)''',
+]
+
+_COLUMNS = "record, state, commitTxBlockNumber, commitTxIndex, unlocked"
+# Only GENERATED sessions take a new record, see putCommitments()
+_UPSERT = '''INSERT INTO sessions
+    (submarineId, addressA, addressB, addressC, record) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (submarineId) DO UPDATE
+    SET addressA = excluded.addressA, addressB = excluded.addressB,
+        addressC = excluded.addressC, record = excluded.record
+    WHERE state = 0 AND record != excluded.record'''
+_MARK_COMMITTED = '''UPDATE sessions
+    SET state = MAX(state, 1), commitTxBlockNumber = ?, commitTxIndex = ?
+    WHERE submarineId = ?'''
+_MARK_REVEALED = '''UPDATE sessions
+    SET state = CASE WHEN unlocked THEN 3 ELSE MAX(state, 2) END
+    WHERE submarineId = ?'''
+_MARK_UNLOCKED = '''UPDATE sessions
+    SET unlocked = 1, state = CASE WHEN state >= 2 THEN 3 ELSE state END
+    WHERE submarineId = ?'''
+_BY_SUBMARINE_ID = "SELECT " + _COLUMNS + " FROM sessions WHERE submarineId = ?"
+_BY_ADDRESS_B = "SELECT " + _COLUMNS + " FROM sessions WHERE addressB = ?"
+_BY_COMMIT_BLOCK = ("SELECT " + _COLUMNS + " FROM sessions "
+                    "WHERE commitTxBlockNumber = ? ORDER BY commitTxIndex")
+_AWAITING_REVEAL = ("SELECT " + _COLUMNS + " FROM sessions "
+                    "WHERE state = 1 AND commitTxBlockNumber < ? "
+                    "ORDER BY commitTxBlockNumber, commitTxIndex")
+_COUNT_BY_STATE = "SELECT state, COUNT(*) FROM sessions GROUP BY state"
+
+
+class StoredSession(
+        namedtuple('StoredSession', [
+            'commitment', 'state', 'commitTxBlockNumber', 'commitTxIndex',
+            'unlocked'
+        ])):
+    '''
+    A row of the store
+
+    commitment: SubmarineCommitment
+    state: GENERATED, COMMITTED, REVEALED or UNLOCKED
+    commitTxBlockNumber: block of the commit tx (A -> B), None until committed
+    commitTxIndex: index of the commit tx in its block, None until committed
+    unlocked: True once the unlock tx is mined, also while still COMMITTED
+    '''
+    __slots__ = ()
+
+
+def _session(row):
+    record, state, commitTxBlockNumber, commitTxIndex, unlocked = row
+    return StoredSession(
+        SubmarineCommitment.unpack(record), state, commitTxBlockNumber,
+        commitTxIndex, bool(unlocked))
+
+
+class CommitmentStore(object):
+    '''
+    SQLite backed store of submarine sessions. Thread safe.
+    '''
+
+    def __init__(self, path):
+        '''
+        :param path: database file, created if it does not exist
+        '''
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        # With WAL, NORMAL only loses the last transactions on power loss,
+        # never the consistency of the database
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        with self._db:
+            for statement in _SCHEMA:
+                self._db.execute(statement)
+
+    def putCommitments(self, commitments):
+        '''
+        Adds generated commitments, or updates them (upsert). A session that
+        is still GENERATED takes the new record. A session that moved on keeps
+        its record, because its commit tx is already on chain. Putting the
+        same commitments again changes nothing, so this can be rerun safely.
+
+        :param commitments: iterable of SubmarineCommitment
+        :return: number of sessions added or updated
+        :raises sqlite3.IntegrityError: if another session has the same
+                                        address B, nothing is written then
+        '''
+        rows = [(c.commit, c.addressA, c.addressB, c.addressC, c.pack())
+                for c in commitments]
+        with self._lock, self._db:
+            before = self._db.total_changes
+            self._db.executemany(_UPSERT, rows)
+            return self._db.total_changes - before
+
+    def markCommitted(self, commits):
+        '''
+        Records the position of the commit txs. A session never goes back
+        to an earlier state.
+
+        :param commits: iterable of (submarineId, commitTxBlockNumber, commitTxIndex) tuples
+        :return: number of sessions updated
+        '''
+        rows = [(blockNumber, txIndex, submarineId)
+                for submarineId, blockNumber, txIndex in commits]
+        return self._update(_MARK_COMMITTED, rows)
+
+    def markRevealed(self, submarineIds):
+        '''
+        :param submarineIds: iterable of submarine IDs
+        :return: number of sessions updated
+        '''
+        return self._update(_MARK_REVEALED, [(i, ) for i in submarineIds])
+
+    def markUnlocked(self, submarineIds):
+        '''
+        Sessions that are not revealed yet stay COMMITTED until markRevealed().
+
+        :param submarineIds: iterable of submarine IDs
+        :return: number of sessions updated
+        '''
+        return self._update(_MARK_UNLOCKED, [(i, ) for i in submarineIds])
+
+    def _update(self, statement, rows):
+        with self._lock, self._db:
+            before = self._db.total_changes
+            self._db.executemany(statement, rows)
+            return self._db.total_changes - before
+
+    def _query(self, statement, args):
+        with self._lock:
+            return [_session(row) for row in self._db.execute(statement, args)]
+
+    def getBySubmarineId(self, submarineId):
+        '''
+        :return: StoredSession, None if it is not in the store
+        '''
+        sessions = self._query(_BY_SUBMARINE_ID, (submarineId, ))
+        return sessions[0] if sessions else None
+
+    def getByAddressB(self, addressB):
+        '''
+        :return: StoredSession, None if it is not in the store
+        '''
+        sessions = self._query(_BY_ADDRESS_B, (addressB, ))
+        return sessions[0] if sessions else None
+
+    def getByCommitBlock(self, commitTxBlockNumber):
+        '''
+        :return: list of StoredSession committed in the block, by tx index
+        '''
+        return self._query(_BY_COMMIT_BLOCK, (commitTxBlockNumber, ))
+
+    def awaitingReveal(self, beforeBlock):
+        '''
+        Sessions that are committed but not revealed. This includes sessions
+        whose unlock tx was mined before the reveal (StoredSession.unlocked),
+        they still have to be revealed.
+
+        :param beforeBlock: only sessions committed before this block number
+        :return: list of StoredSession, by commit tx position
+        '''
+        return self._query(_AWAITING_REVEAL, (beforeBlock, ))
+
+    def countByState(self):
+        '''
+        :return: dict state name -> number of sessions
+        '''
+        with self._lock:
+            counts = dict(self._db.execute(_COUNT_BY_STATE))
+        return {name: counts.get(state, 0) for state, name in STATE_NAMES.items()}
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
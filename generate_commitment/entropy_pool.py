@@ -0,0 +1,85 @@
+'''
+Buffered entropy for witness generation.
+
+Every commit needs a fresh 32 byte witness. Instead of drawing it byte by byte
+from random.SystemRandom, EntropyPool reads os.urandom() in large blocks and
+hands out slices of it.
+
+The pool is fork safe: a child process never hands out bytes that were
+buffered by its parent, otherwise parent and child (e.g. the workers of a
+process pool) would produce identical witnesses.
+'''
+
+import os
+import threading
+import weakref
+
+# 128 witnesses per os.urandom() call
+DEFAULT_BLOCK_SIZE = 4096
+WITNESS_SIZE = 32
+
+_pools = weakref.WeakSet()
+
+
+class EntropyPool(object):
+    '''
+    Thread and fork safe buffer of os.urandom() bytes.
+    '''
+
+    def __init__(self, blockSize=DEFAULT_BLOCK_SIZE):
+        '''
+        :param blockSize: number of bytes read from os.urandom() at a time
+        '''
+        self._blockSize = blockSize
+        self._reset()
+        _pools.add(self)
+
+    def _reset(self):
+        self._lock = threading.Lock()
+        self._buffer = b''
+        self._offset = 0
+        self._pid = os.getpid()
+
+    def read(self, n):
+        '''
+        :param n: number of bytes
+        :return: n random bytes, never handed out before
+        '''
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked without os.register_at_fork, drop the parent's bytes
+                self._buffer = b''
+                self._offset = 0
+                self._pid = os.getpid()
+            offset = self._offset
+            if offset + n > len(self._buffer):
+                self._buffer = os.urandom(max(self._blockSize, n))
+                offset = 0
+            self._offset = offset + n
+            return self._buffer[offset:offset + n]
+
+    def witness(self):
+        '''
+        :return: 32 random bytes for use as witness w
+        '''
+        return self.read(WITNESS_SIZE)
+
+
+def _resetAfterFork():
+    # The lock may have been held by another thread of the parent at the time
+    # of the fork, so it is replaced together with the buffer.
+    for pool in list(_pools):
+        pool._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_resetAfterFork)
+
+defaultPool = EntropyPool()
+
+
+def randomWitness():
+    '''
+    :return: 32 random bytes from the process wide EntropyPool
+    '''
+    return defaultPool.witness()
@@ -1,31 +1,183 @@
-from ethereum.transactions import Transaction
-
-import random
 import logging
 import sys
-import rlp
 import argparse
+import csv
+import functools
+import json
 import os
+import time
+from collections import deque, namedtuple
 
-from ethereum.utils import check_checksum, decode_hex, normalize_address, encode_hex, bytearray_to_int, sha3_256  # sha3_256 is same as Keccak256
-from ethereum.exceptions import InvalidTransaction
-from py_ecc.secp256k1 import N as secp256k1n
-
-sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'test'))
-from test_utils import rec_bin
+# Only light modules are imported up front, the command line tool is mostly
+# run from short lived jobs. ethereum, rlp and the secp256k1 backends are
+# imported where they are first needed.
+from keccak import keccak256
+from unlock_recovery import recoverAddress
+from unlock_template import UNLOCK_FUNCTION_SELECTOR, cachedTemplate
+from commit_hasher import CommitHasher, deriveRS
+from entropy_pool import randomWitness
+from seeded_witness import WitnessDeriver, templateHash
+from submarine_commitment import SubmarineCommitment
+from sampler_stats import (AttemptCounter, CommitGenerationError, SamplerStats,
+                           REJECT_RS_OUT_OF_RANGE, REJECT_INVALID_VRS)
+from stage_stats import (StageStats, STAGE_WITNESS, STAGE_COMMIT, STAGE_RS,
+                         STAGE_RECOVERY, STAGE_ENCODING)
 
-# Logging
+# Logging. Applications embedding this module configure the handlers, the
+# command line tool attaches its own in main().
 log = logging.getLogger('SubmarineCommitGenerator')
 LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
-log.setLevel(logging.getLevelName('INFO'))
-logHandler = logging.StreamHandler(stream=sys.stdout)
-logHandler.setFormatter(logging.Formatter(LOGFORMAT))
-log.addHandler(logHandler)
+log.addHandler(logging.NullHandler())
+
+unlockFunctionSelector = UNLOCK_FUNCTION_SELECTOR
+
+# Order of the secp256k1 curve, same as py_ecc.secp256k1.N
+secp256k1n = 115792089237316195423570985008687907852837564279074904382605163141518161494337
+# Upper bound of S, computed once rather than per candidate
+_secp256k1nHalf = secp256k1n / 2
+
+# Every candidate commit is accepted with a probability of roughly 1/4 (S has to
+# be in the lower half of the curve order and R a valid x coordinate), so
+# running out of attempts is practically impossible.
+DEFAULT_MAX_ATTEMPTS = 256
+
+# Commit hashers of recently used templates. The hashed prefix is shared by the
+# retries of a commit and by consecutive commits for the same template.
+_commitHasher = functools.lru_cache(maxsize=128)(CommitHasher)
+
+# Rejection sampler counters of this process, see getSamplerStats()
+samplerStats = SamplerStats()
+
+
+def getSamplerStats():
+    '''
+    Counters of the rejection sampler in this process: attempts per commit,
+    rejections by reason and time spent in rejected attempts.
+
+    :return: dict, see SamplerStats.snapshot()
+    '''
+    return samplerStats.snapshot()
+
+
+# Stage timing hook of this process, see setStageHook(). None (the default)
+# keeps the timing calls out of the hot path.
+_stageHook = None
+
+
+def setStageHook(hook):
+    '''
+    Installs a stage timing hook in this process, see stage_stats.py
+
+    :param hook: callable(stage, seconds, attempt) called after every stage, None disables timing
+    :return: the previous hook
+    '''
+    global _stageHook
+    previous, _stageHook = _stageHook, hook
+    return previous
 
-unlockFunctionSelector = decode_hex("ec9b5b3a")
 
+def enableStageStats():
+    '''
+    Times every stage of the commits generated in this process
 
-def _generateRS(addressA, addressC, sendAmount, dappData, gasPrice, gasLimit):
+    :return: StageStats collecting the timings, call .snapshot() on it
+    '''
+    stats = StageStats()
+    setStageHook(stats.record)
+    return stats
+
+
+def _encodeHex(data):
+    '''
+    Internal function. Hex string of bytes, without 0x prefix (same as ethereum.utils.encode_hex)
+    '''
+    return data.hex()
+
+
+def _decodeHex(data):
+    '''
+    Internal function. Bytes of a hex string, with or without 0x prefix
+    '''
+    if data[:2] in ("0x", "0X"):
+        data = data[2:]
+    return bytes.fromhex(data)
+
+
+def _sampleRS(addressA,
+              addressC,
+              sendAmount,
+              dappData,
+              gasPrice,
+              gasLimit,
+              attempts,
+              witnessSource=None,
+              hasher=None):
+    '''
+    Internal Function
+    Generator yielding candidate (commit, randw, R, S) tuples with R & S in range.
+    Candidates out of range are rejected on the AttemptCounter, which raises
+    CommitGenerationError once the attempt cap is reached.
+
+    :param attempts: AttemptCounter of the commit being generated
+    :param witnessSource: callable(attempt) -> witness, random witnesses if None
+    :param hasher: CommitHasher of the template, looked up if None
+    '''
+    if hasher is None:
+        # Hashable cache keys, the caller may pass bytearrays
+        hasher = _commitHasher(bytes(addressA), bytes(addressC), sendAmount,
+                               bytes(dappData), gasPrice, gasLimit)
+    while True:
+        attempts.next()
+        hook = _stageHook
+        if hook is not None:
+            commit, randw, R, S = _timedCandidate(hook, attempts.count,
+                                                  hasher, witnessSource)
+        else:
+            if witnessSource is not None:
+                randw = witnessSource(attempts.count - 1)
+            else:
+                randw = randomWitness()
+            commit = hasher.commit(randw)
+
+            R, S = deriveRS(commit)
+
+        if (0 < R < secp256k1n) and (0 < S < _secp256k1nHalf):
+            yield commit, randw, R, S
+        else:
+            log.debug("Invalid R,S. Regenerating the hashes...")
+            attempts.reject(REJECT_RS_OUT_OF_RANGE)
+
+
+def _timedCandidate(hook, attempt, hasher, witnessSource):
+    '''
+    Internal Function
+    Same candidate as the untimed path of _sampleRS(), reporting the witness,
+    commit and rs stages to hook.
+    '''
+    started = time.perf_counter()
+    if witnessSource is not None:
+        w = witnessSource(attempt - 1)
+    else:
+        w = randomWitness()
+    witnessDone = time.perf_counter()
+    commit = hasher.commit(w)
+    commitDone = time.perf_counter()
+    R, S = deriveRS(commit)
+    rsDone = time.perf_counter()
+    hook(STAGE_WITNESS, witnessDone - started, attempt)
+    hook(STAGE_COMMIT, commitDone - witnessDone, attempt)
+    hook(STAGE_RS, rsDone - commitDone, attempt)
+    return commit, w, R, S
+
+
+def _generateRS(addressA,
+                addressC,
+                sendAmount,
+                dappData,
+                gasPrice,
+                gasLimit,
+                maxAttempts=DEFAULT_MAX_ATTEMPTS,
+                witnessSource=None):
     '''
     Internal Function
     Calculates R & S in a way that
@@ -33,34 +185,36 @@ def _generateRS(addressA, addressC, sendAmount, dappData, gasPrice, gasLimit):
     0 < R < secp256k1n
     0 < S < secp256k1n / 2
 
-    if not recursively runs itself til satisfied \_:)_/
+    if not draws a new witness til satisfied, at most maxAttempts times \_:)_/
 
     :param addressA: Sender's Address
     :param addressC: Smart Contracts Address
     :param sendAmount: Send Amount (in Wei)
     :param data: Data for smart contract
+    :param maxAttempts: Raise CommitGenerationError after this many candidates
+    :param witnessSource: callable(attempt) -> witness, random witnesses if None
     :return:
 
     commit, randw, R, S
 
     '''
     #TODO: validate AddressA and AddressC
-    commit, randw = _generateCommit(addressA, addressC, sendAmount, dappData,
-                                    gasPrice, gasLimit)
-
-    R = bytearray_to_int(sha3_256(commit + b'\x01'))
-    S = bytearray_to_int(sha3_256(commit + b'\x00'))
-
-    if (0 < R < secp256k1n) & (0 < S < (secp256k1n / 2)):
-        return commit, randw, R, S
-    else:
-        log.info("Invalid R,S. Regenerating the hashes...")
-        return _generateRS(addressA, addressC, sendAmount, dappData, gasPrice,
-                           gasLimit)
+    attempts = AttemptCounter(maxAttempts)
+    try:
+        return next(
+            _sampleRS(addressA, addressC, sendAmount, dappData, gasPrice,
+                      gasLimit, attempts, witnessSource))
+    finally:
+        samplerStats.record(attempts)
 
 
-def _generateCommit(addressA, addressC, sendAmount, dappData, gasPrice,
-                    gasLimit):
+def _generateCommit(addressA,
+                    addressC,
+                    sendAmount,
+                    dappData,
+                    gasPrice,
+                    gasLimit,
+                    w=None):
     '''
     Internal Function
     Generates a random number (w for witness) and calculates the Keccak256 hash of (AddressA | Address C | sendAmount | data | w)
@@ -69,24 +223,113 @@ def _generateCommit(addressA, addressC, sendAmount, dappData, gasPrice,
     :param addressC: Smart Contracts Address
     :param sendAmount: Send Amount (in Wei)
     :param data: Data for smart contract
+    :param w: witness to use, a random one is drawn if None
     :return:
 
     FullCommit : Keccak256 (sha3_256) hash of full commit (AddressUser | AddressLibSubmarine | sendAmount | data | w)
     w: Random number w for witness
 
     '''
-    rand_gen = random.SystemRandom()  # This uses os.urandom() . Secure enough?
-    w = bytes([rand_gen.randrange(256)
-               for _ in range(256 // 8)])  # random bytes
+    if w is None:
+        w = randomWitness()  # 32 bytes of os.urandom(), read in blocks
 
-    def aux(x):
-        return x.to_bytes(32, byteorder='big')
+    hasher = _commitHasher(bytes(addressA), bytes(addressC), sendAmount,
+                           bytes(dappData), gasPrice, gasLimit)
+    return hasher.commit(w), w
 
-    fullCommit = (addressA + addressC + aux(sendAmount) + dappData + w +
-                  aux(gasPrice) + aux(gasLimit))
-    # log.info("Commit / Session: {} \nAddress A {}\nAddress C {}\n send Amount {}\n dappData {}\n witness {}\n gasprice {}\n gaslimit {}\n".format(fullCommit, addressA, addressC, str(aux(sendAmount)), dappData, w, str(aux(gasPrice)), str(aux(gasLimit))))
 
-    return sha3_256(fullCommit), w
+def _unlockTxDict(template, rawAddressB, commit, R, S):
+    '''
+    Internal Function
+    Same fields as Transaction.to_dict() (without the tx hash), for logging.
+    '''
+    return {
+        'nonce': template.nonce,
+        'gasprice': template.gasPrice,
+        'startgas': template.gasLimit,
+        'to': '0x' + _encodeHex(template.addressC),
+        'value': template.sendAmount,
+        'data': '0x' + _encodeHex(unlockFunctionSelector + commit),
+        'v': template.V,
+        'r': R,
+        's': S,
+        'sender': '0x' + _encodeHex(rawAddressB),
+    }
+
+
+def _generateUnlockInternal(addressA,
+                            addressC,
+                            sendAmount,
+                            dappData,
+                            gasPrice,
+                            gasLimit,
+                            nonce=0,
+                            V=27,
+                            maxAttempts=DEFAULT_MAX_ATTEMPTS,
+                            witnessSource=None,
+                            template=None,
+                            hasher=None):
+    '''
+    Internal Function
+    Runs the rejection sampler until the R & S of a candidate commit recover to
+    a valid addressB. Called from _generateAddressBInternal() and
+    generateCommitAddress(). No Transaction object is built, the unlock tx can
+    be serialized with the returned template.
+
+    :param addressA: Sender's Address
+    :param addressC: Smart Contracts Address
+    :param sendAmount: Send Amount (in Wei)
+    :param data: Data for smart contract C
+    :param gasPrice: Gas Price
+    :param gasLimit: Gas Limit
+    :param nonce: default 0
+    :param V: default 27 --> no replay protection.
+    :param maxAttempts: Raise CommitGenerationError after this many candidates
+    :param witnessSource: callable(attempt) -> witness, random witnesses if None
+    :param template: UnlockTxTemplate of the unlock tx, looked up if None
+    :param hasher: CommitHasher of the commit template, looked up if None
+    :return:
+
+    template, rawAddressB, commit, randw, R, S
+
+    template : UnlockTxTemplate of the unlock tx
+    rawAddressB : Commit transaction receiver (20 bytes)
+    commit : commit message
+    randw: w (witness) random number
+    R, S: signature of the unlock tx
+    '''
+    if template is None:
+        template = cachedTemplate(gasPrice, gasLimit, bytes(addressC),
+                                  sendAmount, nonce, V)
+
+    attempts = AttemptCounter(maxAttempts)
+    try:
+        for commit, randw, R, S in _sampleRS(addressA, addressC, sendAmount,
+                                             dappData, gasPrice, gasLimit,
+                                             attempts, witnessSource, hasher):
+            hook = _stageHook
+            if hook is not None:
+                started = time.perf_counter()
+            # Recover B directly from the unsigned tx hash, rather than through
+            # tx.sender which serializes and hashes the whole transaction again.
+            rawAddressB = recoverAddress(
+                template.unsignedHash(commit), V, R, S)
+            if hook is not None:
+                hook(STAGE_RECOVERY, time.perf_counter() - started,
+                     attempts.count)
+            if rawAddressB is None:
+                log.debug("Address no good (invalid VRS), retrying")
+                attempts.reject(REJECT_INVALID_VRS)
+                continue
+
+            # Formatting the tx costs about as much as hashing the commit,
+            # only do it when somebody is listening
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Unlock TX Dict: {}".format(
+                    _unlockTxDict(template, rawAddressB, commit, R, S)))
+            return template, rawAddressB, commit, randw, R, S
+    finally:
+        samplerStats.record(attempts)
 
 
 def _generateAddressBInternal(addressA,
@@ -96,7 +339,9 @@ def _generateAddressBInternal(addressA,
                               gasPrice,
                               gasLimit,
                               nonce=0,
-                              V=27):
+                              V=27,
+                              maxAttempts=DEFAULT_MAX_ATTEMPTS,
+                              witnessSource=None):
     '''
     Main function
 
@@ -110,6 +355,8 @@ def _generateAddressBInternal(addressA,
     :param gasLimit: Gas Limit
     :param nonce: default 0
     :param V: default 27 --> no replay protection.
+    :param maxAttempts: Raise CommitGenerationError after this many candidates
+    :param witnessSource: callable(attempt) -> witness, random witnesses if None
     :return:
 
     tx obj, addressB, commit, randw
@@ -120,8 +367,14 @@ def _generateAddressBInternal(addressA,
     randw: w (witness) random number
     '''
 
-    commit, randw, R, S = _generateRS(addressA, addressC, sendAmount, dappData,
-                                      gasPrice, gasLimit)
+    template, rawAddressB, commit, randw, R, S = _generateUnlockInternal(
+        addressA, addressC, sendAmount, dappData, gasPrice, gasLimit, nonce, V,
+        maxAttempts, witnessSource)
+
+    hook = _stageHook
+    if hook is not None:
+        started = time.perf_counter()
+    from ethereum.transactions import Transaction
 
     submarineData = unlockFunctionSelector + commit
     # assert(len(commit) == 36)
@@ -135,27 +388,19 @@ def _generateAddressBInternal(addressA,
         v=V,
         r=R,
         s=S)
-
-    try:
-        addressB = tx.to_dict().get("sender")
-        log.info("Unlock TX Dict: {}".format(tx.to_dict()))
-        return tx, addressB, commit, randw
-
-    except (ValueError, InvalidTransaction) as e:
-        if isinstance(e, ValueError) and "VRS" not in str(e):
-            raise
-        log.info("Address no good (%s), retrying" % e)
-        return _generateAddressBInternal(addressA, addressC, sendAmount,
-                                         dappData, gasPrice, gasLimit, nonce,
-                                         V)
+    tx.sender = rawAddressB
+    if hook is not None:
+        hook(STAGE_ENCODING, time.perf_counter() - started, 0)
+    addressB = '0x' + _encodeHex(rawAddressB)
+    return tx, addressB, commit, randw
 
 
 def printRemix(fromAddress, tx, w):
     # sender registry unlockamt data wit gasprice gaslimit
-    sender = "0x" + encode_hex(fromAddress)  #tx.to_dict().get("sender")
+    sender = "0x" + _encodeHex(fromAddress)  #tx.to_dict().get("sender")
     registry = tx.to_dict().get("to")
     unlockamt = tx.to_dict().get("value")
-    data = '0x' + encode_hex(b'')
+    data = '0x' + _encodeHex(b'')
     wit = "0x" + w
     gasprice = tx.to_dict().get("gasprice")
     gaslimit = tx.to_dict().get("startgas")
@@ -163,13 +408,114 @@ def printRemix(fromAddress, tx, w):
                                                 data, wit, gasprice, gaslimit))
 
 
-def generateCommitAddress(fromAddress, toAddress, sendAmount, dappData,
-                          gasPrice, gasLimit):
+class CommitResult(
+        namedtuple('CommitResult',
+                   ['addressB', 'commit', 'witness', 'unlockTx'])):
+    '''
+    Result of generateCommitAddressBytes, all fields are raw bytes
+
+    addressB: AddressB (20 bytes)
+    commit: SessionId (32 bytes)
+    witness: w (32 bytes)
+    unlockTx: RLP encoded B -> C (txUnlock) transaction
+    '''
+    __slots__ = ()
+
+    def hex(self):
+        '''
+        :return: (addressB, commit, w (witness), tx_hex) in hex, as returned by generateCommitAddress
+        '''
+        return ('0x' + _encodeHex(self.addressB), _encodeHex(self.commit),
+                _encodeHex(self.witness), _encodeHex(self.unlockTx))
+
+
+def generateCommitAddressBytes(fromAddress,
+                               toAddress,
+                               sendAmount,
+                               dappData,
+                               gasPrice,
+                               gasLimit,
+                               maxAttempts=DEFAULT_MAX_ATTEMPTS,
+                               witnessSource=None):
+    '''
+    Exportable _generateAddressBInternal
+
+    Same as generateCommitAddress, but returns raw bytes. Use this if you would
+    decode the hex strings again anyway.
+
+    :param maxAttempts: Raise CommitGenerationError after this many candidates
+    :param witnessSource: callable(attempt) -> witness, random witnesses if None
+    :return: CommitResult(addressB, commit, witness, unlockTx), call .hex() for the hex strings
+    '''
+    template, rawAddressB, commit, randw, R, S = _generateUnlockInternal(
+        fromAddress,
+        toAddress,
+        sendAmount,
+        dappData,
+        gasPrice,
+        gasLimit,
+        maxAttempts=maxAttempts,
+        witnessSource=witnessSource)
+
+    hook = _stageHook
+    if hook is None:
+        return CommitResult(rawAddressB, commit, randw,
+                            template.signed(commit, R, S))
+    started = time.perf_counter()
+    unlockTx = template.signed(commit, R, S)
+    hook(STAGE_ENCODING, time.perf_counter() - started, 0)
+    return CommitResult(rawAddressB, commit, randw, unlockTx)
+
+
+def generateCommitment(fromAddress,
+                       toAddress,
+                       sendAmount,
+                       dappData,
+                       gasPrice,
+                       gasLimit,
+                       maxAttempts=DEFAULT_MAX_ATTEMPTS,
+                       witnessSource=None):
+    '''
+    Exportable _generateAddressBInternal
+
+    Same as generateCommitAddress, but returns the whole commitment as a compact
+    record that can be packed into a fixed width binary format, converted to the
+    unlock tx and to the reveal() arguments.
+
+    :param maxAttempts: Raise CommitGenerationError after this many candidates
+    :param witnessSource: callable(attempt) -> witness, random witnesses if None
+    :return: SubmarineCommitment
+    '''
+    template, rawAddressB, commit, randw, R, S = _generateUnlockInternal(
+        fromAddress,
+        toAddress,
+        sendAmount,
+        dappData,
+        gasPrice,
+        gasLimit,
+        maxAttempts=maxAttempts,
+        witnessSource=witnessSource)
+
+    return SubmarineCommitment(fromAddress, toAddress, sendAmount, gasPrice,
+                               gasLimit, bytes(dappData), randw, commit,
+                               rawAddressB, R, S)
+
+
+def generateCommitAddress(fromAddress,
+                          toAddress,
+                          sendAmount,
+                          dappData,
+                          gasPrice,
+                          gasLimit,
+                          maxAttempts=DEFAULT_MAX_ATTEMPTS,
+                          witnessSource=None):
     '''
     Exportable _generateAddressBInternal
 
     returns all the values in Hex
 
+    :param maxAttempts: Raise CommitGenerationError after this many candidates
+    :param witnessSource: callable(attempt) -> witness, random witnesses if None
     :return: all in hex
 
 
@@ -182,11 +528,220 @@ def generateCommitAddress(fromAddress, toAddress, sendAmount, dappData,
 
 
     '''
-    tx, addressB, commit, randw = _generateAddressBInternal(
-        fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit)
+    return generateCommitAddressBytes(
+        fromAddress,
+        toAddress,
+        sendAmount,
+        dappData,
+        gasPrice,
+        gasLimit,
+        maxAttempts=maxAttempts,
+        witnessSource=witnessSource).hex()
+
+
+def _generateCommitAddressWorker(request):
+    '''
+    Internal function. Top level (picklable) wrapper around generateCommitAddress
+    so it can be shipped to the worker processes of generateCommitAddresses().
+
+    :param request: tuple of generateCommitAddress arguments
+    :return: see generateCommitAddress
+    '''
+    return generateCommitAddress(*request)
+
+
+def chunkRequests(requests, workers=None, chunksize=None, minChunkSize=1):
+    '''
+    Splits requests into the chunks handed to a pool of worker processes.
 
-    return addressB, encode_hex(commit), encode_hex(randw), encode_hex(
-        rlp.encode(tx))
+    :param requests: list of requests
+    :param workers: number of worker processes, defaults to the number of CPUs
+    :param chunksize: number of requests per chunk, defaults to a few chunks
+                      per worker, which keeps them all busy until the end
+    :param minChunkSize: smallest amount of work worth a worker process
+    :return: (workers, chunks) tuple. workers is capped so that every worker
+             gets at least minChunkSize requests, when it is 1 or less the
+             caller should run the requests itself. chunks is a list of lists
+             of requests, in order.
+    '''
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = min(workers, len(requests) // minChunkSize)
+    if chunksize is None:
+        chunksize = max(minChunkSize,
+                        len(requests) // (max(workers, 1) * 4))
+    return workers, [
+        requests[start:start + chunksize]
+        for start in range(0, len(requests), chunksize)
+    ]
+
+
+def _mapChunk(worker, chunk):
+    return [worker(request) for request in chunk]
+
+
+def mapRequests(worker, requests, workers=None, chunksize=None):
+    '''
+    Maps worker over requests in a pool of worker processes, preserving the
+    order of the requests. The batch functions of this and the other modules
+    are built on it.
+
+    :param worker: top level (picklable) function taking a single request
+    :param requests: iterable of requests, each is passed to worker as a tuple
+    :param workers: number of worker processes, defaults to the number of CPUs.
+                    1 runs everything in the calling process.
+    :param chunksize: number of requests handed to a worker at a time, see
+                      chunkRequests()
+    :return: list of worker results, in the same order as the requests
+    '''
+    requests = [tuple(request) for request in requests]
+    workers, chunks = chunkRequests(requests, workers, chunksize)
+
+    if workers <= 1:
+        return [worker(request) for request in requests]
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [
+            result
+            for results in executor.map(
+                functools.partial(_mapChunk, worker), chunks)
+            for result in results
+        ]
+
+
+def generateCommitAddresses(requests, workers=None, chunksize=None):
+    '''
+    Batch version of generateCommitAddress
+
+    Fans the requests out over a pool of worker processes. Results are returned
+    in the same order as the requests.
+
+    :param requests: iterable of (fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit) tuples
+    :param workers: number of worker processes, defaults to the number of CPUs.
+                    1 generates everything in the calling process.
+    :param chunksize: number of requests handed to a worker at a time
+    :return: list of (addressB, commit, w (witness), tx_hex) tuples, see generateCommitAddress
+    '''
+    return mapRequests(_generateCommitAddressWorker, requests, workers,
+                       chunksize)
+
+
+def _generateCommitAddressBytesWorker(request):
+    '''
+    Internal function. Top level (picklable) wrapper around
+    generateCommitAddressBytes for generateCommitAddressesBytes().
+    '''
+    return generateCommitAddressBytes(*request)
+
+
+def generateCommitAddressesBytes(requests, workers=None, chunksize=None):
+    '''
+    Batch version of generateCommitAddressBytes, see generateCommitAddresses
+
+    :return: list of CommitResult, in the same order as the requests
+    '''
+    return mapRequests(_generateCommitAddressBytesWorker, requests, workers,
+                       chunksize)
+
+
+def _generateCommitmentWorker(request):
+    '''
+    Internal function. Top level (picklable) wrapper around generateCommitment
+    for generateCommitments().
+    '''
+    return generateCommitment(*request)
+
+
+def generateCommitments(requests, workers=None, chunksize=None):
+    '''
+    Batch version of generateCommitment, see generateCommitAddresses
+
+    :return: list of SubmarineCommitment, in the same order as the requests
+    '''
+    return mapRequests(_generateCommitmentWorker, requests, workers,
+                       chunksize)
+
+
+def generateCommitAddressFromSeed(seed, index, fromAddress, toAddress,
+                                  sendAmount, dappData, gasPrice, gasLimit):
+    '''
+    Deterministic version of generateCommitAddress
+
+    The witness of commit #index is derived from the master seed (see
+    seeded_witness.py), so calling this again with the same arguments
+    regenerates the exact same addressB, commit, witness and unlock tx. Nothing
+    but the seed has to be stored.
+
+    :param seed: master seed bytes, at least 16 bytes
+    :param index: commit index, 0 <= index < 2**64
+    :return: all in hex, see generateCommitAddress
+    '''
+    template = templateHash(fromAddress, toAddress, sendAmount, dappData,
+                            gasPrice, gasLimit)
+    return generateCommitAddress(
+        fromAddress,
+        toAddress,
+        sendAmount,
+        dappData,
+        gasPrice,
+        gasLimit,
+        witnessSource=WitnessDeriver(seed).witnessSource(index, template))
+
+
+def _generateCommitAddressFromSeedWorker(request):
+    '''
+    Internal function. Top level (picklable) wrapper around
+    generateCommitAddressFromSeed for generateCommitAddressesFromSeed().
+    '''
+    return generateCommitAddressFromSeed(*request)
+
+
+def generateCommitAddressesFromSeed(seed, requests, workers=None,
+                                    chunksize=None):
+    '''
+    Batch version of generateCommitAddressFromSeed
+
+    :param seed: master seed bytes, at least 16 bytes
+    :param requests: iterable of (index, fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit) tuples
+    :param workers: number of worker processes, see generateCommitAddresses
+    :param chunksize: number of requests handed to a worker at a time
+    :return: list of (addressB, commit, w (witness), tx_hex) tuples, see generateCommitAddress
+    '''
+    WitnessDeriver(seed)  # fail early on bad seeds
+    return mapRequests(_generateCommitAddressFromSeedWorker,
+                       [(seed, ) + tuple(request) for request in requests],
+                       workers, chunksize)
+
+
+def generateFeeLadder(fromAddress,
+                      toAddress,
+                      sendAmount,
+                      dappData,
+                      gasPrices,
+                      gasLimit,
+                      workers=None,
+                      chunksize=None):
+    '''
+    Precomputes one commitment per gas price
+
+    The gas price of the unlock tx is part of the commit and therefore of
+    addressB, so a commitment cannot be repriced once generated. Generating a
+    variant for every rung of a gas price ladder up front lets the caller pick
+    the one matching the gas price at commit time without any generation
+    latency. Each variant has its own witness. Only the variant that is
+    actually used needs to be kept.
+
+    :param gasPrices: iterable of gas prices of the unlock tx, duplicates are generated once
+    :param workers: number of worker processes, see generateCommitAddresses
+    :param chunksize: number of gas prices handed to a worker at a time
+    :return: dict gasPrice -> (addressB, commit, w (witness), tx_hex), see generateCommitAddress
+    '''
+    gasPrices = sorted(set(gasPrices))
+    results = generateCommitAddresses(
+        [(fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit)
+         for gasPrice in gasPrices], workers, chunksize)
+    return dict(zip(gasPrices, results))
 
 
 def _get_args():
@@ -202,29 +757,30 @@ def _get_args():
     parser.add_argument(
         '-t',
         '--target-address',
-        required=True,
+        required=False,
         type=str,
         default="",
         help="Target end address to send the money to in the end. "
-        "Probably this should be the LibSubmarine contract address.")
+        "Probably this should be the LibSubmarine contract address. "
+        "Required unless --stream is used.")
     parser.add_argument(
         '-f',
         '--from-address',
-        required=True,
+        required=False,
         type=str,
         default="",
         help=
         "From address that starts the submarine process. This should be an address "
-        "that you control.")
+        "that you control. Required unless --stream is used.")
     parser.add_argument(
         '-a',
         '--amount',
-        required=True,
+        required=False,
         type=int,
-        default=0,
+        default=None,
         help=
-        "Amount of money you are sending through the submarine transaction in Wei."
-    )
+        "Amount of money you are sending through the submarine transaction in Wei. "
+        "Required unless --stream is used.")
     parser.add_argument(
         '-d',
         '--dapp-data',
@@ -251,7 +807,291 @@ def _get_args():
         default=3712394,
         help=
         "Optional Gas limit for TX Unlock transaction. Default is 3.7 million gas.")
-    return parser.parse_args()
+    parser.add_argument(
+        '--stream',
+        action='store_true',
+        help=
+        "Read commit requests as JSON lines from stdin and write the results as "
+        "JSON lines to stdout, in the same order. Each request is an object with "
+        "the optional keys \"from\", \"target\", \"amount\", \"dappData\", "
+        "\"gasPrice\", \"gasLimit\" and \"id\". Missing keys default to the "
+        "command line arguments, \"id\" is copied to the result.")
+    parser.add_argument(
+        '-n',
+        '--count',
+        required=False,
+        type=int,
+        default=None,
+        help="Optional number of commitments to generate for the same parameters. "
+        "Results are written as rows in the --format of choice.")
+    parser.add_argument(
+        '--format',
+        required=False,
+        choices=['csv', 'jsonl'],
+        default='csv',
+        help="Optional output format of --count. Default is csv.")
+    parser.add_argument(
+        '-o',
+        '--output',
+        required=False,
+        type=str,
+        default=None,
+        help="Optional file to write the --count results to. Default is stdout.")
+    parser.add_argument(
+        '-w',
+        '--workers',
+        required=False,
+        type=int,
+        default=None,
+        help="Optional number of worker processes. Default is the number of CPUs.")
+    parser.add_argument(
+        '--batch-size',
+        required=False,
+        type=int,
+        default=64,
+        help="Optional number of --stream requests (or --count commitments) "
+        "handed to a worker at a time. Default is 64.")
+    args = parser.parse_args()
+
+    if not args.stream:
+        missing = [
+            option for option, value in
+            [('-t/--target-address', args.target_address),
+             ('-f/--from-address', args.from_address), ('-a/--amount',
+                                                        args.amount)]
+            if value in ("", None)
+        ]
+        if missing:
+            parser.error("the following arguments are required: {}".format(
+                ", ".join(missing)))
+    return args
+
+
+def _parseAddress(address, name):
+    '''
+    Internal function. Validates a 0x prefixed, EIP-55 encoded address from the command line.
+
+    :param address: address string
+    :param name: "Target" or "From", used in error messages
+    :return: 20 bytes address
+    :raises ValueError: if the address is not valid
+    '''
+    if len(address) != 42:
+        raise ValueError(
+            "{} Address length does not appear to match the correct length of an Ethereum address".
+            format(name))
+    if address[0:2] != "0x":
+        raise ValueError(
+            "{} address not in expected format, expected address to start with 0x".
+            format(name))
+    try:
+        rawAddress = bytes.fromhex(address[2:])
+    except ValueError:
+        raise ValueError("{} address is not hex encoded {}".format(
+            name, address))
+    if _checksumEncode(rawAddress) != address:
+        raise ValueError(
+            "{} address is not correctly encoded using EIP-55 {}".format(
+                name, address))
+    return rawAddress
+
+
+def _checksumEncode(rawAddress):
+    '''
+    Internal function. EIP-55 mixed case encoding of an address (same as
+    ethereum.utils.checksum_encode): a hex digit is upper case if the nibble
+    at its position in Keccak256 of the lower case hex address is >= 8.
+    '''
+    hexAddress = _encodeHex(rawAddress)
+    hashed = _encodeHex(keccak256(hexAddress.encode("ascii")))
+    return "0x" + "".join(
+        c.upper() if int(h, 16) >= 8 else c
+        for c, h in zip(hexAddress, hashed))
+
+
+def quietLogging():
+    '''
+    Raises the level of the SubmarineCommitGenerator logger to WARNING, so the
+    per commit INFO lines are dropped.
+
+    Call it in worker processes and wherever stdout carries results, like the
+    --stream and --count modes do. It only affects the calling process.
+    '''
+    log.setLevel(logging.WARNING)
+
+
+def _imapChunks(worker, chunks, workers, *args):
+    '''
+    Internal function. Yields worker(chunk, *args) for every chunk, in order.
+
+    Chunks are processed by a pool of worker processes. At most two chunks per
+    worker are in flight, so memory stays bounded however many chunks there are.
+    '''
+    if workers <= 1:
+        for chunk in chunks:
+            yield worker(chunk, *args)
+        return
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for chunk in chunks:
+            pending.append(executor.submit(worker, chunk, *args))
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def _parseUint256(value, name):
+    '''
+    Internal function. Integer of a request field, checked to fit a uint256.
+    Only JSON integers are accepted: floats, booleans and strings would be
+    truncated or coerced into another amount of Wei or gas.
+
+    :raises ValueError: if the value is not an integer in [0, 2**256)
+    '''
+    if isinstance(value, bool) or not isinstance(value, int):
+        raise ValueError("\"{}\" must be an integer, got {}".format(
+            name, json.dumps(value)))
+    if not 0 <= value < 2**256:
+        raise ValueError("\"{}\" must be between 0 and 2**256 - 1".format(name))
+    return value
+
+
+def processStreamChunk(lines, defaults):
+    '''
+    Generates the commits for a chunk of --stream requests. It is picklable,
+    so it can be submitted to a process pool as is.
+
+    Every line is a JSON object with the keys "from", "target", "amount",
+    "dappData", "gasPrice", "gasLimit" and an optional "id" that is copied to
+    the result. Missing keys are taken from defaults. A bad request doesn't
+    fail the chunk, its result carries an "error" message instead.
+
+    :param lines: list of JSON lines
+    :param defaults: dict of request values used for missing keys
+    :return: list of JSON lines, one per request and in the same order, with
+             either addressB, commit, witness and unlockTx or an error
+    '''
+    quietLogging()
+
+    results = []
+    for line in lines:
+        result = {}
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request is not a JSON object")
+            if "id" in request:
+                result["id"] = request["id"]
+            request = dict(defaults, **request)
+            for key in ("from", "target", "amount"):
+                if request.get(key) in ("", None):
+                    raise ValueError("Missing \"{}\"".format(key))
+
+            addressB, commit, randw, unlockTx = generateCommitAddress(
+                _parseAddress(request["from"], "From"),
+                _parseAddress(request["target"], "Target"),
+                _parseUint256(request["amount"], "amount"),
+                _decodeHex(request["dappData"]) if request["dappData"] else b"",
+                _parseUint256(request["gasPrice"], "gasPrice"),
+                _parseUint256(request["gasLimit"], "gasLimit"))
+            result.update(
+                addressB=addressB,
+                commit=commit,
+                witness=randw,
+                unlockTx=unlockTx)
+        except (ValueError, TypeError, OverflowError,
+                CommitGenerationError) as e:
+            result["error"] = str(e)
+        results.append(json.dumps(result))
+    return results
+
+
+def _readChunks(inStream, batchSize):
+    '''
+    Internal function. Groups the non empty lines of inStream into lists of batchSize lines.
+    '''
+    chunk = []
+    for line in inStream:
+        if line.strip():
+            chunk.append(line)
+        if len(chunk) >= batchSize:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _writeLines(lines, outStream):
+    for line in lines:
+        outStream.write(line)
+        outStream.write("\n")
+    outStream.flush()
+
+
+def _stream(args, inStream, outStream):
+    '''
+    Internal function. --stream mode of main().
+
+    Requests are processed in chunks of args.batch_size, results are written in
+    input order, see _imapChunks().
+    '''
+    defaults = {
+        "from": args.from_address,
+        "target": args.target_address,
+        "amount": args.amount,
+        "dappData": args.dapp_data,
+        "gasPrice": args.gas_price,
+        "gasLimit": args.gas_limit,
+    }
+    chunks = _readChunks(inStream, max(1, args.batch_size))
+    workers = args.workers or os.cpu_count() or 1
+
+    for lines in _imapChunks(processStreamChunk, chunks, workers, defaults):
+        _writeLines(lines, outStream)
+
+
+def _generateCountChunk(size, request):
+    '''
+    Internal function. Generates size commitments for the same request.
+    Runs in the worker processes of --count mode.
+
+    :return: list of (addressB, commit, w (witness), tx_hex) tuples
+    '''
+    quietLogging()
+    return [generateCommitAddress(*request) for _ in range(size)]
+
+
+def _bulk(args, request, outStream):
+    '''
+    Internal function. --count mode of main().
+
+    The addresses have been validated once by main(), every row is generated
+    for the same request. Rows are written as soon as their chunk is done.
+
+    :param request: (fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit)
+    '''
+    batchSize = max(1, args.batch_size)
+    chunks = (min(batchSize, args.count - start)
+              for start in range(0, args.count, batchSize))
+    workers = args.workers or os.cpu_count() or 1
+    fields = ["addressB", "commit", "witness", "unlockTx"]
+
+    if args.format == "csv":
+        writer = csv.writer(outStream)
+        writer.writerow(fields)
+        writeRows = writer.writerows
+    else:
+
+        def writeRows(rows):
+            _writeLines((json.dumps(dict(zip(fields, row))) for row in rows),
+                        outStream)
+
+    for rows in _imapChunks(_generateCountChunk, chunks, workers, request):
+        writeRows(rows)
+    outStream.flush()
 
 
 def main():
@@ -261,61 +1101,51 @@ def main():
 
     parser = _get_args()
 
-    if len(parser.target_address) != 42:
-        log.error(
-            "Target Address length does not appear to match the correct length of an Ethereum address"
-        )
-        sys.exit(1)
-    if len(parser.from_address) != 42:
-        log.error(
-            "From Address length does not appear to match the correct length of an Ethereum address"
-        )
-        sys.exit(1)
-    if parser.target_address[0:2] != "0x":
-        log.error(
-            "Target address not in expected format, expected address to start with 0x"
-        )
-        sys.exit(1)
-    if parser.from_address[0:2] != "0x":
-        log.error(
-            "From address not in expected format, expected address to start with 0x"
-        )
-        sys.exit(1)
+    logHandler = logging.StreamHandler(stream=sys.stdout)
+    logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+    log.addHandler(logHandler)
+    log.setLevel(logging.INFO)
 
-    if not check_checksum(parser.target_address):
-        log.error(
-            "Target address is not correctly encoded using EIP-55 {}".format(
-                parser.target_address))
-        sys.exit(1)
-    if not check_checksum(parser.from_address):
-        log.error(
-            "From address is not correctly encoded using EIP-55 {}".format(
-                parser.from_address))
+    if parser.stream:
+        _stream(parser, sys.stdin, sys.stdout)
+        return
+
+    try:
+        toAddress = _parseAddress(parser.target_address, "Target")
+        fromAddress = _parseAddress(parser.from_address, "From")
+    except ValueError as e:
+        log.error(e)
         sys.exit(1)
 
-    toAddress = normalize_address(parser.target_address)
-    fromAddress = normalize_address(parser.from_address)
     gasPrice = parser.gas_price
     gasLimit = parser.gas_limit
     sendAmount = parser.amount
     if (parser.dapp_data):
-        dappData = rec_bin(parser.dapp_data)
+        dappData = _decodeHex(parser.dapp_data)
     else:
         dappData = b""
 
-    tx, addressB, commit, randw = _generateAddressBInternal(
-        fromAddress, toAddress, sendAmount, dappData, gasPrice, gasLimit)
+    if parser.count is not None:
+        request = (fromAddress, toAddress, sendAmount, dappData, gasPrice,
+                   gasLimit)
+        if parser.output:
+            with open(parser.output, "w", newline="") as outStream:
+                _bulk(parser, request, outStream)
+        else:
+            _bulk(parser, request, sys.stdout)
+        return
+
+    # Same unlock tx as _generateAddressBInternal, without building a
+    # pyethereum Transaction (importing ethereum dominates a single run)
+    result = generateCommitAddressBytes(fromAddress, toAddress, sendAmount,
+                                        dappData, gasPrice, gasLimit)
 
-    # print("-"* 35)
-    # printRemix(fromAddress, tx, encode_hex(randw))
     print("-" * 35)
 
-    print("AddressB: {}".format(addressB)
-          )  # addressB also can retrieved using tx.to_dict().get("sender")
-    print("commit: {}".format(encode_hex(commit)))
-    print("witness (w): {}".format(encode_hex(randw)))
-    # print("Reveal Transation (json): {}".format(tx.to_dict()))
-    print("Reveal Transaction (hex): {}".format(encode_hex(rlp.encode(tx))))
+    print("AddressB: 0x{}".format(_encodeHex(result.addressB)))
+    print("commit: {}".format(_encodeHex(result.commit)))
+    print("witness (w): {}".format(_encodeHex(result.witness)))
+    print("Reveal Transaction (hex): {}".format(_encodeHex(result.unlockTx)))
     print(
         "You can use the reveal transaction hex to broadcast with any service you like, e.g.: https://ropsten.etherscan.io/pushTx"
     )
@@ -0,0 +1,287 @@
+'''
+Keccak256 backends.
+
+Several Keccak256 implementations ship with our requirements and their speed
+differs a lot on the short inputs we hash (commits, R & S, unlock tx hashes):
+
+    pysha3        sha3.keccak_256, C, supports cloning a hash state
+    pycryptodome  Crypto.Hash.keccak, C
+    eth_hash      eth_hash.auto.keccak, wraps one of the above
+    ethereum      ethereum.utils.sha3_256
+
+CommitHasher and deriveRS (commit_hasher.py) absorb the part of a preimage
+that repeats once and clone the hash state for every candidate, which needs a
+backend that can clone states. Without one they hash the full preimage, and
+the longer the dappData the more that costs, so a backend that clones is
+selected whenever one is installed:
+
+    prefix-clone   the backend clones states (pysha3)
+    full-preimage  every hash runs over the full preimage
+
+The first time a hash is needed, the installed native backends (pysha3,
+pycryptodome) are benchmarked on the path the commits take with them, and the
+fastest one of those that clone (or of all of them, if none does) is used
+from then on. eth_hash and ethereum hash with one of the native backends
+themselves, so they can't be faster and are only used if neither is installed.
+Loading them would also add a few hundred milliseconds to the start up. Set
+the SUBMARINE_KECCAK_BACKEND environment variable (or call setBackend()) to
+pick one yourself. activeBackend() tells you which one is in use and
+activeMode() which of the two modes.
+'''
+
+import os
+import time
+
+# Environment variable that overrides the benchmark
+BACKEND_ENV = "SUBMARINE_KECCAK_BACKEND"
+# Preference order when backends are equally fast
+BACKEND_NAMES = ("pysha3", "pycryptodome", "eth_hash", "ethereum")
+# Backends that wrap one of the others
+_WRAPPERS = ("eth_hash", "ethereum")
+# Hashing modes, see activeMode()
+MODE_PREFIX_CLONE = "prefix-clone"
+MODE_FULL_PREIMAGE = "full-preimage"
+# Benchmark input, about the size of a commit preimage. The first 72 bytes
+# (addressA | addressC | sendAmount) are the prefix a cloning backend absorbs once.
+_BENCHMARK_INPUT = bytes(range(136))
+_BENCHMARK_PREFIX_SIZE = 72
+_BENCHMARK_ROUNDS = 200
+# Keccak256(b""), every backend is checked against it when loaded
+_EMPTY_DIGEST = bytes.fromhex(
+    "c5d2460186f7233c927e7db2dcc703c0e500b653ca82273b7bfad8045d85a470")
+
+
+class KeccakBackend(object):
+    '''
+    A Keccak256 implementation.
+
+    hash(data) accepts any bytes-like object. new(data) returns a hash state
+    with update(), copy() and digest(), it is None if the implementation cannot
+    clone states.
+    '''
+
+    __slots__ = ('name', 'hash', 'new')
+
+    def __init__(self, name, hash, new=None):
+        self.name = name
+        self.hash = hash
+        self.new = new
+
+    @property
+    def mode(self):
+        '''
+        :return: MODE_PREFIX_CLONE if the backend clones states, else MODE_FULL_PREIMAGE
+        '''
+        return MODE_FULL_PREIMAGE if self.new is None else MODE_PREFIX_CLONE
+
+    def __repr__(self):
+        return "KeccakBackend({!r})".format(self.name)
+
+
+def _loadPysha3():
+    from sha3 import keccak_256
+    return KeccakBackend("pysha3", lambda data: keccak_256(data).digest(),
+                         keccak_256)
+
+
+def _loadPycryptodome():
+    from Crypto.Hash import keccak
+    return KeccakBackend(
+        "pycryptodome",
+        lambda data: keccak.new(digest_bits=256, data=data).digest())
+
+
+def _loadEthHash():
+    from eth_hash.auto import keccak
+    return KeccakBackend("eth_hash", lambda data: keccak(bytes(data)))
+
+
+def _loadEthereum():
+    from ethereum.utils import sha3_256
+    return KeccakBackend("ethereum", lambda data: sha3_256(bytes(data)))
+
+
+_LOADERS = {
+    "pysha3": _loadPysha3,
+    "pycryptodome": _loadPycryptodome,
+    "eth_hash": _loadEthHash,
+    "ethereum": _loadEthereum,
+}
+
+_backends = {}
+_active = None
+
+
+def loadBackend(name):
+    '''
+    :param name: one of BACKEND_NAMES
+    :return: KeccakBackend, or None if it is not installed (or not working)
+    '''
+    if name not in _LOADERS:
+        raise ValueError("Unknown Keccak256 backend {!r}, expected one of {}".
+                         format(name, ", ".join(BACKEND_NAMES)))
+    if name not in _backends:
+        try:
+            backend = _LOADERS[name]()
+            # eth_hash imports fine without a backend and fails on first use
+            if backend.hash(b"") != _EMPTY_DIGEST:
+                backend = None
+        except Exception:
+            backend = None
+        _backends[name] = backend
+    return _backends[name]
+
+
+def availableBackends():
+    '''
+    :return: names of the installed backends
+    '''
+    return [name for name in BACKEND_NAMES if loadBackend(name) is not None]
+
+
+def _benchmarkRounds(backend, rounds):
+    '''
+    Internal function. Hashes rounds commits with their R & S the way
+    CommitHasher and deriveRS do with backend.
+    '''
+    prefix = _BENCHMARK_INPUT[:_BENCHMARK_PREFIX_SIZE]
+    rest = _BENCHMARK_INPUT[_BENCHMARK_PREFIX_SIZE:]
+    if backend.new is None:
+        hash = backend.hash
+        for _ in range(rounds):
+            commit = hash(prefix + rest)
+            hash(commit + b'\x01')
+            hash(commit + b'\x00')
+        return
+    prefixState = backend.new(prefix)
+    for _ in range(rounds):
+        state = prefixState.copy()
+        state.update(rest)
+        stateR = backend.new(state.digest())
+        stateS = stateR.copy()
+        stateR.update(b'\x01')
+        stateS.update(b'\x00')
+        stateR.digest()
+        stateS.digest()
+
+
+def benchmark(rounds=_BENCHMARK_ROUNDS, names=None):
+    '''
+    :param rounds: number of commits (commit, R & S hashes) per backend, hashed
+                   in the mode of the backend
+    :param names: backends to benchmark, defaults to BACKEND_NAMES
+    :return: dict name -> seconds for rounds commits, for every installed backend
+    '''
+    timings = {}
+    for name in names or BACKEND_NAMES:
+        backend = loadBackend(name)
+        if backend is None:
+            continue
+        started = time.perf_counter()
+        _benchmarkRounds(backend, rounds)
+        timings[name] = time.perf_counter() - started
+    return timings
+
+
+def setBackend(name):
+    '''
+    Switches all hashing of this process to the backend name
+
+    :param name: one of BACKEND_NAMES
+    :raises ValueError: if the backend is not installed
+    '''
+    global _active
+    backend = loadBackend(name)
+    if backend is None:
+        raise ValueError("Keccak256 backend {} is not installed".format(name))
+    _active = backend
+
+
+def requireBackend(name):
+    '''
+    Selects the backend name like setBackend(), but never switches away from
+    a backend this process already uses
+
+    :param name: one of BACKEND_NAMES
+    :raises ValueError: if the backend is not installed or another one is in use
+    '''
+    if _active is None:
+        setBackend(name)
+    elif _active.name != name:
+        raise ValueError(
+            "Keccak256 backend {} is in use, cannot switch to {}".format(
+                _active.name, name))
+
+
+def getBackend():
+    '''
+    :return: KeccakBackend in use, selected on first call
+    '''
+    global _active
+    if _active is None:
+        name = os.environ.get(BACKEND_ENV)
+        if name:
+            setBackend(name)
+        else:
+            names = [name for name in BACKEND_NAMES if name not in _WRAPPERS]
+            timings = benchmark(names=names) or benchmark(names=_WRAPPERS)
+            if not timings:
+                raise ImportError("No Keccak256 implementation installed, "
+                                  "install one of " + ", ".join(BACKEND_NAMES))
+            candidates = [name for name in BACKEND_NAMES if name in timings]
+            # The benchmark input has no dappData, the prefix clone wins
+            # more with every byte of it
+            cloning = [
+                name for name in candidates
+                if loadBackend(name).mode == MODE_PREFIX_CLONE
+            ]
+            # min() keeps the first of equally fast backends
+            _active = loadBackend(min(cloning or candidates, key=timings.get))
+    return _active
+
+
+def activeBackend():
+    '''
+    :return: name of the Keccak256 backend in use
+    '''
+    return getBackend().name
+
+
+def activeMode():
+    '''
+    :return: MODE_PREFIX_CLONE or MODE_FULL_PREIMAGE, how CommitHasher and
+             deriveRS hash with the backend in use
+    '''
+    return getBackend().mode
+
+
+def keccak256(data):
+    '''
+    :param data: bytes-like object
+    :return: 32 bytes Keccak256 hash
+    '''
+    return getBackend().hash(data)
+
+
+def keccak256Batch(data, itemSize=None):
+    '''
+    Hashes many inputs at once
+
+    :param data: iterable of bytes-like objects, or a single contiguous buffer
+                 of equal length inputs if itemSize is given
+    :param itemSize: length of every input in data, data is split into
+                     len(data) // itemSize inputs without copying
+    :return: list of 32 bytes hashes, in the order of the inputs
+    '''
+    hash = getBackend().hash
+    if itemSize is None:
+        return [hash(item) for item in data]
+    if itemSize <= 0 or len(data) % itemSize:
+        raise ValueError(
+            "Buffer of {} bytes does not hold inputs of {} bytes".format(
+                len(data), itemSize))
+    view = memoryview(data)
+    return [
+        hash(view[offset:offset + itemSize])
+        for offset in range(0, len(view), itemSize)
+    ]
@@ -0,0 +1,126 @@
+'''
+Telemetry for the rejection sampler of generate_submarine_commit.
+
+A commit is only usable if R & S derived from it are in range and recover to a
+valid address B. Candidates that fail either check are rejected and a fresh
+witness is drawn. AttemptCounter follows a single commit through that loop and
+enforces the attempt cap, SamplerStats aggregates the counters of every commit
+generated in this process.
+'''
+
+import threading
+import time
+
+REJECT_RS_OUT_OF_RANGE = "rs_out_of_range"
+REJECT_INVALID_VRS = "invalid_vrs"
+
+
+class CommitGenerationError(Exception):
+    '''
+    Raised when no valid commit could be found within the attempt cap.
+    '''
+    pass
+
+
+class AttemptCounter(object):
+    '''
+    Counts the attempts needed for a single commit.
+    '''
+
+    def __init__(self, maxAttempts):
+        '''
+        :param maxAttempts: maximum number of candidates to try before giving up
+        '''
+        self.maxAttempts = maxAttempts
+        self.count = 0
+        self.rejections = {}
+        self.rejectedTime = 0.0
+        self._started = None
+
+    def next(self):
+        '''
+        Starts a new attempt.
+
+        :raises CommitGenerationError: when the attempt cap is reached
+        '''
+        if self.count >= self.maxAttempts:
+            raise CommitGenerationError(
+                "No valid commit found in {} attempts (rejections: {})".format(
+                    self.count, self.rejections))
+        self.count += 1
+        self._started = time.perf_counter()
+
+    def reject(self, reason):
+        '''
+        Rejects the current attempt.
+
+        :param reason: REJECT_RS_OUT_OF_RANGE or REJECT_INVALID_VRS
+        '''
+        self.rejections[reason] = self.rejections.get(reason, 0) + 1
+        self.rejectedTime += time.perf_counter() - self._started
+
+    @property
+    def succeeded(self):
+        return self.count > sum(self.rejections.values())
+
+
+class SamplerStats(object):
+    '''
+    Thread safe aggregate of AttemptCounters. Counters are per process, worker
+    processes of a pool each keep their own.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._commits = 0
+            self._failures = 0
+            self._attempts = 0
+            self._attemptsPerCommit = {}
+            self._rejections = {}
+            self._rejectedTime = 0.0
+
+    def record(self, attempts):
+        '''
+        Adds the counters of a finished (or abandoned) commit.
+
+        :param attempts: AttemptCounter
+        '''
+        with self._lock:
+            if attempts.succeeded:
+                self._commits += 1
+                self._attemptsPerCommit[attempts.count] = (
+                    self._attemptsPerCommit.get(attempts.count, 0) + 1)
+            else:
+                self._failures += 1
+            self._attempts += attempts.count
+            for reason, count in attempts.rejections.items():
+                self._rejections[reason] = self._rejections.get(reason,
+                                                                0) + count
+            self._rejectedTime += attempts.rejectedTime
+
+    def snapshot(self):
+        '''
+        :return: dict with
+
+        commits: number of commits generated
+        failures: number of commits abandoned at the attempt cap
+        attempts: total number of candidates tried
+        attemptsPerCommit: histogram {attempts: number of commits}
+        maxAttemptsPerCommit: worst case seen so far
+        rejections: {reason: number of rejected candidates}
+        rejectedSeconds: time spent in rejected candidates
+        '''
+        with self._lock:
+            return {
+                "commits": self._commits,
+                "failures": self._failures,
+                "attempts": self._attempts,
+                "attemptsPerCommit": dict(self._attemptsPerCommit),
+                "maxAttemptsPerCommit": max(self._attemptsPerCommit or [0]),
+                "rejections": dict(self._rejections),
+                "rejectedSeconds": self._rejectedTime,
+            }
@@ -0,0 +1,104 @@
+'''
+Deterministic, seed derived witnesses (HD-style submarine witnesses).
+
+A random witness has to be stored next to its unlock transaction, if it is lost
+the funds sent to address B are lost too. Deriving the witness of commit #i as
+
+    w(i, attempt) = HMAC-Keccak256(seed, "submarine-witness" | uint64(i) | uint32(attempt) | template)
+    template = Keccak256(A | C | uint256(value) | dappData | uint256(gasPrice) | uint256(gasLimit))
+
+allows every commit, commit address and unlock transaction to be recomputed
+from (seed, index, params) alone. attempt counts the witnesses rejected by the
+rejection sampler for this index, so regenerating a commit walks through the
+exact same candidates.
+
+The template binds the witness to the commit parameters. Without it, reusing
+an index for different parameters would reuse the witness. Once one of those
+commits is revealed, the witness is public and the parameters of the other
+commit (e.g. its amount) could be brute forced, finding its address B before
+it is revealed.
+
+The seed is the master secret of every commit derived from it. Keep it at least
+as safe as you would keep the witnesses themselves.
+'''
+
+from keccak import keccak256
+
+# Keccak256 absorbs 136 bytes per permutation, which is its HMAC block size
+KECCAK256_BLOCK_SIZE = 136
+MIN_SEED_LENGTH = 16
+WITNESS_DOMAIN = b"submarine-witness"
+
+
+def templateHash(addressA, addressC, sendAmount, dappData, gasPrice, gasLimit):
+    '''
+    Hash of the commit parameters a witness is bound to. Every field but
+    dappData has a fixed width, so the encoding is unambiguous.
+
+    :return: 32 bytes Keccak256 of A | C | uint256(sendAmount) | dappData | uint256(gasPrice) | uint256(gasLimit)
+    '''
+    return keccak256(addressA + addressC +
+                     sendAmount.to_bytes(32, byteorder='big') +
+                     bytes(dappData) + gasPrice.to_bytes(32, byteorder='big') +
+                     gasLimit.to_bytes(32, byteorder='big'))
+
+
+def hmacKeccak256(key, message):
+    '''
+    HMAC (RFC 2104) with Keccak256 as the hash function
+
+    :param key: bytes
+    :param message: bytes
+    :return: 32 bytes MAC
+    '''
+    return WitnessDeriver(key, minSeedLength=0)._mac(message)
+
+
+class WitnessDeriver(object):
+    '''
+    Derives witnesses from a master seed. The HMAC key pads are computed once.
+    '''
+
+    def __init__(self, seed, minSeedLength=MIN_SEED_LENGTH):
+        '''
+        :param seed: master seed bytes
+        :param minSeedLength: refuse seeds shorter than this
+        '''
+        if len(seed) < minSeedLength:
+            raise ValueError(
+                "Seed must be at least {} bytes long".format(minSeedLength))
+        if len(seed) > KECCAK256_BLOCK_SIZE:
+            seed = keccak256(seed)
+        key = seed.ljust(KECCAK256_BLOCK_SIZE, b'\x00')
+        self._innerPad = bytes(b ^ 0x36 for b in key)
+        self._outerPad = bytes(b ^ 0x5c for b in key)
+
+    def _mac(self, message):
+        return keccak256(self._outerPad + keccak256(self._innerPad + message))
+
+    def witness(self, index, template, attempt=0):
+        '''
+        :param index: commit index, 0 <= index < 2**64
+        :param template: templateHash() of the commit parameters
+        :param attempt: number of witnesses already rejected for this index
+        :return: 32 bytes witness
+        '''
+        if len(template) != 32:
+            raise ValueError("template must be a 32 bytes templateHash()")
+        return self._mac(WITNESS_DOMAIN + index.to_bytes(8, byteorder='big') +
+                         attempt.to_bytes(4, byteorder='big') + template)
+
+    def witnessSource(self, index, template):
+        '''
+        :param index: commit index
+        :param template: templateHash() of the commit parameters
+        :return: callable(attempt) -> witness, for the rejection sampler
+        '''
+        return lambda attempt: self.witness(index, template, attempt)
+
+
+def deriveWitness(seed, index, template, attempt=0):
+    '''
+    Convenience wrapper around WitnessDeriver(seed).witness(index, template, attempt)
+    '''
+    return WitnessDeriver(seed).witness(index, template, attempt)
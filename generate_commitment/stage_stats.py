@@ -0,0 +1,100 @@
+'''
+Stage timing for generate_submarine_commit.
+
+Generating a commit goes through these stages, the first three once per
+attempt of the rejection sampler (see sampler_stats.py):
+
+    witness     drawing (or deriving) the witness
+    commit      Keccak256 of the commit preimage
+    rs          R & S derived from the commit
+    recovery    address B recovered from the unlock tx, for candidates with R & S in range
+    encoding    building the unlock tx of the accepted candidate
+
+Timing is off by default and costs a single None check per stage. Install a
+hook with generate_submarine_commit.setStageHook(hook), it is called as
+hook(stage, seconds, attempt) after every stage (attempt counts from 1, it is
+0 for encoding, which runs once per commit), or collect the timings in a
+StageStats:
+
+    stats = generate_submarine_commit.enableStageStats()
+    ...
+    stats.snapshot()
+
+Hooks are per process, worker processes of a pool time their own stages.
+'''
+
+import threading
+
+STAGE_WITNESS = "witness"
+STAGE_COMMIT = "commit"
+STAGE_RS = "rs"
+STAGE_RECOVERY = "recovery"
+STAGE_ENCODING = "encoding"
+STAGES = [
+    STAGE_WITNESS, STAGE_COMMIT, STAGE_RS, STAGE_RECOVERY, STAGE_ENCODING
+]
+
+
+class _StageCounters(object):
+    __slots__ = ("count", "seconds", "retries", "retrySeconds", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.retries = 0
+        self.retrySeconds = 0.0
+        self.histogram = {}
+
+
+class StageStats(object):
+    '''
+    Thread safe counters and latency histograms per stage. Use record as the
+    stage hook.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._stages = {stage: _StageCounters() for stage in STAGES}
+
+    def record(self, stage, seconds, attempt):
+        '''
+        :param stage: one of STAGES
+        :param seconds: time the stage took
+        :param attempt: attempt of the rejection sampler, starting at 1
+        '''
+        # Power of two buckets, by upper bound in microseconds
+        bucket = 1 << int(seconds * 1e6).bit_length()
+        with self._lock:
+            counters = self._stages[stage]
+            counters.count += 1
+            counters.seconds += seconds
+            if attempt > 1:
+                counters.retries += 1
+                counters.retrySeconds += seconds
+            counters.histogram[bucket] = counters.histogram.get(bucket, 0) + 1
+
+    def snapshot(self):
+        '''
+        :return: dict stage -> dict with
+
+        count: number of times the stage ran
+        seconds: total time spent in the stage
+        retries: runs in attempts after the first one
+        retrySeconds: time spent in those runs
+        histogramUs: {upper bound in microseconds (power of two): number of runs}
+        '''
+        with self._lock:
+            return {
+                stage: {
+                    "count": counters.count,
+                    "seconds": counters.seconds,
+                    "retries": counters.retries,
+                    "retrySeconds": counters.retrySeconds,
+                    "histogramUs": dict(counters.histogram),
+                }
+                for stage, counters in self._stages.items()
+            }
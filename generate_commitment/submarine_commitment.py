@@ -0,0 +1,205 @@
+'''
+Compact record of a generated submarine commitment.
+
+Binary format (big endian), HEADER_SIZE bytes followed by the dappData:
+
+    version      1 byte
+    addressA    20 bytes
+    addressC    20 bytes
+    value       32 bytes
+    gasPrice    32 bytes
+    gasLimit    32 bytes
+    witness     32 bytes
+    commit      32 bytes
+    addressB    20 bytes
+    r           32 bytes
+    s           32 bytes
+    dappDataLen  4 bytes
+    dappData    dappDataLen bytes
+
+The unlock transaction always uses nonce 0 and v 27, so they are not stored.
+'''
+
+import struct
+
+from unlock_template import cachedTemplate
+
+FORMAT_VERSION = 1
+_HEADER = struct.Struct(">B20s20s32s32s32s32s32s20s32s32sI")
+HEADER_SIZE = _HEADER.size
+# struct pads short and truncates long byte strings, check them first
+_FIELD_SIZES = (('addressA', 20), ('addressC', 20), ('witness', 32),
+                ('commit', 32), ('addressB', 20))
+
+
+def _uint256(x):
+    return x.to_bytes(32, byteorder='big')
+
+
+def _int(x):
+    return int.from_bytes(x, byteorder='big')
+
+
+class SubmarineCommitment(object):
+    '''
+    Everything needed to commit, reveal and unlock a single submarine send.
+    All addresses and hashes are raw bytes, amounts are ints.
+    '''
+
+    __slots__ = ('addressA', 'addressC', 'value', 'gasPrice', 'gasLimit',
+                 'dappData', 'witness', 'commit', 'addressB', 'r', 's')
+
+    def __init__(self, addressA, addressC, value, gasPrice, gasLimit,
+                 dappData, witness, commit, addressB, r, s):
+        '''
+        :param addressA: Sender's Address
+        :param addressC: Smart Contracts Address
+        :param value: Send Amount (in Wei)
+        :param gasPrice: Gas Price of the unlock tx
+        :param gasLimit: Gas Limit of the unlock tx
+        :param dappData: Data for smart contract C
+        :param witness: w (witness)
+        :param commit: commit, a.k.a. submarine ID
+        :param addressB: Commit transaction receiver
+        :param r: R of the unlock tx
+        :param s: S of the unlock tx
+        '''
+        self.addressA = addressA
+        self.addressC = addressC
+        self.value = value
+        self.gasPrice = gasPrice
+        self.gasLimit = gasLimit
+        self.dappData = dappData
+        self.witness = witness
+        self.commit = commit
+        self.addressB = addressB
+        self.r = r
+        self.s = s
+
+    @property
+    def submarineId(self):
+        return self.commit
+
+    @property
+    def packedSize(self):
+        '''
+        :return: size of pack() in bytes
+        '''
+        return HEADER_SIZE + len(self.dappData)
+
+    def packInto(self, buffer, offset=0):
+        '''
+        Writes the binary record into a writable buffer (bytearray, memoryview,
+        mmap, ...).
+
+        :param buffer: writable buffer of at least offset + packedSize bytes
+        :param offset: position to write the record at
+        :return: offset right behind the record
+        :raises ValueError: if an address or hash has the wrong length
+        '''
+        for name, size in _FIELD_SIZES:
+            if len(getattr(self, name)) != size:
+                raise ValueError("{} must be {} bytes, got {}".format(
+                    name, size, len(getattr(self, name))))
+        _HEADER.pack_into(buffer, offset, FORMAT_VERSION, self.addressA,
+                          self.addressC, _uint256(self.value),
+                          _uint256(self.gasPrice), _uint256(self.gasLimit),
+                          self.witness, self.commit, self.addressB,
+                          _uint256(self.r), _uint256(self.s),
+                          len(self.dappData))
+        offset += HEADER_SIZE
+        end = offset + len(self.dappData)
+        buffer[offset:end] = self.dappData
+        return end
+
+    def pack(self):
+        '''
+        :return: binary record
+        :raises ValueError: if an address or hash has the wrong length
+        '''
+        buffer = bytearray(self.packedSize)
+        self.packInto(buffer)
+        return bytes(buffer)
+
+    @classmethod
+    def unpackFrom(cls, buffer, offset=0):
+        '''
+        Reads a binary record written by packInto()
+
+        :param buffer: buffer holding the record
+        :param offset: position of the record
+        :return: SubmarineCommitment, offset right behind the record
+        '''
+        (version, addressA, addressC, value, gasPrice, gasLimit, witness,
+         commit, addressB, r, s, dappDataLen) = _HEADER.unpack_from(
+             buffer, offset)
+        if version != FORMAT_VERSION:
+            raise ValueError(
+                "Unknown SubmarineCommitment format version {}".format(version))
+        offset += HEADER_SIZE
+        end = offset + dappDataLen
+        dappData = bytes(buffer[offset:end])
+        if len(dappData) != dappDataLen:
+            raise ValueError("Truncated SubmarineCommitment record")
+        return cls(addressA, addressC, _int(value), _int(gasPrice),
+                   _int(gasLimit), dappData, witness, commit, addressB, _int(r),
+                   _int(s)), end
+
+    @classmethod
+    def unpack(cls, data):
+        '''
+        :param data: binary record, see pack()
+        :return: SubmarineCommitment
+        '''
+        commitment, end = cls.unpackFrom(data)
+        if end != len(data):
+            raise ValueError("Trailing bytes after SubmarineCommitment record")
+        return commitment
+
+    def __reduce__(self):
+        # pickle (e.g. to and from worker processes) as the compact record
+        return (self.__class__.unpack, (self.pack(), ))
+
+    def _template(self):
+        return cachedTemplate(self.gasPrice, self.gasLimit, self.addressC,
+                              self.value)
+
+    def unlockTx(self):
+        '''
+        :return: RLP encoded signed unlock transaction (B -> C), ready to be broadcast
+        '''
+        return self._template().signed(self.commit, self.r, self.s)
+
+    def unsignedUnlockTx(self):
+        '''
+        :return: RLP encoded unsigned unlock transaction
+        '''
+        return self._template().unsigned(self.commit)
+
+    def revealArgs(self, commitTxBlockNumber, proofBlob):
+        '''
+        Arguments of LibSubmarineSimple.reveal(), to be sent from addressA
+
+        :param commitTxBlockNumber: Number of the block that includes the commit tx (A -> B)
+        :param proofBlob: proveth proof of the commit tx
+        :return: (_commitTxBlockNumber, _embeddedDAppData, _witness, _rlpUnlockTxUnsigned, _proofBlob)
+        '''
+        return (commitTxBlockNumber, self.dappData, self.witness,
+                self.unsignedUnlockTx(), proofBlob)
+
+    def __eq__(self, other):
+        if not isinstance(other, SubmarineCommitment):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name)
+            for name in self.__slots__)
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "SubmarineCommitment(submarineId=0x{}, addressB=0x{})".format(
+            self.commit.hex(), self.addressB.hex())
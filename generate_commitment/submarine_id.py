@@ -0,0 +1,133 @@
+'''
+Off-chain LibSubmarineSimple.getSubmarineId().
+
+    submarineId = keccak256(abi.encodePacked(_user, _libsubmarine, _commitValue,
+                                             _embeddedDAppData, _witness,
+                                             _gasPrice, _gasLimit))
+
+abi.encodePacked writes addresses as 20 bytes, uint256 and bytes32 as 32 bytes
+and bytes without any length prefix or padding:
+
+    user 20 | libsubmarine 20 | commitValue 32 | dappData | witness 32 | gasPrice 32 | gasLimit 32
+
+getSubmarineIds() packs requests with the same dappData length into one
+preallocated buffer and hashes it with keccak256Batch(), large batches are
+split over a pool of worker processes.
+'''
+
+import generate_submarine_commit
+from keccak import keccak256, keccak256Batch
+
+ADDRESS_SIZE = 20
+WORD_SIZE = 32
+# Size of an encodePacked preimage without the dappData
+FIXED_SIZE = 2 * ADDRESS_SIZE + 4 * WORD_SIZE
+# Don't bother worker processes with less than this many ids each
+MIN_CHUNK_SIZE = 4096
+
+
+def _check(user, libsubmarine, witness):
+    if len(user) != ADDRESS_SIZE or len(libsubmarine) != ADDRESS_SIZE:
+        raise ValueError("Addresses must be {} bytes".format(ADDRESS_SIZE))
+    if len(witness) != WORD_SIZE:
+        raise ValueError("Witness must be {} bytes".format(WORD_SIZE))
+
+
+def encodePacked(user, libsubmarine, commitValue, embeddedDAppData, witness,
+                 gasPrice, gasLimit):
+    '''
+    :param user: 20 bytes address of the user (addressA)
+    :param libsubmarine: 20 bytes address of the LibSubmarine contract (addressC)
+    :param commitValue: Send Amount (in Wei)
+    :param embeddedDAppData: Data for smart contract C
+    :param witness: 32 bytes witness
+    :param gasPrice: Gas Price of the unlock tx
+    :param gasLimit: Gas Limit of the unlock tx
+    :return: abi.encodePacked() of the getSubmarineId() arguments
+    '''
+    _check(user, libsubmarine, witness)
+    return (user + libsubmarine + commitValue.to_bytes(WORD_SIZE, 'big') +
+            bytes(embeddedDAppData) + witness +
+            gasPrice.to_bytes(WORD_SIZE, 'big') +
+            gasLimit.to_bytes(WORD_SIZE, 'big'))
+
+
+def getSubmarineId(user, libsubmarine, commitValue, embeddedDAppData, witness,
+                   gasPrice, gasLimit):
+    '''
+    Same as LibSubmarineSimple.getSubmarineId(), see encodePacked for the parameters
+
+    :return: 32 bytes submarine ID (the commit)
+    '''
+    return keccak256(
+        encodePacked(user, libsubmarine, commitValue, embeddedDAppData,
+                     witness, gasPrice, gasLimit))
+
+
+def _packGroup(requests, dappDataSize):
+    '''
+    Internal function. Writes the preimages of requests, which all have
+    dappDataSize bytes of dappData, back to back into one buffer.
+    '''
+    itemSize = FIXED_SIZE + dappDataSize
+    buffer = bytearray(itemSize * len(requests))
+    offset = 0
+    for (user, libsubmarine, commitValue, embeddedDAppData, witness, gasPrice,
+         gasLimit) in requests:
+        _check(user, libsubmarine, witness)
+        buffer[offset:offset + 20] = user
+        buffer[offset + 20:offset + 40] = libsubmarine
+        buffer[offset + 40:offset + 72] = commitValue.to_bytes(WORD_SIZE, 'big')
+        offset += 72
+        buffer[offset:offset + dappDataSize] = embeddedDAppData
+        offset += dappDataSize
+        buffer[offset:offset + 32] = witness
+        buffer[offset + 32:offset + 64] = gasPrice.to_bytes(WORD_SIZE, 'big')
+        buffer[offset + 64:offset + 96] = gasLimit.to_bytes(WORD_SIZE, 'big')
+        offset += 96
+    return buffer, itemSize
+
+
+def _getSubmarineIdsChunk(requests):
+    '''
+    Internal function. Runs in the worker processes of getSubmarineIds().
+    '''
+    groups = {}
+    for position, request in enumerate(requests):
+        groups.setdefault(len(request[3]), []).append(position)
+
+    ids = [None] * len(requests)
+    for dappDataSize, positions in groups.items():
+        buffer, itemSize = _packGroup([requests[p] for p in positions],
+                                      dappDataSize)
+        for position, submarineId in zip(positions,
+                                         keccak256Batch(buffer, itemSize)):
+            ids[position] = submarineId
+    return ids
+
+
+def getSubmarineIds(requests, workers=None, chunksize=None):
+    '''
+    Batch version of getSubmarineId
+
+    :param requests: iterable of (user, libsubmarine, commitValue, embeddedDAppData, witness, gasPrice, gasLimit) tuples
+    :param workers: number of worker processes, defaults to the number of CPUs.
+                    Batches smaller than MIN_CHUNK_SIZE ids per worker are
+                    hashed in the calling process.
+    :param chunksize: number of requests handed to a worker at a time
+    :return: list of 32 bytes submarine IDs, in the same order as the requests
+    '''
+    requests = [tuple(request) for request in requests]
+    workers, chunks = generate_submarine_commit.chunkRequests(
+        requests, workers, chunksize, MIN_CHUNK_SIZE)
+
+    if workers <= 1:
+        return _getSubmarineIdsChunk(requests)
+
+    from concurrent.futures import ProcessPoolExecutor
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [
+            submarineId
+            for ids in executor.map(_getSubmarineIdsChunk, chunks)
+            for submarineId in ids
+        ]
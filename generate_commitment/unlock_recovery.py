@@ -0,0 +1,139 @@
+'''
+Recovery engine for the sender (address B) of a TXunlock transaction.
+
+pyethereum recovers the sender of a Transaction by serializing it, hashing the
+unsigned part and going through its generic ecrecover code. For TXunlock we
+already know every field, so we hash the unsigned transaction once and recover
+the public key straight from secp256k1.
+
+coincurve (libsecp256k1) is used when it is installed, otherwise we fall back
+to the pure python py_ecc implementation. activeBackend() tells you which one
+is in use, setBackend() picks one. Both are imported on first use, so importing
+this module is cheap.
+'''
+
+from keccak import keccak256
+
+# "coincurve" or "py_ecc", chosen by activeBackend() on first use
+BACKEND = None
+coincurve = None
+
+
+def activeBackend():
+    '''
+    :return: name of the secp256k1 backend used for recovery, "coincurve" or "py_ecc"
+    '''
+    global BACKEND, coincurve
+    if BACKEND is None:
+        try:
+            import coincurve
+        except ImportError:
+            coincurve = None
+        if coincurve is not None and hasattr(coincurve, "PublicKey"):
+            BACKEND = "coincurve"
+        else:
+            BACKEND = "py_ecc"
+    return BACKEND
+
+
+def setBackend(name):
+    '''
+    Switches recovery in this process to the backend name
+
+    :param name: "coincurve" or "py_ecc"
+    :raises ValueError: if the backend is unknown or not installed
+    '''
+    global BACKEND, coincurve
+    if name not in ("coincurve", "py_ecc"):
+        raise ValueError("Unknown secp256k1 backend {}".format(name))
+    if name == "coincurve":
+        try:
+            import coincurve as module
+        except ImportError:
+            module = None
+        if module is None or not hasattr(module, "PublicKey"):
+            raise ValueError("secp256k1 backend coincurve is not installed")
+        coincurve = module
+    BACKEND = name
+
+
+def requireBackend(name):
+    '''
+    Selects the backend name like setBackend(), but never switches away from
+    a backend this process already uses
+
+    :param name: "coincurve" or "py_ecc"
+    :raises ValueError: if the backend is unknown, not installed or another
+                        one is in use
+    '''
+    if BACKEND is None:
+        setBackend(name)
+    elif BACKEND != name:
+        raise ValueError(
+            "secp256k1 backend {} is in use, cannot switch to {}".format(
+                BACKEND, name))
+
+
+def unlockTxHash(nonce, gasPrice, gasLimit, to, value, data):
+    '''
+    Keccak256 hash of the RLP encoded unsigned transaction. This is the message
+    that is "signed" by the R & S of TXunlock (V = 27, no replay protection).
+
+    :param nonce: Nonce of the transaction
+    :param gasPrice: Gas Price
+    :param gasLimit: Gas Limit
+    :param to: Receiver's Address
+    :param value: Send Amount (in Wei)
+    :param data: Transaction data
+    :return: 32 bytes hash
+    '''
+    import rlp
+    return keccak256(rlp.encode([nonce, gasPrice, gasLimit, to, value, data]))
+
+
+def recoverPublicKey(msgHash, V, R, S):
+    '''
+    Recovers the uncompressed public key (without the 0x04 prefix) that signed msgHash
+
+    :param msgHash: 32 bytes message hash
+    :param V: 27 or 28
+    :param R: R of the signature
+    :param S: S of the signature
+    :return: 64 bytes public key, or None if (V, R, S) does not recover to a valid key
+    '''
+    if activeBackend() == "coincurve":
+        try:
+            pk = coincurve.PublicKey.from_signature_and_message(
+                R.to_bytes(32, byteorder='big') +
+                S.to_bytes(32, byteorder='big') + bytes([V - 27]),
+                msgHash,
+                hasher=None)
+        except Exception:
+            return None
+        return pk.format(compressed=False)[1:]
+
+    from py_ecc.secp256k1 import ecdsa_raw_recover
+    try:
+        result = ecdsa_raw_recover(msgHash, (V, R, S))
+    except ValueError:
+        return None
+    if not result:
+        return None
+    x, y = result
+    return x.to_bytes(32, byteorder='big') + y.to_bytes(32, byteorder='big')
+
+
+def recoverAddress(msgHash, V, R, S):
+    '''
+    Recovers the address that signed msgHash
+
+    :param msgHash: 32 bytes message hash
+    :param V: 27 or 28
+    :param R: R of the signature
+    :param S: S of the signature
+    :return: 20 bytes address, or None if (V, R, S) does not recover to a valid key
+    '''
+    pub = recoverPublicKey(msgHash, V, R, S)
+    if pub is None or pub == b"\x00" * 64:
+        return None
+    return keccak256(pub)[-20:]
@@ -0,0 +1,150 @@
+'''
+Precompiled RLP template of the TXunlock transaction.
+
+For a fixed (nonce, gasPrice, gasLimit, addressC, sendAmount) every unlock
+transaction has the same RLP layout:
+
+    [nonce, gasPrice, gasLimit, addressC, sendAmount, unlockFunctionSelector | commit, v, r, s]
+
+Only the 32 byte commit and r & s change. UnlockTxTemplate encodes the fixed
+fields once and writes the commit (and r & s) into a copy of a preallocated
+buffer, instead of building a pyethereum Transaction and running rlp.encode()
+for every candidate.
+'''
+
+import functools
+
+from keccak import keccak256
+
+UNLOCK_FUNCTION_SELECTOR = b"\xec\x9b\x5b\x3a"
+COMMIT_SIZE = 32
+
+
+def _lengthPrefix(length, offset):
+    '''
+    :param length: length of the payload
+    :param offset: 0x80 for strings, 0xc0 for lists
+    :return: RLP length prefix
+    '''
+    if length <= 55:
+        return bytes([offset + length])
+    lengthBytes = length.to_bytes((length.bit_length() + 7) // 8,
+                                  byteorder='big')
+    return bytes([offset + 55 + len(lengthBytes)]) + lengthBytes
+
+
+def encodeBytes(value):
+    '''
+    :return: RLP encoding of a byte string
+    '''
+    if len(value) == 1 and value[0] < 0x80:
+        return bytes(value)
+    return _lengthPrefix(len(value), 0x80) + value
+
+
+def encodeInt(value):
+    '''
+    :return: RLP encoding of an unsigned integer (big endian, no leading zeros)
+    '''
+    return encodeBytes(value.to_bytes((value.bit_length() + 7) // 8,
+                                      byteorder='big'))
+
+
+def encodeList(payload):
+    '''
+    :param payload: concatenated RLP encodings of the list items
+    :return: RLP encoding of the list
+    '''
+    return _lengthPrefix(len(payload), 0xc0) + payload
+
+
+class UnlockTxTemplate(object):
+    '''
+    RLP template for the unlock transactions of one (nonce, gasPrice, gasLimit,
+    addressC, sendAmount, V). Instances are never mutated after creation, so
+    they can be shared between threads.
+    '''
+
+    def __init__(self, gasPrice, gasLimit, addressC, sendAmount, nonce=0,
+                 V=27):
+        '''
+        :param gasPrice: Gas Price
+        :param gasLimit: Gas Limit
+        :param addressC: Smart Contracts Address
+        :param sendAmount: Send Amount (in Wei)
+        :param nonce: default 0
+        :param V: default 27 --> no replay protection.
+        '''
+        self.gasPrice = gasPrice
+        self.gasLimit = gasLimit
+        self.addressC = addressC
+        self.sendAmount = sendAmount
+        self.nonce = nonce
+        self.V = V
+
+        # Everything in front of the commit
+        self._head = (encodeInt(nonce) + encodeInt(gasPrice) +
+                      encodeInt(gasLimit) + encodeBytes(addressC) +
+                      encodeInt(sendAmount) +
+                      _lengthPrefix(
+                          len(UNLOCK_FUNCTION_SELECTOR) + COMMIT_SIZE, 0x80) +
+                      UNLOCK_FUNCTION_SELECTOR)
+        self._encodedV = encodeInt(V)
+
+        unsignedPrefix = _lengthPrefix(len(self._head) + COMMIT_SIZE, 0xc0)
+        self._unsigned = bytearray(unsignedPrefix + self._head +
+                                   bytes(COMMIT_SIZE))
+        self._unsignedCommitOffset = len(unsignedPrefix) + len(self._head)
+
+        # Common case: r and s both need all 32 bytes (0xa0 + 32 bytes)
+        signedPrefix = _lengthPrefix(
+            len(self._head) + COMMIT_SIZE + len(self._encodedV) + 2 * 33,
+            0xc0)
+        self._signed = bytearray(signedPrefix + self._head +
+                                 bytes(COMMIT_SIZE) + self._encodedV +
+                                 b"\xa0" + bytes(32) + b"\xa0" + bytes(32))
+        self._signedCommitOffset = len(signedPrefix) + len(self._head)
+        self._signedROffset = (self._signedCommitOffset + COMMIT_SIZE +
+                               len(self._encodedV) + 1)
+        self._signedSOffset = self._signedROffset + 33
+
+    def unsigned(self, commit):
+        '''
+        :param commit: 32 bytes commit
+        :return: RLP encoded unsigned unlock transaction (the _rlpUnlockTxUnsigned argument of reveal())
+        '''
+        buf = bytearray(self._unsigned)
+        buf[self._unsignedCommitOffset:] = commit
+        return bytes(buf)
+
+    def unsignedHash(self, commit):
+        '''
+        :param commit: 32 bytes commit
+        :return: Keccak256 hash of the unsigned unlock transaction, the message R & S "sign"
+        '''
+        return keccak256(self.unsigned(commit))
+
+    def signed(self, commit, R, S):
+        '''
+        :param commit: 32 bytes commit
+        :param R: R of the signature
+        :param S: S of the signature
+        :return: RLP encoded signed unlock transaction, ready to be broadcast
+        '''
+        if R.bit_length() > 248 and S.bit_length() > 248:
+            buf = bytearray(self._signed)
+            offset = self._signedCommitOffset
+            buf[offset:offset + COMMIT_SIZE] = commit
+            offset = self._signedROffset
+            buf[offset:offset + 32] = R.to_bytes(32, byteorder='big')
+            offset = self._signedSOffset
+            buf[offset:offset + 32] = S.to_bytes(32, byteorder='big')
+            return bytes(buf)
+
+        # r or s has leading zero bytes, which RLP strips
+        return encodeList(self._head + commit + self._encodedV +
+                          encodeInt(R) + encodeInt(S))
+
+
+# Templates of recently used unlock transactions
+cachedTemplate = functools.lru_cache(maxsize=128)(UnlockTxTemplate)
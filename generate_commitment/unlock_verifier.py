@@ -0,0 +1,119 @@
+'''
+Bulk verification of signed TXunlock transactions.
+
+A relayer that accepts unlock transactions from users has to check, before
+broadcasting one, that it
+
+    - is a canonical RLP encoded transaction with nonce 0 and v 27
+    - is sent to the expected LibSubmarine contract (addressC)
+    - calls unlock(bytes32 commit), i.e. data = unlockFunctionSelector | commit
+    - has R = Keccak256(commit | 1) and S = Keccak256(commit | 0), so nobody
+      knows the private key of its sender
+    - recovers to the claimed address B
+
+verifyUnlockTxs() checks thousands of them on a pool of worker processes and
+returns a verdict with the reason of the first failed check per transaction.
+The recovery goes through unlock_recovery, i.e. libsecp256k1 when coincurve is
+installed.
+'''
+
+from collections import namedtuple
+
+from commit_hasher import deriveRS
+from unlock_recovery import recoverAddress
+from unlock_template import (COMMIT_SIZE, UNLOCK_FUNCTION_SELECTOR,
+                             cachedTemplate)
+import generate_submarine_commit
+
+
+class UnlockVerdict(
+        namedtuple('UnlockVerdict', ['valid', 'reason', 'addressB',
+                                     'commit'])):
+    '''
+    Result of verifyUnlockTx
+
+    valid: True if every check passed
+    reason: why the transaction was rejected, None if it is valid
+    addressB: 20 bytes address the transaction recovers to, None if it was not recovered
+    commit: 32 bytes commit (submarine ID) of the data, None if the data is not unlock(bytes32)
+    '''
+    __slots__ = ()
+
+
+def _int(x):
+    return int.from_bytes(x, byteorder='big')
+
+
+def verifyUnlockTx(rawTx, addressB, addressC, commit=None):
+    '''
+    :param rawTx: RLP encoded signed unlock transaction
+    :param addressB: 20 bytes address the transaction is claimed to be sent from
+    :param addressC: 20 bytes address of the LibSubmarine contract
+    :param commit: expected 32 bytes commit, not checked if None
+    :return: UnlockVerdict
+    '''
+    import rlp
+
+    try:
+        fields = rlp.decode(bytes(rawTx))
+    except Exception:
+        return UnlockVerdict(False, "Not RLP encoded", None, None)
+    if not isinstance(fields, list) or len(fields) != 9 or not all(
+            isinstance(field, bytes) for field in fields):
+        return UnlockVerdict(False, "Not a signed transaction", None, None)
+
+    nonce, gasPrice, gasLimit, to, value, data, V, R, S = fields
+    if _int(nonce) != 0:
+        return UnlockVerdict(False, "Nonce is not 0", None, None)
+    if _int(V) != 27:
+        return UnlockVerdict(False, "V is not 27", None, None)
+    if to != addressC:
+        return UnlockVerdict(False, "Not sent to the LibSubmarine contract",
+                             None, None)
+    if (len(data) != len(UNLOCK_FUNCTION_SELECTOR) + COMMIT_SIZE
+            or not data.startswith(UNLOCK_FUNCTION_SELECTOR)):
+        return UnlockVerdict(False, "Data is not unlock(bytes32)", None, None)
+
+    txCommit = data[len(UNLOCK_FUNCTION_SELECTOR):]
+    if commit is not None and txCommit != commit:
+        return UnlockVerdict(False, "Commit does not match", None, txCommit)
+
+    R, S = _int(R), _int(S)
+    if (R, S) != deriveRS(txCommit):
+        return UnlockVerdict(False, "R and S are not derived from the commit",
+                             None, txCommit)
+
+    template = cachedTemplate(_int(gasPrice), _int(gasLimit), to, _int(value))
+    if template.signed(txCommit, R, S) != rawTx:
+        return UnlockVerdict(False, "Not canonically encoded", None, txCommit)
+
+    recovered = recoverAddress(template.unsignedHash(txCommit), 27, R, S)
+    if recovered is None:
+        return UnlockVerdict(False, "Signature does not recover", None,
+                             txCommit)
+    if recovered != addressB:
+        return UnlockVerdict(False, "Recovers to 0x{}, not address B".format(
+            recovered.hex()), recovered, txCommit)
+    return UnlockVerdict(True, None, recovered, txCommit)
+
+
+def _verifyUnlockTxWorker(item):
+    '''
+    Internal function. Top level (picklable) wrapper around verifyUnlockTx
+    for verifyUnlockTxs().
+    '''
+    return verifyUnlockTx(*item)
+
+
+def verifyUnlockTxs(items, workers=None, chunksize=None):
+    '''
+    Batch version of verifyUnlockTx
+
+    :param items: iterable of (rawTx, addressB, addressC) or (rawTx, addressB, addressC, commit) tuples
+    :param workers: number of worker processes, defaults to the number of CPUs.
+                    1 verifies everything in the calling process.
+    :param chunksize: number of transactions handed to a worker at a time
+    :return: list of UnlockVerdict, in the same order as the items
+    '''
+    return generate_submarine_commit.mapRequests(_verifyUnlockTxWorker, items,
+                                                 workers, chunksize)
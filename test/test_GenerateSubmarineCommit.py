@@ -0,0 +1,1176 @@
+import argparse
+import asyncio
+import csv
+import http.client
+import io
+import itertools
+import json
+import logging
+import os
+import threading
+import time
+import rlp
+import subprocess
+import sys
+import tempfile
+import unittest
+import warnings
+from ethereum import transactions
+from ethereum.tools import tester as t
+from ethereum.utils import checksum_encode, normalize_address, sha3_256
+from test_utils import rec_hex, rec_bin
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(
+    os.path.join(os.path.dirname(__file__), '..', 'generate_commitment'))
+import commit_hasher
+import commit_server
+from commit_generator import SubmarineCommitGenerator
+import commitment_arena
+import commitment_journal
+from commitment_journal import (CommitmentJournal, FRAME_HEADER_SIZE,
+                                JournalError)
+from commitment_pool import CommitmentPool
+import commitment_store
+from async_commit_generator import AsyncCommitGenerator
+import entropy_pool
+import keccak
+from seeded_witness import WitnessDeriver, deriveWitness, templateHash
+import stage_stats
+import submarine_id
+import generate_submarine_commit
+import unlock_recovery
+import unlock_template
+import unlock_verifier
+from submarine_commitment import SubmarineCommitment, HEADER_SIZE
+
+UNLOCK_AMOUNT = 1337000000000000000
+OURGASLIMIT = 3712394
+OURGASPRICE = 10**6
+ALICE_ADDRESS = t.a1
+CONTRACT_ADDRESS = t.a7
+
+log = logging.getLogger('TestGenerateSubmarineCommit')
+LOGFORMAT = "%(levelname)s:%(filename)s:%(lineno)s:%(funcName)s(): %(message)s"
+log.setLevel(logging.getLevelName('INFO'))
+logHandler = logging.StreamHandler(stream=sys.stdout)
+logHandler.setFormatter(logging.Formatter(LOGFORMAT))
+log.addHandler(logHandler)
+
+
+def decode_unlock_tx(unlock_tx_hex):
+    unlock_tx_info = rlp.decode(rec_bin(unlock_tx_hex))
+    return transactions.Transaction(
+        int.from_bytes(unlock_tx_info[0], byteorder="big"),  # nonce;
+        int.from_bytes(unlock_tx_info[1], byteorder="big"),  # gasprice
+        int.from_bytes(unlock_tx_info[2], byteorder="big"),  # startgas
+        unlock_tx_info[3],  # to addr
+        int.from_bytes(unlock_tx_info[4], byteorder="big"),  # value
+        unlock_tx_info[5],  # data
+        int.from_bytes(unlock_tx_info[6], byteorder="big"),  # v
+        int.from_bytes(unlock_tx_info[7], byteorder="big"),  # r
+        int.from_bytes(unlock_tx_info[8], byteorder="big")  # s
+    )
+
+
+class TestGenerateSubmarineCommit(unittest.TestCase):
+    def setUp(self):
+        self.fromAddress = normalize_address(rec_hex(ALICE_ADDRESS))
+        self.toAddress = normalize_address(rec_hex(CONTRACT_ADDRESS))
+
+    def assertValidCommit(self, result, sendAmount, dappData=b'',
+                          gasPrice=OURGASPRICE, gasLimit=OURGASLIMIT):
+        addressB, commit, witness, unlock_tx_hex = result
+        unlock_tx_object = decode_unlock_tx(unlock_tx_hex)
+        self.assertEqual(addressB, rec_hex(unlock_tx_object.sender))
+        self.assertEqual(self.toAddress, unlock_tx_object.to)
+        self.assertEqual(sendAmount, unlock_tx_object.value)
+        self.assertEqual(gasPrice, unlock_tx_object.gasprice)
+        self.assertEqual(gasLimit, unlock_tx_object.startgas)
+        self.assertEqual(0, unlock_tx_object.nonce)
+        self.assertEqual(
+            generate_submarine_commit.unlockFunctionSelector + rec_bin(commit),
+            unlock_tx_object.data)
+        self.assertEqual(32, len(rec_bin(witness)))
+
+    def test_generateCommitAddresses_preserves_order(self):
+        requests = [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT + i, b'',
+                     OURGASPRICE, OURGASLIMIT) for i in range(16)]
+
+        results = generate_submarine_commit.generateCommitAddresses(
+            requests, workers=4)
+
+        self.assertEqual(len(requests), len(results))
+        for i, result in enumerate(results):
+            self.assertValidCommit(result, UNLOCK_AMOUNT + i)
+        self.assertEqual(len(requests), len(set(r[1] for r in results)),
+                         "Every commit must use a fresh witness.")
+
+    def test_generateCommitAddresses_single_worker(self):
+        requests = [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'',
+                     OURGASPRICE, OURGASLIMIT)]
+
+        results = generate_submarine_commit.generateCommitAddresses(
+            requests, workers=1)
+
+        self.assertEqual(1, len(results))
+        self.assertValidCommit(results[0], UNLOCK_AMOUNT)
+
+    def test_chunkRequests(self):
+        requests = list(range(10))
+        self.assertEqual(
+            (2, [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]]),
+            generate_submarine_commit.chunkRequests(requests, 2, 3))
+        # a few chunks per worker, and no more workers than requests
+        workers, chunks = generate_submarine_commit.chunkRequests(
+            list(range(80)), 2)
+        self.assertEqual((2, 8), (workers, len(chunks)))
+        self.assertEqual(list(range(80)), list(itertools.chain(*chunks)))
+        self.assertEqual(
+            10, generate_submarine_commit.chunkRequests(requests, 16)[0])
+        self.assertEqual(
+            (2, [requests[:4], requests[4:8], requests[8:]]),
+            generate_submarine_commit.chunkRequests(requests, 16,
+                                                    minChunkSize=4))
+        self.assertEqual((0, []),
+                         generate_submarine_commit.chunkRequests([], 4))
+
+    def test_generateCommitAddress_accepts_bytearrays(self):
+        result = generate_submarine_commit.generateCommitAddress(
+            bytearray(self.fromAddress), bytearray(self.toAddress),
+            UNLOCK_AMOUNT, bytearray(b'\x42'), OURGASPRICE, OURGASLIMIT)
+        self.assertValidCommit(result, UNLOCK_AMOUNT)
+
+        with SubmarineCommitGenerator(
+                bytearray(self.toAddress), OURGASPRICE, OURGASLIMIT,
+                workers=1) as generator:
+            commitment = generator.generate(bytearray(self.fromAddress),
+                                            UNLOCK_AMOUNT)
+            self.assertValidCommitment(commitment, UNLOCK_AMOUNT)
+
+    def test_generateFeeLadder(self):
+        gasPrices = [OURGASPRICE * 4, OURGASPRICE, OURGASPRICE * 2, OURGASPRICE]
+
+        ladder = generate_submarine_commit.generateFeeLadder(
+            self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'', gasPrices,
+            OURGASLIMIT, workers=2)
+
+        self.assertEqual(sorted(set(gasPrices)), sorted(ladder))
+        for gasPrice, result in ladder.items():
+            self.assertValidCommit(result, UNLOCK_AMOUNT, gasPrice=gasPrice)
+        self.assertEqual(3, len(set(result[0] for result in ladder.values())),
+                         "Every rung must have its own addressB.")
+
+    def assertValidCommitment(self, commitment, sendAmount, dappData=b''):
+        self.assertEqual(dappData, commitment.dappData)
+        self.assertValidCommit(
+            (rec_hex(commitment.addressB), rec_hex(commitment.commit),
+             rec_hex(commitment.witness), rec_hex(commitment.unlockTx())),
+            sendAmount)
+
+    def test_submarine_commit_generator(self):
+        requests = [(self.fromAddress, UNLOCK_AMOUNT + i, b'\x42' * (i % 3))
+                    for i in range(10)]
+        with SubmarineCommitGenerator(
+                self.toAddress, OURGASPRICE, OURGASLIMIT,
+                workers=2) as generator:
+            commitment = generator.generate(self.fromAddress, UNLOCK_AMOUNT)
+            self.assertValidCommitment(commitment, UNLOCK_AMOUNT)
+
+            # Same commit as the module function for the same witnesses
+            seed = b'\x01' * 32
+            seeded = generator.generate(
+                self.fromAddress, UNLOCK_AMOUNT, b'',
+                WitnessDeriver(seed).witnessSource(3, templateHash(
+                    self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'',
+                    OURGASPRICE, OURGASLIMIT)))
+            self.assertEqual(
+                generate_submarine_commit.generateCommitAddressFromSeed(
+                    seed, 3, self.fromAddress, self.toAddress, UNLOCK_AMOUNT,
+                    b'', OURGASPRICE, OURGASLIMIT),
+                (rec_hex(seeded.addressB), seeded.commit.hex(),
+                 seeded.witness.hex(), seeded.unlockTx().hex()))
+
+            commitments = generator.generateMany(requests)
+            self.assertEqual(len(requests), len(commitments))
+            for (_, sendAmount, dappData), commitment in zip(requests,
+                                                             commitments):
+                self.assertValidCommitment(commitment, sendAmount, dappData)
+
+            # Endless requests, only what is consumed is waited for
+            endless = ((self.fromAddress, UNLOCK_AMOUNT + i)
+                       for i in itertools.count())
+            commitments = list(
+                itertools.islice(generator.generateIter(endless, chunksize=2), 5))
+            for i, commitment in enumerate(commitments):
+                self.assertValidCommitment(commitment, UNLOCK_AMOUNT + i)
+
+        with self.assertRaises(ValueError):
+            generator.generateMany(requests)
+
+        # Closed is closed, also without a worker pool
+        generator = SubmarineCommitGenerator(self.toAddress, OURGASPRICE,
+                                             OURGASLIMIT, workers=1)
+        generator.close()
+        with self.assertRaises(ValueError):
+            generator.generate(self.fromAddress, UNLOCK_AMOUNT)
+        with self.assertRaises(ValueError):
+            generator.generateMany(requests)
+        with self.assertRaises(ValueError):
+            next(generator.generateIter(requests))
+
+    def test_submarine_commit_generator_backends(self):
+        keccakBackend = keccak.activeBackend()
+        secp256k1Backend = unlock_recovery.activeBackend()
+        generator = SubmarineCommitGenerator(
+            self.toAddress, OURGASPRICE, OURGASLIMIT, workers=1,
+            keccakBackend=keccakBackend, secp256k1Backend=secp256k1Backend)
+        self.assertEqual(keccakBackend, generator.keccakBackend)
+        self.assertEqual(secp256k1Backend, generator.secp256k1Backend)
+
+        # Never switches the backends of the whole process
+        otherKeccak = [
+            name for name in keccak.BACKEND_NAMES
+            if name != keccakBackend and keccak.loadBackend(name) is not None
+        ]
+        otherSecp256k1 = ("py_ecc" if secp256k1Backend == "coincurve" else
+                          "coincurve")
+        for kwargs in ([{"secp256k1Backend": otherSecp256k1}] +
+                       [{"keccakBackend": name} for name in otherKeccak]):
+            with self.assertRaises(ValueError):
+                SubmarineCommitGenerator(self.toAddress, OURGASPRICE,
+                                         OURGASLIMIT, workers=1, **kwargs)
+        self.assertEqual(keccakBackend, keccak.activeBackend())
+        self.assertEqual(secp256k1Backend, unlock_recovery.activeBackend())
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_submarine_commit_generator_fork(self):
+        generator = SubmarineCommitGenerator(
+            self.toAddress, OURGASPRICE, OURGASLIMIT, workers=2)
+        try:
+            generator.generateMany([(self.fromAddress, UNLOCK_AMOUNT)] * 2)
+
+            read_fd, write_fd = os.pipe()
+            pid = os.fork()
+            if pid == 0:
+                os.close(read_fd)
+                try:
+                    # The parent's pool is not usable in the child
+                    ok = (generator._executor is None and
+                          generator.generate(self.fromAddress, UNLOCK_AMOUNT))
+                    os.write(write_fd, b'1' if ok else b'0')
+                finally:
+                    os._exit(0)
+            os.close(write_fd)
+            result = os.read(read_fd, 1)
+            os.close(read_fd)
+            os.waitpid(pid, 0)
+            self.assertEqual(b'1', result)
+            self.assertIsNotNone(generator._executor)
+        finally:
+            generator.close()
+
+    def test_commitment_pool(self):
+        with CommitmentPool(size=3, workers=2) as pool:
+            key = pool.register(self.fromAddress, self.toAddress,
+                                UNLOCK_AMOUNT, b'', OURGASPRICE, OURGASLIMIT)
+            for _ in range(600):
+                if pool.available(key) == 3:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(3, pool.available(key))
+
+            commitments = [pool.take(key) for _ in range(8)]
+            self.assertGreaterEqual(pool.hits, 3)
+            self.assertEqual(8, pool.hits + pool.misses)
+
+        for commitment in commitments:
+            self.assertValidCommit(
+                (rec_hex(commitment.addressB), rec_hex(commitment.commit),
+                 rec_hex(commitment.witness), rec_hex(commitment.unlockTx())),
+                UNLOCK_AMOUNT)
+        self.assertEqual(8, len(set(c.witness for c in commitments)),
+                         "A witness must never be handed out twice.")
+        with self.assertRaises(KeyError):
+            pool.take((self.fromAddress, self.toAddress, 1, b'', 1, 1))
+
+    def test_unlock_recovery_matches_pyethereum(self):
+        activeBackend = unlock_recovery.activeBackend()
+        for backend in set([activeBackend, "py_ecc"]):
+            unlock_recovery.BACKEND = backend
+            try:
+                tx, addressB, commit, witness = generate_submarine_commit._generateAddressBInternal(
+                    self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'',
+                    OURGASPRICE, OURGASLIMIT)
+            finally:
+                unlock_recovery.BACKEND = activeBackend
+            unlock_tx_object = decode_unlock_tx(rec_hex(rlp.encode(tx)))
+            self.assertEqual(addressB, rec_hex(unlock_tx_object.sender),
+                             "Recovery with {} does not match pyethereum".format(backend))
+
+    def test_sampler_stats(self):
+        generate_submarine_commit.samplerStats.reset()
+        for _ in range(8):
+            generate_submarine_commit.generateCommitAddress(
+                self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'',
+                OURGASPRICE, OURGASLIMIT)
+
+        stats = generate_submarine_commit.getSamplerStats()
+        log.info("Sampler stats: {}".format(stats))
+        self.assertEqual(8, stats["commits"])
+        self.assertEqual(0, stats["failures"])
+        self.assertEqual(8, sum(stats["attemptsPerCommit"].values()))
+        self.assertEqual(stats["attempts"],
+                         8 + sum(stats["rejections"].values()))
+
+    def test_sampler_attempt_cap(self):
+        generate_submarine_commit.samplerStats.reset()
+        with self.assertRaises(generate_submarine_commit.CommitGenerationError):
+            generate_submarine_commit.generateCommitAddress(
+                self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'',
+                OURGASPRICE, OURGASLIMIT, maxAttempts=0)
+        self.assertEqual(1, generate_submarine_commit.getSamplerStats()["failures"])
+
+    def test_stage_stats(self):
+        seed = b'\x01' * 32
+        args = (self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'',
+                OURGASPRICE, OURGASLIMIT)
+        untimed = generate_submarine_commit.generateCommitAddressFromSeed(
+            seed, 3, *args)
+        generate_submarine_commit.samplerStats.reset()
+        stats = generate_submarine_commit.enableStageStats()
+        try:
+            timed = generate_submarine_commit.generateCommitAddressFromSeed(
+                seed, 3, *args)
+            for _ in range(4):
+                generate_submarine_commit.generateCommitAddress(*args)
+        finally:
+            generate_submarine_commit.setStageHook(None)
+        # Timing doesn't change what is generated
+        self.assertEqual(untimed, timed)
+
+        snapshot = stats.snapshot()
+        log.info("Stage stats: {}".format(snapshot))
+        attempts = generate_submarine_commit.getSamplerStats()["attempts"]
+        for stage in [stage_stats.STAGE_WITNESS, stage_stats.STAGE_COMMIT,
+                      stage_stats.STAGE_RS]:
+            self.assertEqual(attempts, snapshot[stage]["count"])
+            self.assertEqual(attempts - 5, snapshot[stage]["retries"])
+            self.assertEqual(attempts,
+                             sum(snapshot[stage]["histogramUs"].values()))
+        self.assertGreaterEqual(snapshot[stage_stats.STAGE_RECOVERY]["count"], 5)
+        self.assertEqual(5, snapshot[stage_stats.STAGE_ENCODING]["count"])
+        self.assertEqual(0, snapshot[stage_stats.STAGE_ENCODING]["retries"])
+
+    def test_entropy_pool(self):
+        pool = entropy_pool.EntropyPool(blockSize=64)
+        witnesses = [pool.witness() for _ in range(100)]
+        self.assertTrue(all(len(w) == 32 for w in witnesses))
+        self.assertEqual(len(witnesses), len(set(witnesses)))
+
+    @unittest.skipUnless(hasattr(os, "fork"), "requires os.fork")
+    def test_entropy_pool_fork_safe(self):
+        pool = entropy_pool.EntropyPool()
+        pool.witness()  # fill the buffer before forking
+
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(read_fd)
+            os.write(write_fd, pool.witness())
+            os._exit(0)
+        os.close(write_fd)
+        child_witness = os.read(read_fd, 32)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+
+        self.assertNotEqual(pool.witness(), child_witness,
+                            "A child process must not reuse the parent's buffer.")
+
+    def test_generateCommitAddressFromSeed_is_deterministic(self):
+        seed = b"\x42" * 32
+        requests = [(index, self.fromAddress, self.toAddress,
+                     UNLOCK_AMOUNT + index, b'', OURGASPRICE, OURGASLIMIT)
+                    for index in range(8)]
+
+        results = generate_submarine_commit.generateCommitAddressesFromSeed(
+            seed, requests, workers=2)
+
+        for request, result in zip(requests, results):
+            self.assertValidCommit(result, request[3])
+            self.assertEqual(
+                result,
+                generate_submarine_commit.generateCommitAddressFromSeed(
+                    seed, *request))
+        self.assertEqual(len(requests), len(set(r[1] for r in results)))
+        self.assertNotEqual(
+            results[0],
+            generate_submarine_commit.generateCommitAddressFromSeed(
+                b"\x43" * 32, *requests[0]))
+
+        # The witness is bound to the commit parameters, reusing an index for
+        # another amount gives another witness
+        otherAmount = requests[0][:3] + (UNLOCK_AMOUNT + 100,) + requests[0][4:]
+        self.assertNotEqual(
+            results[0][2],
+            generate_submarine_commit.generateCommitAddressFromSeed(
+                seed, *otherAmount)[2])
+
+        template = templateHash(self.fromAddress, self.toAddress,
+                                UNLOCK_AMOUNT, b'', OURGASPRICE, OURGASLIMIT)
+        self.assertIn(
+            rec_bin(results[0][2]),
+            [deriveWitness(seed, 0, template, attempt) for attempt in range(256)])
+
+    def test_commit_hasher_matches_full_hash(self):
+        dappData = os.urandom(1000)
+        hasher = commit_hasher.CommitHasher(self.fromAddress, self.toAddress,
+                                            UNLOCK_AMOUNT, dappData,
+                                            OURGASPRICE, OURGASLIMIT)
+        for _ in range(4):
+            w = entropy_pool.randomWitness()
+            fullCommit = (self.fromAddress + self.toAddress +
+                          UNLOCK_AMOUNT.to_bytes(32, byteorder='big') +
+                          dappData + w +
+                          OURGASPRICE.to_bytes(32, byteorder='big') +
+                          OURGASLIMIT.to_bytes(32, byteorder='big'))
+            commit = hasher.commit(w)
+            self.assertEqual(sha3_256(fullCommit), commit)
+            self.assertEqual(
+                (int.from_bytes(sha3_256(commit + b'\x01'), byteorder='big'),
+                 int.from_bytes(sha3_256(commit + b'\x00'), byteorder='big')),
+                commit_hasher.deriveRS(commit))
+
+    def test_cli_keeps_heavy_modules_out(self):
+        # The command line tool runs in short lived jobs. Its start up stays
+        # cheap as long as it doesn't load ethereum or rlp, timing is left to
+        # the benchmark.
+        script = ("import runpy, sys\n"
+                  "sys.argv = ['generate_submarine_commit.py'] + sys.argv[1:]\n"
+                  "try:\n"
+                  "    if len(sys.argv) == 1:\n"
+                  "        import generate_submarine_commit\n"
+                  "    else:\n"
+                  "        runpy.run_path(sys.argv[0], run_name='__main__')\n"
+                  "except SystemExit:\n"
+                  "    pass\n"
+                  "heavy = ['ethereum', 'rlp', 'py_ecc', 'solc', 'test_utils']\n"
+                  "print('Loaded:', [m for m in heavy if m in sys.modules])\n")
+        generateDir = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                   '..', 'generate_commitment')
+
+        def run(*args):
+            output = subprocess.check_output(
+                [sys.executable, "-c", script] + list(args),
+                cwd=generateDir, universal_newlines=True)
+            return dict(line.split(": ", 1) for line in output.splitlines()
+                        if ": " in line)
+
+        # Importing the module and --help
+        self.assertEqual("[]", run()["Loaded"])
+        self.assertEqual("[]", run("-h")["Loaded"])
+
+        # A single commit only needs Keccak256 and secp256k1
+        fromAddress = checksum_encode(self.fromAddress)
+        targetAddress = checksum_encode(self.toAddress)
+        self.assertEqual(
+            self.fromAddress,
+            generate_submarine_commit._parseAddress(fromAddress, "From"))
+        with self.assertRaises(ValueError):
+            generate_submarine_commit._parseAddress(fromAddress.lower(), "From")
+        values = run("-f", fromAddress, "-t", targetAddress, "-a",
+                     str(UNLOCK_AMOUNT), "-p", str(OURGASPRICE), "-l",
+                     str(OURGASLIMIT))
+        expectedLoaded = ([] if unlock_recovery.activeBackend() == "coincurve"
+                          else ['py_ecc'])
+        self.assertEqual(str(expectedLoaded), values["Loaded"])
+        self.assertValidCommit(
+            (values["AddressB"], values["commit"], values["witness (w)"],
+             values["Reveal Transaction (hex)"]), UNLOCK_AMOUNT)
+
+    def test_keccak_backends_agree(self):
+        inputs = [b'', b'\x01', bytes(range(136)), os.urandom(1000)]
+        activeBackend = keccak.activeBackend()
+        log.info("Keccak256 backends: {}, using {}".format(
+            keccak.benchmark(), activeBackend))
+        self.assertIn("ethereum", keccak.availableBackends())
+        try:
+            for backend in keccak.availableBackends():
+                keccak.setBackend(backend)
+                self.assertEqual([sha3_256(x) for x in inputs],
+                                 keccak.keccak256Batch(inputs), backend)
+                hasher = commit_hasher.CommitHasher(
+                    self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'\x42',
+                    OURGASPRICE, OURGASLIMIT)
+                self.assertEqual(
+                    sha3_256(self.fromAddress + self.toAddress +
+                             commit_hasher.aux(UNLOCK_AMOUNT) + b'\x42' +
+                             inputs[2][:32] + commit_hasher.aux(OURGASPRICE) +
+                             commit_hasher.aux(OURGASLIMIT)),
+                    hasher.commit(inputs[2][:32]), backend)
+                commit = inputs[2][:32]
+                self.assertEqual(
+                    (int.from_bytes(sha3_256(commit + b'\x01'), 'big'),
+                     int.from_bytes(sha3_256(commit + b'\x00'), 'big')),
+                    commit_hasher.deriveRS(commit), backend)
+        finally:
+            keccak.setBackend(activeBackend)
+
+        # Backends that clone states win the selection, whatever the timings
+        self.assertEqual(keccak.MODE_PREFIX_CLONE, keccak.loadBackend("pysha3").mode)
+        self.assertEqual(keccak.MODE_FULL_PREIMAGE,
+                         keccak.loadBackend("ethereum").mode)
+        environ = os.environ.pop(keccak.BACKEND_ENV, None)
+        benchmark = keccak.benchmark
+        try:
+            keccak.benchmark = lambda names=None: {
+                name: (1.0 if name == "pysha3" else 0.1)
+                for name in (names or keccak.BACKEND_NAMES)
+                if keccak.loadBackend(name) is not None
+            }
+            keccak._active = None
+            self.assertEqual("pysha3", keccak.activeBackend())
+            self.assertEqual(keccak.MODE_PREFIX_CLONE, keccak.activeMode())
+        finally:
+            keccak.benchmark = benchmark
+            if environ is not None:
+                os.environ[keccak.BACKEND_ENV] = environ
+            keccak.setBackend(activeBackend)
+
+        buffer = b''.join(os.urandom(52) for _ in range(10))
+        self.assertEqual(
+            [sha3_256(buffer[i:i + 52]) for i in range(0, len(buffer), 52)],
+            keccak.keccak256Batch(buffer, itemSize=52))
+        with self.assertRaises(ValueError):
+            keccak.keccak256Batch(buffer, itemSize=51)
+
+    def test_getSubmarineIds_matches_encodePacked(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")  # packed mode is experimental
+            from eth_abi.packed import encode_abi_packed
+        requests = [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT + i,
+                     os.urandom(i % 3 * 17), os.urandom(32), OURGASPRICE + i,
+                     OURGASLIMIT) for i in range(12)]
+        expected = [
+            sha3_256(
+                encode_abi_packed([
+                    'address', 'address', 'uint256', 'bytes', 'bytes32',
+                    'uint256', 'uint256'
+                ], list(r)))
+            for r in requests
+        ]
+
+        self.assertEqual(expected, submarine_id.getSubmarineIds(requests))
+        self.assertEqual(expected[5], submarine_id.getSubmarineId(*requests[5]))
+
+        minChunkSize = submarine_id.MIN_CHUNK_SIZE
+        submarine_id.MIN_CHUNK_SIZE = 2
+        try:
+            self.assertEqual(expected, submarine_id.getSubmarineIds(
+                requests, workers=2, chunksize=5))
+        finally:
+            submarine_id.MIN_CHUNK_SIZE = minChunkSize
+
+        commitment = generate_submarine_commit.generateCommitment(
+            self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'\x42' * 40,
+            OURGASPRICE, OURGASLIMIT)
+        self.assertEqual(commitment.submarineId, submarine_id.getSubmarineId(
+            self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'\x42' * 40,
+            commitment.witness, OURGASPRICE, OURGASLIMIT))
+
+    def test_verifyUnlockTxs(self):
+        commitments = generate_submarine_commit.generateCommitments(
+            [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'',
+              OURGASPRICE, OURGASLIMIT)] * 3, workers=1)
+        good, other, third = commitments
+        unlockTx = good.unlockTx()
+        fields = rlp.decode(unlockTx)
+
+        def reencode(index, value):
+            return rlp.encode(fields[:index] + [value] + fields[index + 1:])
+
+        items = [
+            (unlockTx, good.addressB, self.toAddress),
+            (unlockTx, good.addressB, self.toAddress, good.commit),
+            (unlockTx, other.addressB, self.toAddress),
+            (unlockTx, good.addressB, other.addressB),
+            (unlockTx, good.addressB, self.toAddress, other.commit),
+            (reencode(0, b'\x01'), good.addressB, self.toAddress),
+            (reencode(6, b'\x1c'), good.addressB, self.toAddress),
+            (reencode(5, other.unsignedUnlockTx()[-36:]), good.addressB,
+             self.toAddress),
+            (reencode(7, fields[7][1:]), good.addressB, self.toAddress),
+            (reencode(2, b'\x00' + fields[2]), good.addressB, self.toAddress),
+            (unlockTx[:-1], good.addressB, self.toAddress),
+            (rlp.encode(fields[:6]), good.addressB, self.toAddress),
+            (third.unlockTx(), third.addressB, self.toAddress),
+        ]
+
+        verdicts = unlock_verifier.verifyUnlockTxs(items, workers=2)
+
+        self.assertEqual([
+            None,
+            None,
+            "Recovers to 0x{}, not address B".format(good.addressB.hex()),
+            "Not sent to the LibSubmarine contract",
+            "Commit does not match",
+            "Nonce is not 0",
+            "V is not 27",
+            "R and S are not derived from the commit",
+            "R and S are not derived from the commit",
+            "Not canonically encoded",
+            "Not RLP encoded",
+            "Not a signed transaction",
+            None,
+        ], [verdict.reason for verdict in verdicts])
+        self.assertEqual([True, True] + [False] * 10 + [True],
+                         [verdict.valid for verdict in verdicts])
+        self.assertEqual(good.addressB, verdicts[0].addressB)
+        self.assertEqual(good.commit, verdicts[0].commit)
+
+    def test_unlock_template_matches_rlp_encode(self):
+        template = unlock_template.UnlockTxTemplate(
+            OURGASPRICE, OURGASLIMIT, self.toAddress, UNLOCK_AMOUNT)
+        commit = os.urandom(32)
+        data = generate_submarine_commit.unlockFunctionSelector + commit
+
+        unsigned_tx_object = transactions.UnsignedTransaction(
+            0, OURGASPRICE, OURGASLIMIT, self.toAddress, UNLOCK_AMOUNT, data)
+        self.assertEqual(
+            rlp.encode(unsigned_tx_object, transactions.UnsignedTransaction),
+            template.unsigned(commit))
+
+        # full width r & s, and r & s with leading zero bytes
+        for R, S in [(2**256 - 5, 2**255 + 7), (2**200 + 1, 2**255 + 3),
+                     (2**255 + 3, 5), (127, 128)]:
+            tx = transactions.Transaction(0, OURGASPRICE, OURGASLIMIT,
+                                          self.toAddress, UNLOCK_AMOUNT, data,
+                                          27, R, S)
+            self.assertEqual(rlp.encode(tx), template.signed(commit, R, S))
+
+    def test_unlock_template_readme_example(self):
+        unlock_tx_hex = (
+            "f88f80850ba43b74008338a58a947aeb1fd3a42731c4ae80870044c992eb689fb2fe"
+            "866fde2b4eb000a4ec9b5b3a79ae69adf744d9ccc88d487d7bb7be0f948c2902b016"
+            "abb5b34bec2b554c45611ba0a70e779dca3a47d95401253d02a82ced651a1b934ec8"
+            "8e5c8736f7dd6ee4e374a015aa9000feec7034f94ad3bba2234310015a82e6d11acf"
+            "1a0f900129a001e5b4")
+        unlock_tx_object = decode_unlock_tx(unlock_tx_hex)
+        template = unlock_template.UnlockTxTemplate(
+            unlock_tx_object.gasprice, unlock_tx_object.startgas,
+            unlock_tx_object.to, unlock_tx_object.value)
+        self.assertEqual(
+            rec_bin(unlock_tx_hex),
+            template.signed(unlock_tx_object.data[4:], unlock_tx_object.r,
+                            unlock_tx_object.s))
+        self.assertEqual(unlock_tx_object.sender,
+                         unlock_recovery.recoverAddress(
+                             template.unsignedHash(unlock_tx_object.data[4:]),
+                             27, unlock_tx_object.r, unlock_tx_object.s))
+
+    def test_generateCommitAddressBytes(self):
+        requests = [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT + i, b'',
+                     OURGASPRICE, OURGASLIMIT) for i in range(4)]
+
+        results = generate_submarine_commit.generateCommitAddressesBytes(
+            requests, workers=2)
+
+        for i, result in enumerate(results):
+            self.assertEqual(20, len(result.addressB))
+            self.assertEqual(32, len(result.commit))
+            self.assertEqual(32, len(result.witness))
+            self.assertEqual(result.addressB,
+                             decode_unlock_tx(rec_hex(result.unlockTx)).sender)
+            self.assertValidCommit(result.hex(), UNLOCK_AMOUNT + i)
+
+    def test_submarine_commitment_record(self):
+        requests = [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT, dappData,
+                     OURGASPRICE, OURGASLIMIT)
+                    for dappData in [b'', b'\x01' * 100]]
+
+        commitments = generate_submarine_commit.generateCommitments(
+            requests, workers=2)
+
+        for request, commitment in zip(requests, commitments):
+            self.assertEqual(HEADER_SIZE + len(request[3]),
+                             len(commitment.pack()))
+            self.assertEqual(commitment,
+                             SubmarineCommitment.unpack(commitment.pack()))
+
+            unlock_tx_object = decode_unlock_tx(rec_hex(commitment.unlockTx()))
+            self.assertEqual(commitment.addressB, unlock_tx_object.sender)
+            self.assertEqual(generate_submarine_commit.unlockFunctionSelector +
+                             commitment.commit, unlock_tx_object.data)
+
+            unsigned_tx_object = transactions.UnsignedTransaction(
+                0, OURGASPRICE, OURGASLIMIT, self.toAddress, UNLOCK_AMOUNT,
+                unlock_tx_object.data)
+            self.assertEqual(
+                (42, request[3], commitment.witness,
+                 rlp.encode(unsigned_tx_object,
+                            transactions.UnsignedTransaction), b'proof'),
+                commitment.revealArgs(42, b'proof'))
+
+        buffer = bytearray(sum(c.packedSize for c in commitments))
+        offset = 0
+        for commitment in commitments:
+            offset = commitment.packInto(buffer, offset)
+        offset = 0
+        for commitment in commitments:
+            unpacked, offset = SubmarineCommitment.unpackFrom(buffer, offset)
+            self.assertEqual(commitment, unpacked)
+
+        # Never padded or truncated into another address or hash
+        for name, value in [("addressA", self.fromAddress[1:]),
+                            ("addressC", self.toAddress + b'\x00'),
+                            ("witness", b'\x01' * 31),
+                            ("commit", b'\x01' * 33),
+                            ("addressB", b'')]:
+            commitment = SubmarineCommitment.unpack(commitments[0].pack())
+            setattr(commitment, name, value)
+            with self.assertRaises(ValueError):
+                commitment.pack()
+            with self.assertRaises(ValueError):
+                commitment.packInto(bytearray(commitment.packedSize))
+
+    def test_commitment_arena(self):
+        requests = [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT + i,
+                     b'\x42' * (i % 3 * 20), OURGASPRICE, OURGASLIMIT)
+                    for i in range(10)]
+        for workers in (1, 3):
+            with commitment_arena.generateCommitmentArena(
+                    requests, workers=workers, chunksize=2) as arena:
+                self.assertEqual(len(requests), len(arena))
+                if workers > 1 and commitment_arena.shared_memory is not None:
+                    self.assertIsNotNone(arena.name)
+                commitments = list(arena)
+                for i, commitment in enumerate(commitments):
+                    self.assertEqual(commitment, arena[i])
+                    self.assertEqual(commitment.pack(), bytes(arena.record(i)))
+                    self.assertEqual(requests[i][3], commitment.dappData)
+                    self.assertValidCommit(
+                        (rec_hex(commitment.addressB),
+                         rec_hex(commitment.commit),
+                         rec_hex(commitment.witness),
+                         rec_hex(commitment.unlockTx())), UNLOCK_AMOUNT + i)
+            self.assertEqual(len(requests),
+                             len(set(c.witness for c in commitments)))
+
+        # Python < 3.8 copies the packed records back instead
+        sharedMemory = commitment_arena.shared_memory
+        commitment_arena.shared_memory = None
+        try:
+            with commitment_arena.generateCommitmentArena(
+                    requests, workers=3, chunksize=2) as arena:
+                self.assertIsNone(arena.name)
+                for i, commitment in enumerate(arena):
+                    self.assertEqual(requests[i][3], commitment.dappData)
+                    self.assertEqual(UNLOCK_AMOUNT + i, commitment.value)
+        finally:
+            commitment_arena.shared_memory = sharedMemory
+
+    def test_commitment_journal(self):
+        commitments = generate_submarine_commit.generateCommitments(
+            [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT + i,
+              b'\x42' * i, OURGASPRICE, OURGASLIMIT) for i in range(41)],
+            workers=1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "commitments.journal")
+            # Small growth steps, so appends have to grow the file
+            with CommitmentJournal(path, growth=4096) as journal:
+                journal.append(commitments[0])
+                journal.appendMany(commitments[1:30])
+                threads = [
+                    threading.Thread(target=journal.append, args=(c, ))
+                    for c in commitments[30:40]
+                ]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                self.assertEqual(40, len(journal))
+                self.assertEqual(commitments[7], journal.getBySubmarineId(
+                    commitments[7].submarineId))
+                self.assertEqual(commitments[35], journal.getByAddressB(
+                    commitments[35].addressB))
+                self.assertIsNone(journal.getByAddressB(b'\x00' * 20))
+
+            with CommitmentJournal(path) as journal:
+                self.assertEqual(40, len(journal))
+                self.assertEqual(commitments[:30], list(journal)[:30])
+                self.assertEqual(
+                    sorted(c.commit for c in commitments[:40]),
+                    sorted(c.commit for c in journal))
+                lastOffset = journal.append(commitments[40])
+
+            # A torn append of the last record, the process died before the
+            # checkpoint covering it was written. It is dropped on open, and
+            # the journal continues behind the last intact record.
+            with open(path, "r+b") as f:
+                f.seek(commitment_journal.CHECKPOINT_OFFSET)
+                f.write(lastOffset.to_bytes(8, byteorder='big'))
+                f.seek(lastOffset + FRAME_HEADER_SIZE + 1)
+                f.write(b'\xff')
+            with CommitmentJournal(path) as journal:
+                self.assertEqual(40, len(journal))
+                self.assertIsNone(journal.getBySubmarineId(
+                    commitments[40].submarineId))
+                journal.append(commitments[40])
+            with CommitmentJournal(path) as journal:
+                self.assertEqual(41, len(journal))
+                self.assertEqual(commitments[40], list(journal)[-1])
+
+    def test_commitment_journal_damaged_middle(self):
+        commitments = generate_submarine_commit.generateCommitments(
+            [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT + i, b'',
+              OURGASPRICE, OURGASLIMIT) for i in range(5)],
+            workers=1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "commitments.journal")
+            with CommitmentJournal(path) as journal:
+                offsets = journal.appendMany(commitments)
+
+            for position in (offsets[1] + FRAME_HEADER_SIZE + 1, offsets[1]):
+                with open(path, "rb") as f:
+                    intact = f.read()
+                damaged = bytearray(intact)
+                # A flipped byte in record 1, then a zeroed frame header
+                damaged[position] ^= 0xff
+                if position == offsets[1]:
+                    damaged[position:position + FRAME_HEADER_SIZE] = bytes(
+                        FRAME_HEADER_SIZE)
+                with open(path, "wb") as f:
+                    f.write(damaged)
+
+                # The acknowledged records behind it must survive
+                with self.assertRaises(JournalError):
+                    CommitmentJournal(path)
+                with open(path, "rb") as f:
+                    self.assertEqual(bytes(damaged), f.read())
+
+                # Explicitly truncated behind the last intact record
+                self.assertEqual(1, commitment_journal.repair(path))
+                with CommitmentJournal(path) as journal:
+                    self.assertEqual(commitments[:1], list(journal))
+                    journal.append(commitments[1])
+                with CommitmentJournal(path) as journal:
+                    self.assertEqual(commitments[:2], list(journal))
+
+                with open(path, "wb") as f:
+                    f.write(intact)
+                with CommitmentJournal(path) as journal:
+                    self.assertEqual(commitments, list(journal))
+
+            # Records 3 and 4 were never acknowledged, and only 4 reached the
+            # disk before a crash. 3 is the end of the journal, 4 is dropped.
+            with open(path, "r+b") as f:
+                f.seek(commitment_journal.CHECKPOINT_OFFSET)
+                f.write(offsets[3].to_bytes(8, byteorder='big'))
+                f.seek(offsets[3])
+                f.write(bytes(FRAME_HEADER_SIZE))
+            with CommitmentJournal(path) as journal:
+                self.assertEqual(commitments[:3], list(journal))
+                self.assertIsNone(journal.getBySubmarineId(
+                    commitments[4].submarineId))
+                journal.append(commitments[4])
+            with CommitmentJournal(path) as journal:
+                self.assertEqual(commitments[:3] + commitments[4:], list(journal))
+
+    def test_commitment_store(self):
+        commitments = generate_submarine_commit.generateCommitments(
+            [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT + i,
+              b'\x42' * i, OURGASPRICE, OURGASLIMIT) for i in range(6)],
+            workers=1)
+        ids = [c.submarineId for c in commitments]
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "sessions.sqlite")
+            with commitment_store.CommitmentStore(path) as store:
+                self.assertEqual(6, store.putCommitments(commitments))
+                self.assertEqual(0, store.putCommitments(commitments[:2]))
+                # A changed record replaces the one of a GENERATED session
+                changed = [
+                    SubmarineCommitment.unpack(c.pack()) for c in commitments[:2]
+                ]
+                for c in changed:
+                    c.r += 1
+                self.assertEqual(2, store.putCommitments(changed))
+                self.assertEqual(changed[0],
+                                 store.getBySubmarineId(ids[0]).commitment)
+                self.assertEqual(2, store.putCommitments(commitments[:2]))
+                self.assertEqual(5, store.markCommitted(
+                    [(ids[i], 100 + i // 2, 5 - i) for i in range(5)]))
+                self.assertEqual(2, store.markRevealed(ids[:2]))
+                # Unlocked before the reveal: still awaits the reveal
+                self.assertEqual(3, store.markUnlocked([ids[0], ids[1], ids[2]]))
+                # A late commit notification doesn't move a session back
+                store.markCommitted([(ids[0], 100, 5)])
+                # Nor does a re-put change the record of a committed session
+                self.assertEqual(0, store.putCommitments(changed))
+
+            with commitment_store.CommitmentStore(path) as store:
+                self.assertEqual({
+                    "generated": 1,
+                    "committed": 3,
+                    "revealed": 0,
+                    "unlocked": 2
+                }, store.countByState())
+                session = store.getByAddressB(commitments[3].addressB)
+                self.assertEqual(commitments[3], session.commitment)
+                self.assertEqual((commitment_store.COMMITTED, 101, 2, False),
+                                 session[1:])
+                self.assertEqual(commitments[0],
+                                 store.getBySubmarineId(ids[0]).commitment)
+                self.assertEqual(
+                    commitment_store.GENERATED,
+                    store.getBySubmarineId(ids[5]).state)
+                self.assertIsNone(store.getBySubmarineId(b'\x00' * 32))
+                self.assertEqual(
+                    [ids[3], ids[2]],
+                    [s.commitment.submarineId for s in store.getByCommitBlock(101)])
+                awaiting = store.awaitingReveal(102)
+                self.assertEqual([ids[3], ids[2]],
+                                 [s.commitment.submarineId for s in awaiting])
+                # ids[2] was unlocked before its reveal
+                self.assertEqual([False, True], [s.unlocked for s in awaiting])
+                self.assertEqual(
+                    [ids[3], ids[2], ids[4]],
+                    [s.commitment.submarineId for s in store.awaitingReveal(103)])
+                store.markRevealed([ids[2]])
+                self.assertEqual(commitment_store.UNLOCKED,
+                                 store.getBySubmarineId(ids[2]).state)
+
+    def test_stream_mode(self):
+        args = argparse.Namespace(
+            from_address=checksum_encode(self.fromAddress),
+            target_address=checksum_encode(self.toAddress),
+            amount=None,
+            dapp_data="",
+            gas_price=OURGASPRICE,
+            gas_limit=OURGASLIMIT,
+            workers=2,
+            batch_size=3)
+        requests = [{"id": i, "amount": UNLOCK_AMOUNT + i} for i in range(10)]
+        requests.insert(4, {"id": "bad", "from": "0x1234"})
+        requests.insert(6, {"id": "bad", "amount": -5})
+        requests.insert(8, {"id": "bad", "amount": 1, "gasPrice": 2**256})
+        # Never truncated or coerced into another amount
+        requests.insert(9, {"id": "bad", "amount": 1.7})
+        requests.insert(10, {"id": "bad", "amount": True})
+        requests.insert(11, {"id": "bad", "amount": "1e3"})
+        requests.insert(12, {"id": "bad", "amount": 1, "gasLimit": 3e6})
+        inStream = io.StringIO("\n".join(json.dumps(r) for r in requests))
+        outStream = io.StringIO()
+
+        generate_submarine_commit._stream(args, inStream, outStream)
+
+        results = [json.loads(line) for line in outStream.getvalue().splitlines()]
+        self.assertEqual([r["id"] for r in requests], [r["id"] for r in results])
+        for request, result in zip(requests, results):
+            if request["id"] == "bad":
+                self.assertIn("error", result)
+                continue
+            self.assertValidCommit((result["addressB"], result["commit"],
+                                    result["witness"], result["unlockTx"]),
+                                   request["amount"])
+
+        # The chunk worker on its own, as the commit server uses it
+        results = generate_submarine_commit.processStreamChunk(
+            ['{"amount": 1}', '[]'], {
+                "from": checksum_encode(self.fromAddress),
+                "target": checksum_encode(self.toAddress),
+                "dappData": "",
+                "gasPrice": OURGASPRICE,
+                "gasLimit": OURGASLIMIT
+            })
+        result, error = [json.loads(line) for line in results]
+        self.assertValidCommit((result["addressB"], result["commit"],
+                                result["witness"], result["unlockTx"]), 1)
+        self.assertEqual({"error": "Request is not a JSON object"}, error)
+
+    def test_count_mode(self):
+        request = (self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'',
+                   OURGASPRICE, OURGASLIMIT)
+        for outputFormat in ["csv", "jsonl"]:
+            args = argparse.Namespace(
+                count=7, batch_size=2, workers=2, format=outputFormat)
+            outStream = io.StringIO()
+
+            generate_submarine_commit._bulk(args, request, outStream)
+
+            outStream.seek(0)
+            if outputFormat == "csv":
+                rows = list(csv.DictReader(outStream))
+            else:
+                rows = [json.loads(line) for line in outStream]
+            self.assertEqual(7, len(rows))
+            for row in rows:
+                self.assertValidCommit((row["addressB"], row["commit"],
+                                        row["witness"], row["unlockTx"]),
+                                       UNLOCK_AMOUNT)
+
+    def test_async_commit_generator(self):
+        requests = [(self.fromAddress, self.toAddress, UNLOCK_AMOUNT + i, b'',
+                     OURGASPRICE, OURGASLIMIT) for i in range(6)]
+        ticks = []
+
+        async def ticker(done):
+            while not done.is_set():
+                ticks.append(1)
+                await asyncio.sleep(0)
+
+        async def generate(executor):
+            done = asyncio.Event()
+            tickerTask = asyncio.ensure_future(ticker(done))
+            async with AsyncCommitGenerator(
+                    executor=executor, maxWorkers=2,
+                    maxConcurrency=2) as generator:
+                results = await generator.generateCommitAddresses(requests)
+            done.set()
+            await tickerTask
+            return results
+
+        loop = asyncio.new_event_loop()
+        try:
+            for executor in ["process", "thread"]:
+                del ticks[:]
+                results = loop.run_until_complete(generate(executor))
+                self.assertTrue(ticks, "The event loop must not be blocked.")
+                for i, result in enumerate(results):
+                    self.assertValidCommit(result, UNLOCK_AMOUNT + i)
+        finally:
+            loop.close()
+
+    def test_async_commit_generator_cancel(self):
+        request = (self.fromAddress, self.toAddress, UNLOCK_AMOUNT, b'',
+                   OURGASPRICE, OURGASLIMIT)
+
+        async def generate():
+            async with AsyncCommitGenerator(
+                    executor="thread", maxWorkers=1,
+                    maxConcurrency=1) as generator:
+                tasks = [
+                    asyncio.ensure_future(
+                        generator.generateCommitAddress(*request))
+                    for _ in range(20)
+                ]
+                await asyncio.sleep(0)
+                for task in tasks[1:]:
+                    task.cancel()
+                results = await asyncio.gather(*tasks, return_exceptions=True)
+                # the generator is still usable after cancellations
+                results.append(await generator.generateCommitAddress(*request))
+                return results
+
+        loop = asyncio.new_event_loop()
+        try:
+            results = loop.run_until_complete(generate())
+        finally:
+            loop.close()
+        self.assertValidCommit(results[0], UNLOCK_AMOUNT)
+        self.assertTrue(
+            all(isinstance(r, asyncio.CancelledError) for r in results[1:-1]))
+        self.assertValidCommit(results[-1], UNLOCK_AMOUNT)
+
+    def test_async_commit_generator_cancel_keeps_slot(self):
+        started = threading.Event()
+        finish = threading.Event()
+
+        def running():
+            started.set()
+            finish.wait()
+
+        async def generate(executor):
+            async with AsyncCommitGenerator(executor=executor,
+                                            maxConcurrency=1) as generator:
+                loop = asyncio.get_event_loop()
+                first = asyncio.ensure_future(generator._run(running))
+                await loop.run_in_executor(None, started.wait)
+                first.cancel()
+                # The cancelled job still runs, the next one has to wait for it
+                second = asyncio.ensure_future(generator._run(finish.is_set))
+                await asyncio.sleep(0.05)
+                self.assertFalse(second.done())
+                finish.set()
+                return await second
+
+        executor = ThreadPoolExecutor(max_workers=2)
+        loop = asyncio.new_event_loop()
+        try:
+            self.assertTrue(loop.run_until_complete(generate(executor)))
+        finally:
+            finish.set()
+            loop.close()
+            executor.shutdown()
+
+    def test_commit_server(self):
+        executor = commit_server.startWorkers(2)
+        server = commit_server.createServer(
+            executor, {
+                "from": checksum_encode(self.fromAddress),
+                "target": checksum_encode(self.toAddress),
+                "amount": None,
+                "dappData": "",
+                "gasPrice": OURGASPRICE,
+                "gasLimit": OURGASLIMIT
+            },
+            batchSize=3)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        try:
+            # all requests over the same keep-alive connection
+            connection = http.client.HTTPConnection(*server.server_address)
+            for i in range(3):
+                connection.request("POST", "/commit",
+                                   json.dumps({"id": i, "amount": UNLOCK_AMOUNT + i}))
+                response = connection.getresponse()
+                self.assertEqual(200, response.status)
+                result = json.loads(response.read().decode())
+                self.assertEqual(i, result["id"])
+                self.assertValidCommit((result["addressB"], result["commit"],
+                                        result["witness"], result["unlockTx"]),
+                                       UNLOCK_AMOUNT + i)
+
+            connection.request("POST", "/commit", "\n".join(
+                json.dumps({"amount": UNLOCK_AMOUNT + i}) for i in range(4)))
+            response = connection.getresponse()
+            self.assertEqual(200, response.status)
+            # Two chunks of batchSize 3, answered in order
+            results = [json.loads(line) for line in response.read().decode().splitlines()]
+            self.assertEqual(4, len(results))
+            for i, result in enumerate(results):
+                self.assertValidCommit((result["addressB"], result["commit"],
+                                        result["witness"], result["unlockTx"]),
+                                       UNLOCK_AMOUNT + i)
+
+            connection.request("POST", "/commit", json.dumps({"from": "0x12"}))
+            response = connection.getresponse()
+            self.assertEqual(400, response.status)
+            response.read()
+
+            connection.request("POST", "/commit", json.dumps({"amount": -1}))
+            response = connection.getresponse()
+            self.assertEqual(400, response.status)
+            self.assertIn("error", json.loads(response.read().decode()))
+
+            connection.request("POST", "/commit", json.dumps({"amount": 1.7}))
+            response = connection.getresponse()
+            self.assertEqual(400, response.status)
+            self.assertIn("error", json.loads(response.read().decode()))
+
+            connection.request("GET", "/stats")
+            stats = json.loads(connection.getresponse().read().decode())
+            log.info("Server stats: {}".format(stats))
+            self.assertEqual(7, stats["requests"])
+            self.assertEqual(7, stats["commits"])
+            self.assertEqual(3, stats["errors"])
+            self.assertLessEqual(stats["p50Ms"], stats["p99Ms"])
+            connection.close()
+        finally:
+            server.shutdown()
+            server.server_close()
+            thread.join()
+            executor.shutdown()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -12,6 +12,7 @@ from test_utils import rec_hex, rec_bin, deploy_solidity_contract_with_args, pro
 sys.path.append(
     os.path.join(os.path.dirname(__file__), '..', 'generate_commitment'))
 import generate_submarine_commit
+import submarine_id
 
 sys.path.append(
     os.path.join(os.path.dirname(__file__), '..', 'proveth', 'offchain'))
@@ -874,5 +875,25 @@ class TestLibSubmarineSimple(unittest.TestCase):
                 sender=ALICE_PRIVATE_KEY
             )
 
+    def test_getSubmarineIds_matches_contract(self):
+        requests = [
+            (normalize_address(rec_hex(user)),
+             normalize_address(rec_hex(self.verifier_contract.address)),
+             UNLOCK_AMOUNT + i, os.urandom(dappDataSize), os.urandom(32),
+             OURGASPRICE + i, OURGASLIMIT)
+            for i, (user, dappDataSize) in enumerate(
+                [(t.a1, 0), (t.a2, 1), (t.a3, 31), (t.a1, 32), (t.a2, 33),
+                 (t.a3, 100)])
+        ]
+
+        submarine_ids = submarine_id.getSubmarineIds(requests)
+
+        for request, python_submarine_id in zip(requests, submarine_ids):
+            self.assertEqual(
+                self.verifier_contract.getSubmarineId(*request),
+                python_submarine_id,
+                "getSubmarineIds does not match abi.encodePacked for {} bytes of dappData".
+                format(len(request[3])))
+
 if __name__ == "__main__":
     unittest.main()